@@ -0,0 +1,75 @@
+import os
+import sys
+import hashlib
+from typing import Optional
+
+# The fake provider's latency and failure model is shared with the prescription analyser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "shared"))
+from fake_llm import FakeLatency, FakeProviderError
+
+SPECIALTIES = [
+    "medicine", "orthopedics", "cardiology", "dermatology",
+    "endocrinology", "neurology", "gastroenterology", "pulmonology",
+]
+
+
+class ChatProvider:
+    """A text completion backend for the chatbot: prompt in, reply text out."""
+    name = "base"
+
+    async def complete(self, prompt: str) -> str:
+        raise NotImplementedError
+
+
+class GroqChatProvider(ChatProvider):
+    """Groq through LangChain's ChatGroq."""
+    name = "groq"
+
+    def __init__(self, model: str, api_key: str):
+        from langchain_groq import ChatGroq
+
+        self.llm = ChatGroq(model=model, groq_api_key=api_key)
+
+    async def complete(self, prompt: str) -> str:
+        response = await self.llm.ainvoke(prompt)
+        return response.content
+
+
+class FakeChatProvider(ChatProvider):
+    """Offline stand-in for Groq, for load tests and benchmarks.
+
+    Replies depend only on the prompt: specialty questions get a specialty from the
+    list chosen by a hash of the prompt, anything else a fixed information reply.
+    Latency and failures (FakeProviderError) are simulated by ``FakeLatency`` from the
+    shared fake_llm module.
+    """
+    name = "fake"
+
+    def __init__(self, latency_ms: float, latency_sigma: float, failure_rate: float, seed: Optional[int] = None):
+        self.latency = FakeLatency(latency_ms, latency_sigma, failure_rate, seed)
+
+    async def complete(self, prompt: str) -> str:
+        await self.latency.wait("the chat model")
+        digest = int(hashlib.sha256(prompt.encode()).hexdigest(), 16)
+        if "specialty" in prompt.lower():
+            return SPECIALTIES[digest % len(SPECIALTIES)]
+        return (
+            "This is simulated general health information for offline testing. "
+            "I'm providing general information, not medical advice; please consult a "
+            "healthcare professional about serious concerns."
+        )
+
+
+def create_chat_provider(name: str, model: str, api_key: str) -> ChatProvider:
+    """Build the named provider; the fake one is tuned with FAKE_LLM_* environment variables."""
+    if name == "groq":
+        return GroqChatProvider(model, api_key)
+    if name == "fake":
+        seed = os.getenv("FAKE_LLM_SEED")
+        return FakeChatProvider(
+            float(os.getenv("FAKE_LLM_LATENCY_MS", "300")),
+            float(os.getenv("FAKE_LLM_LATENCY_SIGMA", "0.5")),
+            float(os.getenv("FAKE_LLM_FAILURE_RATE", "0")),
+            int(seed) if seed else None,
+        )
+    raise ValueError(f"Unknown LLM provider '{name}'. Choose one of: groq, fake")
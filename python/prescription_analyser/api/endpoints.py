@@ -1,16 +1,24 @@
-import time
-from io import BytesIO
+import json
 from uuid import uuid4
-from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, BackgroundTasks, status
+from typing import List, Optional
+from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, BackgroundTasks, Query, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import APIKeyHeader
 
 from config import settings, logger
-from models.schemas import PrescriptionResponse, JobStatus, PrescriptionData
-from services.image_processor import validate_image
-from services.ocr_service import extract_text_from_image
-from services.text_processor import correct_text_with_groq, extract_structured_medications
+from models.schemas import PrescriptionResponse, JobStatus, PrescriptionData, TextAnalysisRequest, TextBatchRequest
+from services.analysis_context import AnalysisContext
+from services.image_processor import get_preprocess_profile
+from services.nlp_model import nlp_model_name, nlp_warm
+from services.ocr_engine import EngineBusyError
+from services.llm_client import LLM_CACHE, LLM_CLIENT
+from services.pipeline import RESULT_CACHE, analyze_batch, analyze_image, analyze_text, analyze_texts
+from services.text_processor import extract_structured_medications, get_llm_mode
 from services.prescription_parser import parse_prescription_text
-from utils.job_store import JOB_STORE
+from utils.resilience import deadline_after, deadline_scope
+from utils.job_store import JOB_STORE, follow_job_events, publish_job_event
+from utils.upload import IngestedUpload, UploadTooLargeError, cleanup_uploads, ingest_upload
 
 router = APIRouter()
 
@@ -26,53 +34,96 @@ def verify_api_key(api_key: str = Depends(api_key_header)):
         )
     return api_key
 
+def verify_profile(profile: Optional[str] = Query(None, description="Preprocessing profile: fast, balanced or quality")):
+    """Validate the optional per-request preprocessing profile."""
+    try:
+        get_preprocess_profile(profile)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e),
+        )
+    return profile
+
+def verify_llm_mode(llm_mode: Optional[str] = Query(None, description="LLM pipeline mode: two_pass or single_pass")):
+    """Validate the optional per-request LLM pipeline mode."""
+    try:
+        get_llm_mode(llm_mode)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e),
+        )
+    return llm_mode
+
+async def read_prescription_upload(upload: UploadFile) -> IngestedUpload:
+    """Stream an uploaded image in chunks, rejecting it as soon as it exceeds the size limit."""
+    try:
+        return await ingest_upload(
+            upload,
+            max_bytes=settings.max_image_size_mb * 1024 * 1024,
+            spool_bytes=settings.upload_spool_mb * 1024 * 1024,
+        )
+    except UploadTooLargeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e),
+        )
+
 # Background task for async processing
-def process_prescription_image(job_id: str, image_bytes: BytesIO):
-    """Background task to process prescription image."""
+async def process_prescription_image(
+    job_id: str, upload: IngestedUpload, profile: Optional[str] = None, llm_mode: Optional[str] = None
+):
+    """Background task to process prescription image, publishing an event per stage."""
+    async def on_stage(stage: str, data: dict):
+        await publish_job_event(job_id, stage, data)
+
     try:
-        start_time = time.time()
-        
-        # Validate and extract text
-        validate_image(image_bytes)
-        extracted_text = extract_text_from_image(image_bytes)
-        
-        # AI-Powered Correction
-        corrected_text = correct_text_with_groq(extracted_text) if settings.enable_ai_correction else extracted_text
-        
-        # Extract structured medication data
-        medications = extract_structured_medications(corrected_text)
-        
-        # Parse structured data
-        prescription_details = parse_prescription_text(corrected_text)
-        
-        # Add medications to the response
-        prescription_details.medications = medications
-        
-        processing_time = (time.time() - start_time) * 1000  # Convert to milliseconds
+        # The budget starts when the job runs, not when it was queued
+        deadline = deadline_after(settings.request_deadline_seconds)
+        result = await analyze_image(upload, profile, on_stage, llm_mode, deadline)
         
         # Store result
         JOB_STORE[job_id] = {
             "status": "completed",
-            "result": PrescriptionResponse(
-                success=True,
-                raw_text=extracted_text,
-                corrected_text=corrected_text,
-                parsed_data=prescription_details,
-                medications=medications,
-                processing_time_ms=processing_time
-            )
+            "result": result
         }
-        logger.info(f"Job {job_id} completed successfully in {processing_time:.2f}ms")
+        await publish_job_event(job_id, "completed", result)
+        logger.info(f"Job {job_id} completed successfully in {result.processing_time_ms:.2f}ms")
         
     except Exception as e:
         logger.error(f"Job {job_id} failed: {e}")
+        result = PrescriptionResponse(
+            success=False,
+            error=str(e)
+        )
         JOB_STORE[job_id] = {
             "status": "failed",
-            "result": PrescriptionResponse(
-                success=False,
-                error=str(e)
-            )
+            "result": result
         }
+        await publish_job_event(job_id, "failed", result)
+
+class UploadStreamingResponse(StreamingResponse):
+    """StreamingResponse that closes its body and deletes the uploads behind it when it ends.
+
+    Runs however the response ends, including a client that disconnects before the
+    first byte, where Starlette skips background tasks and never starts the body.
+    """
+
+    def __init__(self, content, uploads: List[IngestedUpload], **kwargs):
+        super().__init__(content, **kwargs)
+        self.uploads = uploads
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+            cleanup_uploads(self.uploads)
+
+def format_sse(event: str, data) -> str:
+    """Encode one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
 
 @router.get("/", tags=["Info"])
 async def root():
@@ -86,43 +137,22 @@ async def root():
 @router.post("/analyze-prescription/", response_model=PrescriptionResponse, tags=["Prescriptions"])
 async def analyze_prescription(
     prescription: UploadFile = File(...),
+    profile: Optional[str] = Depends(verify_profile),
+    llm_mode: Optional[str] = Depends(verify_llm_mode),
     api_key: str = Depends(verify_api_key)
 ):
     """Synchronously analyze a prescription image."""
+    deadline = deadline_after(settings.request_deadline_seconds)
+    upload = await read_prescription_upload(prescription)
     try:
-        start_time = time.time()
-        
-        # Read and validate image
-        image_bytes = BytesIO(await prescription.read())
-        validate_image(image_bytes)
-        
-        # Extract text
-        extracted_text = extract_text_from_image(image_bytes)
-        
-        # AI-Powered Correction
-        corrected_text = correct_text_with_groq(extracted_text) if settings.enable_ai_correction else extracted_text
-        
-        # Extract structured medication data
-        medications = extract_structured_medications(corrected_text)
-        
-        # Parse structured data
-        prescription_details = parse_prescription_text(corrected_text)
-        
-        # Add medications to the response
-        prescription_details.medications = medications
-        
-        processing_time = (time.time() - start_time) * 1000  # Convert to milliseconds
-        logger.info(f"Processed prescription in {processing_time:.2f}ms")
+        return await analyze_image(upload, profile, llm_mode=llm_mode, deadline=deadline)
         
-        return PrescriptionResponse(
-            success=True,
-            raw_text=extracted_text,
-            corrected_text=corrected_text,
-            parsed_data=prescription_details,
-            medications=medications,
-            processing_time_ms=processing_time
+    except EngineBusyError as e:
+        logger.warning(f"Rejected prescription analysis: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
         )
-        
     except Exception as e:
         logger.error(f"Prescription analysis failed: {e}")
         raise HTTPException(
@@ -130,25 +160,114 @@ async def analyze_prescription(
             detail=str(e)
         )
 
+@router.post("/analyze-prescriptions/batch", tags=["Prescriptions"])
+async def analyze_prescriptions_batch(
+    prescriptions: List[UploadFile] = File(...),
+    profile: Optional[str] = Depends(verify_profile),
+    llm_mode: Optional[str] = Depends(verify_llm_mode),
+    api_key: str = Depends(verify_api_key)
+):
+    """Analyze many prescription images, streaming one NDJSON PrescriptionResponse per image.
+
+    Lines are written in completion order; match them to uploads by ``filename``.
+    """
+    if len(prescriptions) > settings.batch_max_files:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch has {len(prescriptions)} files; the limit is {settings.batch_max_files}"
+        )
+
+    # Read every file before streaming starts; the multipart files are closed afterwards
+    uploads, rejected = [], []
+    try:
+        for prescription in prescriptions:
+            try:
+                uploads.append(await read_prescription_upload(prescription))
+            except HTTPException as e:
+                rejected.append(PrescriptionResponse(success=False, filename=prescription.filename, error=e.detail))
+    except BaseException:
+        cleanup_uploads(uploads)
+        raise
+
+    async def stream_results():
+        results = analyze_batch(
+            uploads, profile, settings.batch_concurrency, llm_mode, settings.request_deadline_seconds
+        )
+        try:
+            for response in rejected:
+                yield response.model_dump_json() + "\n"
+            async for response in results:
+                yield response.model_dump_json() + "\n"
+        finally:
+            await results.aclose()  # Cancels the images still in flight
+
+    logger.info(f"Started batch of {len(uploads)} prescriptions ({len(rejected)} rejected)")
+    return UploadStreamingResponse(stream_results(), uploads, media_type="application/x-ndjson")
+
+@router.post("/analyze-text/", response_model=PrescriptionResponse, tags=["Prescriptions"])
+async def analyze_prescription_text(
+    request: TextAnalysisRequest,
+    llm_mode: Optional[str] = Depends(verify_llm_mode),
+    api_key: str = Depends(verify_api_key)
+):
+    """Analyze prescription text directly: correction and parsing, without image validation or OCR."""
+    deadline = deadline_after(settings.request_deadline_seconds)
+    try:
+        return await analyze_text(request.text, llm_mode, deadline)
+
+    except Exception as e:
+        logger.error(f"Prescription text analysis failed: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+@router.post("/analyze-texts/", response_model=List[PrescriptionResponse], tags=["Prescriptions"])
+async def analyze_prescription_texts(
+    request: TextBatchRequest,
+    llm_mode: Optional[str] = Depends(verify_llm_mode),
+    api_key: str = Depends(verify_api_key)
+):
+    """Analyze many prescription texts, returning one PrescriptionResponse per text in request order.
+
+    Texts likely to need NER are parsed in one ``nlp.pipe`` batch. A text that fails gets an
+    error response; the others are still analyzed.
+    """
+    if len(request.texts) > settings.batch_max_texts:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch has {len(request.texts)} texts; the limit is {settings.batch_max_texts}"
+        )
+    deadline = deadline_after(settings.request_deadline_seconds)
+    try:
+        return await analyze_texts(request.texts, llm_mode, deadline)
+
+    except Exception as e:
+        logger.error(f"Prescription text batch analysis failed: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
 @router.post("/analyze-prescription-async/", response_model=JobStatus, tags=["Prescriptions"])
 async def analyze_prescription_async(
     background_tasks: BackgroundTasks,
     prescription_image: UploadFile = File(...),
+    profile: Optional[str] = Depends(verify_profile),
+    llm_mode: Optional[str] = Depends(verify_llm_mode),
     api_key: str = Depends(verify_api_key)
 ):
     """Asynchronously analyze a prescription image."""
+    upload = await read_prescription_upload(prescription_image)
     try:
         # Generate job ID
         job_id = str(uuid4())
         
-        # Store image data
-        image_bytes = BytesIO(await prescription_image.read())
-        
         # Create job entry
         JOB_STORE[job_id] = {"status": "processing"}
         
         # Start background processing
-        background_tasks.add_task(process_prescription_image, job_id, image_bytes)
+        background_tasks.add_task(process_prescription_image, job_id, upload, profile, llm_mode)
         
         logger.info(f"Started async job {job_id}")
         return JobStatus(job_id=job_id, status="processing")
@@ -176,6 +295,33 @@ async def get_job_status(job_id: str, api_key: str = Depends(verify_api_key)):
         result=job_info.get("result")
     )
 
+@router.get("/job-events/{job_id}", tags=["Jobs"])
+async def stream_job_events(job_id: str, api_key: str = Depends(verify_api_key)):
+    """Stream an async job's stage events as server-sent events.
+
+    Events are validated, raw_text, corrected_text, medications and parsed_data as each
+    stage finishes, then completed (the full PrescriptionResponse) or failed. Events
+    already published are replayed first, so subscribing late loses nothing.
+    """
+    if job_id not in JOB_STORE:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Job with ID {job_id} not found"
+        )
+
+    async def event_stream():
+        async for event in follow_job_events(job_id, settings.job_events_heartbeat_seconds):
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield format_sse(*event)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.get("/test-prescription/", response_model=PrescriptionResponse, tags=["Testing"])
 async def test_prescription(api_key: str = Depends(verify_api_key)):
     """Test with a sample prescription."""
@@ -199,10 +345,12 @@ async def test_prescription(api_key: str = Depends(verify_api_key)):
     corrected_text = sample_text
     
     # Extract structured medication data
-    medications = extract_structured_medications(corrected_text)
+    context = AnalysisContext(corrected_text)
+    with deadline_scope(deadline_after(settings.request_deadline_seconds)):
+        medications, _ = await extract_structured_medications(corrected_text, context)
     
     # Parse data
-    parsed_data = parse_prescription_text(corrected_text)
+    parsed_data = parse_prescription_text(corrected_text, context)
     
     # Add medications to the response
     parsed_data.medications = medications
@@ -215,7 +363,25 @@ async def test_prescription(api_key: str = Depends(verify_api_key)):
         medications=medications
     )
 
+@router.get("/cache-stats", tags=["Info"])
+async def cache_stats(api_key: str = Depends(verify_api_key)):
+    """Hit/miss counters of this process's result and LLM caches, and coalesced LLM calls."""
+    return {
+        "result_cache": RESULT_CACHE.stats() if settings.result_cache_enabled else None,
+        "llm_cache": LLM_CACHE.stats() if LLM_CACHE is not None else None,
+        "llm_in_flight": LLM_CLIENT.inflight_stats(),
+    }
+
 @router.get("/health", tags=["Info"])
 async def health_check():
-    """Health check endpoint."""
-    return {"status": "healthy"}
\ No newline at end of file
+    """Health check endpoint. Also reports whether LLM calls are currently short-circuited."""
+    return {"status": "healthy", "llm_circuit": LLM_CLIENT.breaker.state}
+
+@router.get("/ready", tags=["Info"])
+async def readiness_check():
+    """Readiness probe: 503 until the spaCy model has been warmed up (when warmup is enabled)."""
+    ready = nlp_warm() or not settings.nlp_warmup
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "ready" if ready else "warming_up", "nlp_model": nlp_model_name()},
+    )
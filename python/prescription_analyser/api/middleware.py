@@ -0,0 +1,44 @@
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+
+
+class RequestSizeLimitMiddleware:
+    """Reject request bodies larger than ``max_bytes`` before they are fully received.
+
+    Requests that declare a larger Content-Length are refused without reading the body;
+    chunked bodies are cut off as soon as the running total passes the limit.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = JSONResponse(
+                {"detail": f"Request body exceeds the {self.max_bytes // (1024 * 1024)}MB limit"},
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"Request body exceeds the {self.max_bytes // (1024 * 1024)}MB limit",
+                    )
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Offline load test of the LLM text stages (correction, extraction, parsing).
+Runs prescriptions through process_extracted_text against the fake LLM provider
+and reports throughput and latency percentiles, so concurrency limits, retries,
+deadlines and the caches can be measured without network access.
+
+Usage: python benchmarks/llm_pipeline_load.py [--requests 200] [--concurrency 20]
+       [--latency-ms 300] [--sigma 0.5] [--failure-rate 0.0] [--distinct 50] [--mode two_pass]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+# Make the application modules importable when run from any directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.llm_client import LLM_CLIENT
+from services.llm_providers import FakeLLMProvider
+from services.pipeline import process_extracted_text
+from utils.resilience import deadline_after, deadline_scope
+from config import settings
+
+# OCR-like prescriptions with misspelt medication names
+SAMPLE_LINES = [
+    "Paracetmol 500 mg tablet every 8 hours for 5 days",
+    "Amoxicilin 250 mg capsule three times daily after meals",
+    "Metfornin 500 mg twice daily with food",
+    "Ibuprofin 400 mg when required for pain",
+    "Omeprazol 20 mg once daily before breakfast",
+]
+
+
+def make_prescription(i):
+    """A distinct two-medication prescription for each i."""
+    first, second = SAMPLE_LINES[i % len(SAMPLE_LINES)], SAMPLE_LINES[(i // len(SAMPLE_LINES)) % len(SAMPLE_LINES)]
+    return f"Dr. A. Rao\nPatient: Test {i}\nRx:\n1. {first}\n2. {second}\n"
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+async def run(args):
+    LLM_CLIENT.provider = FakeLLMProvider(args.latency_ms, args.sigma, args.failure_rate, seed=args.seed)
+    if LLM_CLIENT.cache is not None and not args.keep_cache:
+        LLM_CLIENT.cache.clear()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, failures = [], 0
+
+    async def one(i):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            with deadline_scope(deadline_after(settings.request_deadline_seconds)):
+                _, _, medications, _, _ = await process_extracted_text(make_prescription(i % args.distinct), llm_mode=args.mode)
+            latencies.append((time.perf_counter() - start) * 1000)
+            failures += not medications
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.requests} requests, {args.distinct} distinct, concurrency {args.concurrency}, mode {args.mode}")
+    print(f"fake latency median {args.latency_ms}ms sigma {args.sigma}, failure rate {args.failure_rate}")
+    print(f"throughput: {args.requests / elapsed:.1f} req/s")
+    print(f"latency ms: p50 {percentile(latencies, 50):.1f}  p95 {percentile(latencies, 95):.1f}  "
+          f"p99 {percentile(latencies, 99):.1f}  max {max(latencies):.1f}")
+    print(f"without medications: {failures}")
+    print(f"llm cache: {LLM_CLIENT.cache.stats() if LLM_CLIENT.cache is not None else None}")
+    print(f"in flight: {LLM_CLIENT.inflight_stats()}, circuit: {LLM_CLIENT.breaker.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="Prescriptions to process")
+    parser.add_argument("--concurrency", type=int, default=20, help="Prescriptions processed at once")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Median fake LLM latency")
+    parser.add_argument("--sigma", type=float, default=0.5, help="Log-normal latency spread")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of fake LLM calls that fail")
+    parser.add_argument("--distinct", type=int, default=50, help="Distinct prescriptions (repeats hit the cache)")
+    parser.add_argument("--mode", default="two_pass", help="LLM pipeline mode: two_pass or single_pass")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for fake latencies and failures")
+    parser.add_argument("--keep-cache", action="store_true", help="Do not clear the LLM cache first")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark of medication name matching on a large formulary.
+Builds a synthetic formulary (100k names by default, including the real ones), then
+compares scoring every name (the previous linear process.extractOne scan) with the
+trigram-indexed MedicationMatcher on misspelt queries: per-query latency and how
+often both find a name with the same best score. First checks that on the real
+formulary the matcher returns exactly what fuzzywuzzy's process.extractOne did before
+it (misspelt names, and every line of the parser golden corpus); exits 1 if not.
+
+Usage: python benchmarks/med_matcher.py [--names 100000] [--queries 500] [--linear-queries 20]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+# Make the application modules importable when run from any directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fuzzywuzzy import process
+from config import settings
+from db.formulary import FORMULARY
+from services.med_matcher import MedicationMatcher, normalize_name
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "parser_golden.jsonl")
+
+# Queries whose scores once differed between scorer libraries
+BASELINE_QUERIES = [
+    "Metformin Hydrochloride 1000 g Take three times per day Insulin Glargine",
+    "Paracetamo1", "0meprazole", "Amoxicilin", "Insulin Glargine",
+]
+
+SYLLABLES = ["ab", "ac", "al", "am", "ar", "ax", "ba", "ce", "ci", "da", "do", "el", "en", "fen", "gli",
+             "ide", "in", "ol", "on", "pra", "pro", "ra", "ril", "sar", "ta", "tin", "to", "va", "xo", "zol"]
+SUFFIXES = ["mab", "pril", "sartan", "statin", "olol", "azole", "mycin", "cillin", "dipine", "tide", "vir", "one"]
+
+
+def make_formulary(size, seed=0):
+    """Real names plus pronounceable synthetic generic and brand names."""
+    rng = random.Random(seed)
+    names = set(FORMULARY.names())
+    while len(names) < size:
+        stem = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        names.add((stem + rng.choice(SUFFIXES)).capitalize())
+    return sorted(names)
+
+
+def misspell(name, rng):
+    """One or two OCR-style edits: dropped, doubled or substituted letters."""
+    chars = list(name)
+    for _ in range(rng.randint(1, 2)):
+        i = rng.randrange(len(chars))
+        edit = rng.choice(("drop", "double", "substitute"))
+        if edit == "drop" and len(chars) > 4:
+            del chars[i]
+        elif edit == "double":
+            chars.insert(i, chars[i])
+        else:
+            chars[i] = rng.choice("aeilnorst")
+    return "".join(chars)
+
+
+def baseline_mismatches(rng, size=500):
+    """Queries where the matcher over the real formulary disagrees with a plain process.extractOne."""
+    names = FORMULARY.names()
+    queries = BASELINE_QUERIES + [misspell(rng.choice(names), rng) for _ in range(size)]
+    with open(GOLDEN_PATH, encoding="utf-8") as f:
+        queries += [line for case in map(json.loads, f) for line in case["text"].splitlines()]
+    # Queries with no letters or digits (blank lines) match nothing either way
+    queries = [query for query in dict.fromkeys(queries) if normalize_name(query)]
+    matcher = MedicationMatcher(names, settings.medication_match_candidates)
+    mismatches = []
+    for query in queries:
+        expected, found = process.extractOne(query, names), matcher.extract_one(query)
+        if found != expected:
+            mismatches.append((query, expected, found))
+    return len(queries), mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--names", type=int, default=100_000, help="Formulary size")
+    parser.add_argument("--queries", type=int, default=500, help="Misspelt queries for the indexed matcher")
+    parser.add_argument("--linear-queries", type=int, default=20, help="Queries also run through the linear scan")
+    parser.add_argument("--candidates", type=int, default=settings.medication_match_candidates,
+                        help="Names scored per indexed lookup")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    checked, mismatches = baseline_mismatches(rng)
+    print(f"same match and score as process.extractOne on the formulary: {checked - len(mismatches)}/{checked}")
+    for query, expected, found in mismatches[:5]:
+        print(f"  {query!r}: expected {expected}, got {found}")
+
+    names = make_formulary(args.names)
+    queries = [misspell(rng.choice(names), rng) for _ in range(args.queries)]
+    print(f"{len(names)} names, {args.queries} queries")
+
+    start = time.perf_counter()
+    matcher = MedicationMatcher(names, args.candidates)
+    print(f"index build: {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        matcher.correct(query)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(f"indexed: mean {sum(timings) / len(timings):.2f}ms  p50 {timings[len(timings) // 2]:.2f}ms  "
+          f"p99 {timings[min(len(timings) - 1, int(len(timings) * 0.99))]:.2f}ms")
+
+    # Without a candidate limit every name is scored, as the linear scan did
+    linear_matcher = MedicationMatcher(names, max_candidates=len(names))
+    linear_queries = queries[:args.linear_queries]
+    start = time.perf_counter()
+    linear = [linear_matcher.extract_one(query) for query in linear_queries]
+    linear_ms = (time.perf_counter() - start) * 1000 / max(1, len(linear_queries))
+    agree = sum(full[1] == matcher.extract_one(query)[1] for query, full in zip(linear_queries, linear))
+    print(f"linear:  mean {linear_ms:.2f}ms over {len(linear_queries)} queries")
+    print(f"same best score as the linear scan: {agree}/{len(linear_queries)}")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
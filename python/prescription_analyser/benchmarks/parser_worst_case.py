@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Worst-case latency of the rule-based text stages on adversarial input.
+For each text length, times parse_prescription_text and extract_medications_with_rules
+on crafted inputs that make backtracking regexes blow up (repeated field words in
+long runs without punctuation, digit and separator runs, unclosed parentheses) and
+on random fuzz built from field words and punctuation, then reports the slowest
+case per length. With linear-time patterns the worst time per character stays
+roughly flat as the length grows; a backtracking blow-up shows as a per-character
+time that climbs with it. Docs come from a blank spaCy pipeline, so NER is not timed.
+Texts longer than settings.max_text_chars are cut to it, as in the pipeline.
+
+Usage: python benchmarks/parser_worst_case.py [--lengths 1000,2000,5000,10000,20000] [--fuzz 20]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+# Make the application modules importable when run from any directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import spacy
+from services.analysis_context import AnalysisContext
+from services.prescription_parser import parse_prescription_text
+from services.text_processor import extract_medications_with_rules
+
+FUZZ_PIECES = [
+    "Dr", "dr.", "Doctor:", "Physician:", "SIGNATURE", "Signa:", "Bottle", "DATE", "Date:", "Patient", "Pt:", "Name:",
+    "FOR", "For:", "(", ")", "(Patient's name)", "Hospital", "Clinic", "Medical", "Notes:", "(Corrected medication name)",
+    "every", "times", "day", "TID", "QD", "Take", "once", "mg", "ml", "tablet", "1", "12", "500", "2025", "/", "-",
+    ".", ",", ":", " ", "\n", "a", "Paracetamol", "Metformin", "x",
+]
+
+
+def repeat_to(unit, length):
+    """``unit`` repeated to exactly ``length`` characters."""
+    return (unit * (length // len(unit) + 1))[:length]
+
+
+ADVERSARIAL = {
+    "repeated field words": lambda n: repeat_to("dr patient for sign ", n),
+    "facility word, no hospital": lambda n: "Medical " + repeat_to("ward a ", n - 8),
+    "numbered list, no units": lambda n: repeat_to("1 a ", n),
+    "digit run": lambda n: "7" * n,
+    "digits and spaces": lambda n: repeat_to("7 ", n),
+    "date separators": lambda n: "1" + repeat_to("/-", n - 1),
+    "unclosed parentheses": lambda n: repeat_to("for (a ", n),
+    "signature tail": lambda n: repeat_to("Signature Dr ab. ", n) + ",",
+    "notes tail": lambda n: repeat_to("Notes: a, ", n) + "!",
+    "dosage lines": lambda n: repeat_to("1. a 5 mg b\n", n),
+}
+
+
+def fuzz_text(rng, length):
+    """Random text from field words and punctuation."""
+    parts, size = [], 0
+    while size < length:
+        piece = rng.choice(FUZZ_PIECES) + rng.choice(["", " ", " ", ", "])
+        parts.append(piece)
+        size += len(piece)
+    return "".join(parts)[:length]
+
+
+def time_text(text, blank):
+    """Seconds to parse the text and run the rule-based medication extraction."""
+    context = AnalysisContext(text)
+    context._doc = blank(context.text)
+    start = time.perf_counter()
+    parse_prescription_text(text, context)
+    extract_medications_with_rules(text, context)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lengths", default="1000,2000,5000,10000,20000", help="Comma-separated text lengths")
+    parser.add_argument("--fuzz", type=int, default=20, help="Random fuzz texts per length")
+    args = parser.parse_args()
+
+    blank = spacy.blank("en")
+    rng = random.Random(0)
+    for length in (int(value) for value in args.lengths.split(",")):
+        cases = [(name, make(length)) for name, make in ADVERSARIAL.items()]
+        cases += [("fuzz", fuzz_text(rng, length)) for _ in range(args.fuzz)]
+        timings = sorted(((time_text(text, blank), name) for name, text in cases), reverse=True)
+        worst, name = timings[0]
+        print(f"{length:>7} chars: worst {worst * 1000:8.1f}ms  {worst / length * 1e6:6.1f}us per char  ({name})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark for image preprocessing.
+Compares peak Python-visible allocation per megapixel of the previous float64
+preprocessing tail against the buffer-pooled uint8 pipeline.
+
+Usage: python benchmarks/preprocess_memory.py [--profile fast] [--runs 5]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+import cv2
+import numpy as np
+
+# Make the application modules importable when run from any directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.image_processor import (
+    BufferPool, DecodedImage, MAX_UPSCALE, get_preprocess_profile, preprocess_decoded
+)
+
+# A4 at 300 dpi, a phone photo and a small low-resolution scan
+PAGE_SIZES = [
+    ((3508, 2480), 300.0),
+    ((4032, 3024), 488.0),
+    ((1200, 850), 100.0),
+]
+
+
+def make_page(shape, seed=0):
+    """Synthetic prescription page: text lines on a noisy background."""
+    rng = np.random.default_rng(seed)
+    page = np.full(shape, 225, np.uint8)
+    line_height = max(20, shape[0] // 40)
+    for y in range(line_height * 2, shape[0] - line_height, line_height):
+        cv2.putText(page, "Amoxicillin 250 mg capsule three times daily", (line_height, y),
+                    cv2.FONT_HERSHEY_SIMPLEX, line_height / 40, 0, max(1, line_height // 15))
+    return cv2.add(page, rng.integers(0, 25, shape, dtype=np.uint8))
+
+
+def legacy_preprocess(decoded, profile):
+    """The preprocessing pipeline before buffer pooling (float64 contrast stretch, 1x1 closing)."""
+    stage_profile = get_preprocess_profile(profile)
+    img_np = decoded.gray
+    scale = stage_profile["target_dpi"] / decoded.dpi
+    if not (scale > 1 and not stage_profile["upscale"]):
+        scale = min(scale, MAX_UPSCALE)
+        if abs(scale - 1) >= 0.1:
+            interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+            img_np = cv2.resize(img_np, None, fx=scale, fy=scale, interpolation=interpolation)
+    if stage_profile["denoise"] == "median":
+        img_np = cv2.medianBlur(img_np, stage_profile["median_ksize"])
+    else:
+        img_np = cv2.fastNlMeansDenoising(
+            img_np, None, stage_profile["nlm_h"], stage_profile["nlm_template"], stage_profile["nlm_search"]
+        )
+    img_np = cv2.adaptiveThreshold(img_np, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 2)
+    img_np = cv2.morphologyEx(img_np, cv2.MORPH_CLOSE, np.ones((1, 1), np.uint8))
+    p2, p98 = np.percentile(img_np, (2, 98))
+    if p98 <= p2:
+        return img_np
+    img_np = np.clip(img_np, p2, p98)
+    return ((img_np - p2) / (p98 - p2) * 255).astype(np.uint8)
+
+
+def measure(fn, runs):
+    """Peak traced allocation (bytes) and mean wall time (ms) over steady-state runs."""
+    fn()  # Warm-up: first-call allocations (and pool growth) are not steady state
+    peak = 0
+    start = time.perf_counter()
+    for _ in range(runs):
+        tracemalloc.start()
+        fn()
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return peak, (time.perf_counter() - start) * 1000 / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--profile", default="fast", help="Preprocessing profile to run")
+    parser.add_argument("--runs", type=int, default=5, help="Measured runs per page size")
+    args = parser.parse_args()
+
+    print(f"Profile: {args.profile}, {args.runs} runs per page (peak traced bytes per source megapixel)")
+    print(f"{'page':>12} {'legacy MB/MP':>13} {'pooled MB/MP':>13} {'legacy ms':>10} {'pooled ms':>10}")
+    for shape, dpi in PAGE_SIZES:
+        decoded = DecodedImage(make_page(shape), dpi)
+        megapixels = shape[0] * shape[1] / 1e6
+        pool = BufferPool()
+
+        legacy_peak, legacy_ms = measure(lambda: legacy_preprocess(decoded, args.profile), args.runs)
+        pooled_peak, pooled_ms = measure(lambda: preprocess_decoded(decoded, args.profile, pool), args.runs)
+        print(f"{shape[1]:>5}x{shape[0]:<6} {legacy_peak / 1e6 / megapixels:>13.3f} "
+              f"{pooled_peak / 1e6 / megapixels:>13.3f} {legacy_ms:>10.1f} {pooled_ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Golden-corpus check and benchmark of prescription_parser field extraction.
+Parses a fixed corpus of prescription texts, fails if any result differs from the
+recorded golden output, and reports the per-prescription parse time. Docs come from
+a blank spaCy pipeline, so the NER fallback finds nothing and the results do not
+depend on which model is installed.
+
+The golden file holds the output of the parser as it was before the field lexer
+(one regex search per field over the whole text), in the environment pinned by
+requirements.txt (fuzzywuzzy with python-Levenshtein scoring medication names).
+Re-record it only with a parser whose output is meant to be the reference.
+
+Usage: python benchmarks/prescription_parser.py [--repeat 20] [--golden PATH]
+       python benchmarks/prescription_parser.py --record [--size 250]   (rewrite the golden file)
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+# Make the application modules importable when run from any directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import spacy
+from services.analysis_context import AnalysisContext
+from services.prescription_parser import parse_prescription_text
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "parser_golden.jsonl")
+
+HEADERS = [
+    "Dr. J. Smith\nGeneral Hospital\nDate: 12 Feb 2025\nPatient: John Doe\n",
+    "City Clinic\nDr Anna Lee,\nDATE 03/04/2024\n(Patient's name) Mary Major, US Army\n",
+    "Physician: Bob Ray.\nSt Mary Medical Center\nName: Jane Roe,\n",
+    "MEDICAL FACILITY\nDoctor: K. Nair, 14 Hill Road\nFOR (outpatient) Sam Lee, age 40\n",
+    "Prescribed for: Ali Khan.\nSIGNED BY Dr. P. Das\n",
+    "Pt: Rosa Diaz, 1 Bottle Street\nSignature Dr Ortiz\n",
+    "Address: 22 Drury Lane, Riverside Hospital wing\n",
+    "",
+]
+MEDICATIONS = [
+    "Paracetamol", "Amoxicillin", "Metformin", "Atorvastatin", "Paracetamo1", "0meprazole", "Lisinopril",
+    "Ibuprofen", "Amoxicilin", "Insulin Glargine", "Cetirizine", "Metformin Hydrochloride",
+]
+FREQUENCIES = [
+    "twice daily", "BID", "every 8 hours", "3 times a day", "TID after meals", "once daily at night", "QD",
+    "before meals", "with meals in the morning", "Take twice a day", "Take three times per day", "QID", "",
+]
+UNITS = ["mg", "mcg", "ml", "g", "tablet", "capsule", "pill"]
+NOTES = [
+    "Notes: Drink plenty of fluids. Return if symptoms persist.",
+    "Instructions: avoid alcohol; take with water",
+    "Signa: 1 tab po",
+    "Directions: as directed",
+]
+
+
+def make_corpus(size, seed=0):
+    """Synthetic prescriptions: varied headers, medication line styles, frequencies and notes."""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        lines = [rng.choice(HEADERS)]
+        for i in range(rng.randint(0, 4)):
+            name, frequency = rng.choice(MEDICATIONS), rng.choice(FREQUENCIES)
+            dosage = f"{rng.choice([5, 10, 250, 500, 0.5, 1000])} {rng.choice(UNITS)}"
+            style = rng.randint(0, 5)
+            if style == 0:
+                lines.append(f"{i + 1}. {name} {dosage} {frequency}")
+            elif style == 1:
+                lines.append(f"{name}  {dosage}\n   Take {frequency}")
+            elif style == 2:
+                lines.append(f"(Corrected medication name) {name} {dosage} {frequency}")
+            elif style == 3:
+                lines.append(f"Rx {name} {frequency} for hypertension and diabetes")
+            elif style == 4:
+                lines.append(f"• {name}\t{dosage}, {frequency}")
+            else:
+                lines.append(f"{name} {dosage}. {frequency}. Refill x{rng.randint(1, 3)}")
+        if rng.random() < 0.6:
+            lines.append(rng.choice(NOTES))
+        corpus.append("\n".join(lines))
+    return corpus
+
+
+def parse(text, blank):
+    """Parse as the pipeline does, with a Doc that has no entities."""
+    context = AnalysisContext(text)
+    context._doc = blank(context.text)
+    return parse_prescription_text(text, context).model_dump()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--golden", default=GOLDEN_PATH, help="Golden corpus file (JSON lines)")
+    parser.add_argument("--record", action="store_true", help="Rewrite the golden file from the current parser")
+    parser.add_argument("--size", type=int, default=250, help="Prescriptions generated when recording")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed passes over the corpus")
+    args = parser.parse_args()
+
+    blank = spacy.blank("en")
+    if args.record:
+        os.makedirs(os.path.dirname(args.golden), exist_ok=True)
+        with open(args.golden, "w", encoding="utf-8") as f:
+            for text in make_corpus(args.size):
+                f.write(json.dumps({"text": text, "parsed": parse(text, blank)}, ensure_ascii=False) + "\n")
+        print(f"Recorded {args.size} prescriptions to {args.golden}")
+        return
+
+    with open(args.golden, encoding="utf-8") as f:
+        golden = [json.loads(line) for line in f]
+    mismatches = [case for case in golden if parse(case["text"], blank) != case["parsed"]]
+    print(f"golden corpus: {len(golden) - len(mismatches)}/{len(golden)} match")
+    for case in mismatches[:5]:
+        print(f"  mismatch: {case['text']!r}")
+
+    # Contexts and Docs are built outside the timed loop; only parsing is measured
+    contexts = []
+    for case in golden:
+        context = AnalysisContext(case["text"])
+        context._doc = blank(context.text)
+        contexts.append(context)
+    timings = []
+    for _ in range(args.repeat):
+        for case, context in zip(golden, contexts):
+            start = time.perf_counter()
+            parse_prescription_text(case["text"], context)
+            timings.append((time.perf_counter() - start) * 1e6)
+    timings.sort()
+    print(f"parse: mean {sum(timings) / len(timings):.0f}us  p50 {timings[len(timings) // 2]:.0f}us  "
+          f"p99 {timings[min(len(timings) - 1, int(len(timings) * 0.99))]:.0f}us per prescription")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import os
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 
@@ -7,12 +9,69 @@ class Settings(BaseSettings):
     api_key: str = "dev_key"  # API key for securing endpoints
     ocr_config: str = "--oem 3 --psm 6"
     tesseract_path: str = r"C:\Program Files\Tesseract-OCR\tesseract.exe"  # Path to Tesseract executable
+    ocr_backend: str = "auto"  # auto (tesserocr if installed), tesserocr or pytesseract
+    layout_analysis: bool = True  # OCR only detected text blocks instead of the whole page
+    layout_detect_orientation: bool = True  # Correct 90/180/270 degree page rotation (needs tesserocr and osd.traineddata)
+    layout_threads: int = 2  # Threads per OCR worker recognising text blocks in parallel
     fuzzy_match_threshold: int = 80
+    medication_match_candidates: int = 256  # Formulary names scored per lookup, picked by shared trigrams
+    formulary_path: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db", "formulary.bin")  # Compiled, memory-mapped formulary
+    formulary_source_path: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db", "formulary.csv")
+    formulary_reload_seconds: float = 5.0  # How often to check the formulary files for changes
+    nlp_model: str = "en_core_sci_sm"  # spaCy model behind the NER fallback
+    nlp_fallback_model: str = "en_core_web_sm"  # Used when nlp_model is not installed
+    nlp_exclude: str = "tagger,parser,attribute_ruler,lemmatizer,senter"  # Components not loaded (comma-separated)
+    nlp_batch_size: int = 64  # Texts per nlp.pipe batch when many are analysed together
+    nlp_warmup: bool = True  # Load the model in the background at startup; /ready reports when it is done
+    nlp_preload: bool = False  # Load the model when main is imported, so `gunicorn --preload` workers share it
     enable_ai_correction: bool = True
+    correction_gate_enabled: bool = True  # Skip or narrow AI correction when OCR confidence is high
+    correction_gate_mean_confidence: float = 90.0  # Mean word confidence needed to skip correction
+    correction_gate_min_confidence: float = 60.0  # Words below this are low-confidence
+    correction_gate_fuzzy_score: int = 100  # Words resembling a formulary name must match it this well to skip
+    correction_gate_spans: bool = True  # Correct only low-confidence fragments when there are few of them
+    correction_gate_max_span_fraction: float = 0.2  # Max share of low-confidence words for fragment correction
+    llm_pipeline_mode: str = "two_pass"  # two_pass (correct, then extract) or single_pass (one combined call)
+    llm_provider: str = "groq"  # groq, or fake for offline load tests (simulated replies)
+    fake_llm_latency_ms: float = 300.0  # Median simulated latency of the fake provider
+    fake_llm_latency_sigma: float = 0.5  # Spread of the log-normal latency; larger means a longer tail
+    fake_llm_failure_rate: float = 0.0  # Share of fake calls that fail
+    fake_llm_seed: Optional[int] = None  # Seed for repeatable fake latencies and failures
+    llm_max_connections: int = 20  # Keep-alive HTTP connections to the Groq API
+    llm_max_concurrency: int = 8  # LLM requests in flight per process
+    llm_timeout_seconds: float = 30.0
+    llm_retry_base_delay: float = 1.0  # Backoff before the first retry; doubles each attempt, with jitter
+    request_deadline_seconds: float = 20.0  # Time budget per image; LLM stages past it fall back to rules (0 = none)
+    llm_breaker_failure_threshold: int = 5  # Consecutive Groq failures that open the circuit
+    llm_breaker_reset_seconds: float = 30.0  # How long an open circuit skips the LLM before a trial call
+    llm_cache_enabled: bool = True  # Reuse LLM replies for repeated (normalised) OCR text
+    llm_cache_ttl_seconds: int = 30 * 24 * 3600
+    llm_cache_memory_entries: int = 1024
+    llm_cache_max_disk_mb: int = 256
     debug_mode: bool = False
     log_level: str = "INFO"
     max_image_size_mb: int = 10
-    
+    max_request_size_mb: int = 200  # Whole request body limit, enforced while the body is received
+    upload_spool_mb: int = 2  # Uploads larger than this are spooled to a temp file
+    max_document_pages: int = 20  # Page limit for PDF and multi-page TIFF prescriptions
+    document_page_concurrency: int = 4  # Pages of one document submitted to the OCR engine at once
+    max_text_chars: int = 20000  # Longest text the rule-based extractors read; longer OCR output is cut
+    pdf_text_layer_min_chars: int = 20  # PDF pages with at least this much embedded text skip OCR
+    preprocess_profile: str = "balanced"  # Default preprocessing profile: fast, balanced or quality
+    assumed_page_height_in: float = 8.27  # Page height used to estimate DPI when the image has none (A5)
+    ocr_workers: int = 0  # Number of OCR worker processes (0 = one per CPU core)
+    ocr_queue_size: int = 32  # Max OCR jobs queued or running before new submissions are rejected
+    cache_db_path: str = "prescription_cache.db"  # SQLite file backing the on-disk cache tier
+    result_cache_enabled: bool = True
+    result_cache_ttl_seconds: int = 7 * 24 * 3600
+    result_cache_memory_entries: int = 256  # Responses kept in the per-process LRU tier
+    result_cache_max_disk_mb: int = 512
+    batch_max_files: int = 500  # Files accepted in one batch request
+    batch_max_texts: int = 500  # Texts accepted in one text batch request
+    batch_concurrency: int = 4  # Images of one batch analysed at the same time
+    job_events_heartbeat_seconds: float = 15.0  # Keep-alive interval on idle job event streams
+    job_retention_seconds: float = 3600.0  # How long a finished job's status and events stay available
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
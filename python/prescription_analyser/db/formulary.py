@@ -0,0 +1,364 @@
+"""
+Compact on-disk formulary: brand and generic names with strengths and forms.
+
+The formulary is compiled from a CSV source (name, generic, category, strength, form)
+into one binary file that every worker process memory-maps read-only. The OS page
+cache shares its pages between processes, and lookups read fixed-width tables through
+numpy views instead of building Python objects for every entry. Names are sorted for
+binary search, and records are indexed by category and by normalised strength.
+
+Build it at deploy time with: python db/formulary.py [source.csv] [formulary.bin]
+The app also builds it at startup when it is missing or older than the CSV, and a
+running process rebuilds and reloads it when the CSV changes. Builds write a temporary
+file and rename it into place, so readers never see a partial file.
+"""
+
+import os
+import re
+import csv
+import sys
+import mmap
+import hashlib
+import time
+import struct
+import tempfile
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+if __name__ == "__main__":
+    # Make the application modules importable when run as a script
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings, logger
+
+MAGIC = b"RXFM"
+FORMAT_VERSION = 1
+SECTIONS = ("strings", "names", "records", "categories", "category_records", "forms",
+            "strength_keys", "strength_records")
+# Magic, format version, padding, then (offset, count) of every section
+HEADER = struct.Struct("<4sHH" + "QQ" * len(SECTIONS))
+
+NAME_DTYPE = np.dtype([
+    ("key_offset", "<u4"), ("key_length", "<u2"),
+    ("display_offset", "<u4"), ("display_length", "<u2"),
+    ("first", "<u4"), ("count", "<u4"),
+])
+RECORD_DTYPE = np.dtype([
+    ("name", "<u4"), ("generic", "<u4"), ("category", "<u2"), ("form", "<u2"),
+    ("strength_offset", "<u4"), ("strength_length", "<u2"),
+    ("amount", "<f8"), ("unit", "<u1"), ("brand", "<u1"),
+])
+CATEGORY_DTYPE = np.dtype([("offset", "<u4"), ("length", "<u2"), ("first", "<u4"), ("count", "<u4")])
+STRING_DTYPE = np.dtype([("offset", "<u4"), ("length", "<u2")])
+SECTION_DTYPES = {
+    "strings": np.dtype("u1"), "names": NAME_DTYPE, "records": RECORD_DTYPE, "categories": CATEGORY_DTYPE,
+    "category_records": np.dtype("<u4"), "forms": STRING_DTYPE,
+    "strength_keys": np.dtype("<f8"), "strength_records": np.dtype("<u4"),
+}
+
+# Strengths are compared in a canonical unit per dimension: mass in mg
+UNITS = ("", "mg", "ml", "iu", "%")
+UNIT_SCALE = {"mcg": ("mg", 0.001), "g": ("mg", 1000.0)}
+_STRENGTH = re.compile(r'(\d+(?:\.\d+)?)\s*(mcg|mg|g|ml|iu|%)', re.IGNORECASE)
+# Keeps (unit, amount) pairs apart in one sorted float key
+_UNIT_STRIDE = 1e9
+
+
+class FormularyEntry(NamedTuple):
+    name: str
+    generic: str
+    category: str
+    strength: str
+    form: str
+
+    @property
+    def is_brand(self) -> bool:
+        return self.name.casefold() != self.generic.casefold()
+
+
+def parse_strength(strength: str) -> Optional[Tuple[float, str]]:
+    """Leading amount of a strength in its canonical unit, e.g. "0.5 g" -> (500.0, "mg")."""
+    match = _STRENGTH.search(strength)
+    if match is None:
+        return None
+    amount, unit = float(match.group(1)), match.group(2).lower()
+    unit, scale = UNIT_SCALE.get(unit, (unit, 1.0))
+    return amount * scale, unit
+
+
+def _strength_key(amount: float, unit: str) -> float:
+    return UNITS.index(unit) * _UNIT_STRIDE + amount
+
+
+def read_formulary_csv(path: str) -> List[FormularyEntry]:
+    with open(path, newline="", encoding="utf-8") as f:
+        return [
+            FormularyEntry(row["name"].strip(), (row.get("generic") or row["name"]).strip(),
+                           row["category"].strip(), row.get("strength", "").strip(), row.get("form", "").strip())
+            for row in csv.DictReader(f)
+            if row.get("name", "").strip()
+        ]
+
+
+def build_formulary(entries: Iterable[FormularyEntry], path: str):
+    """Compile entries into the binary formulary at ``path``, replacing it atomically."""
+    strings = bytearray()
+    string_ids: Dict[str, Tuple[int, int]] = {}
+
+    def intern(text: str) -> Tuple[int, int]:
+        if text not in string_ids:
+            data = text.encode("utf-8")
+            string_ids[text] = (len(strings), len(data))
+            strings.extend(data)
+        return string_ids[text]
+
+    entries = list(entries)
+    displays: Dict[str, str] = {}
+    for entry in entries:
+        for name in (entry.name, entry.generic):
+            displays.setdefault(name.casefold(), name)
+    name_keys = sorted(displays)
+    name_ids = {key: i for i, key in enumerate(name_keys)}
+    category_names = sorted({entry.category for entry in entries})
+    category_ids = {category: i for i, category in enumerate(category_names)}
+    form_names = sorted({entry.form for entry in entries})
+    form_ids = {form: i for i, form in enumerate(form_names)}
+
+    # Records are grouped by name so each name owns one contiguous range
+    entries.sort(key=lambda entry: (name_ids[entry.name.casefold()], entry.strength, entry.form))
+    records = np.zeros(len(entries), RECORD_DTYPE)
+    for i, entry in enumerate(entries):
+        amount, unit = parse_strength(entry.strength) or (0.0, "")
+        records[i] = (
+            name_ids[entry.name.casefold()], name_ids[entry.generic.casefold()],
+            category_ids[entry.category], form_ids[entry.form], *intern(entry.strength),
+            amount, UNITS.index(unit), entry.is_brand,
+        )
+
+    names = np.zeros(len(name_keys), NAME_DTYPE)
+    starts = np.searchsorted(records["name"], np.arange(len(name_keys)), side="left")
+    ends = np.searchsorted(records["name"], np.arange(len(name_keys)), side="right")
+    for i, key in enumerate(name_keys):
+        names[i] = (*intern(key), *intern(displays[key]), starts[i], ends[i] - starts[i])
+
+    category_records = np.argsort(records["category"], kind="stable").astype("<u4")
+    sorted_categories = records["category"][category_records]
+    categories = np.zeros(len(category_names), CATEGORY_DTYPE)
+    for i, category in enumerate(category_names):
+        first = np.searchsorted(sorted_categories, i, side="left")
+        last = np.searchsorted(sorted_categories, i, side="right")
+        categories[i] = (*intern(category), first, last - first)
+
+    forms = np.array([intern(form) for form in form_names], STRING_DTYPE)
+
+    keys = records["unit"] * _UNIT_STRIDE + records["amount"]
+    strength_records = np.argsort(keys, kind="stable").astype("<u4")
+    strength_keys = keys[strength_records].astype("<f8")
+
+    sections = {
+        "strings": np.frombuffer(bytes(strings), np.uint8), "names": names, "records": records,
+        "categories": categories, "category_records": category_records, "forms": forms,
+        "strength_keys": strength_keys, "strength_records": strength_records,
+    }
+    layout, body, offset = [], bytearray(), HEADER.size
+    for section in SECTIONS:
+        data = sections[section].tobytes()
+        padding = -offset % 8  # Keep every table 8-byte aligned in the mapping
+        body.extend(b"\0" * padding)
+        offset += padding
+        layout.extend((offset, len(sections[section])))
+        body.extend(data)
+        offset += len(data)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".formulary-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, *layout))
+            f.write(body)
+        os.chmod(tmp_path, 0o644)  # mkstemp files are private; every worker must be able to map it
+        # Readers keep the old mapping until they reopen, so replacing in place is safe
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    logger.info(f"Built formulary {path}: {len(name_keys)} names, {len(entries)} products")
+
+
+class _Mapping(NamedTuple):
+    mm: mmap.mmap
+    tables: Dict[str, np.ndarray]
+    signature: Tuple[int, int, int]
+    checksum: str
+
+
+class Formulary:
+    """Read-only view of a memory-mapped formulary, reopened when the file changes.
+
+    Nothing is read until ``load`` (called at startup) or the first lookup. ``refresh``
+    (called at most every ``reload_seconds``) rebuilds the file when the CSV
+    ``source_path`` is newer and remaps it when it was replaced; ``version`` goes up
+    with every reload so derived indexes know to rebuild.
+    """
+
+    def __init__(self, path: str, source_path: Optional[str] = None, reload_seconds: float = 5.0):
+        self.path = path
+        self.source_path = source_path
+        self.reload_seconds = reload_seconds
+        self.version = 0
+        self._lock = threading.RLock()
+        self._checked_at = 0.0
+        self._current: Optional[_Mapping] = None
+
+    def load(self):
+        """Build the file when it is missing or older than its source, then map it."""
+        with self._lock:
+            if self._current is not None:
+                return
+            if self._source_is_newer():
+                build_formulary(read_formulary_csv(self.source_path), self.path)
+            self._current = self._open()
+            self._checked_at = time.monotonic()
+
+    @property
+    def _mapping(self) -> _Mapping:
+        if self._current is None:
+            self.load()
+        return self._current
+
+    def _source_is_newer(self) -> bool:
+        if not self.source_path or not os.path.exists(self.source_path):
+            return False
+        return not os.path.exists(self.path) or os.path.getmtime(self.source_path) > os.path.getmtime(self.path)
+
+    def _open(self) -> _Mapping:
+        with open(self.path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, *layout = HEADER.unpack_from(mm)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{self.path} is not a version {FORMAT_VERSION} formulary file")
+        tables = {
+            section: np.frombuffer(mm, SECTION_DTYPES[section], count=layout[2 * i + 1], offset=layout[2 * i])
+            for i, section in enumerate(SECTIONS)
+        }
+        self.version += 1
+        return _Mapping(mm, tables, (stat.st_ino, stat.st_size, stat.st_mtime_ns), hashlib.sha256(mm).hexdigest())
+
+    def refresh(self) -> bool:
+        """Reload if the formulary file (or its CSV source) changed; True when it did."""
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_seconds:
+            return False
+        with self._lock:
+            self._checked_at = now
+            try:
+                if self._source_is_newer():
+                    build_formulary(read_formulary_csv(self.source_path), self.path)
+                stat = os.stat(self.path)
+                if (stat.st_ino, stat.st_size, stat.st_mtime_ns) == self._mapping.signature:
+                    return False
+                # The old mapping is released once no lookup still holds its tables
+                self._current = self._open()
+            except (OSError, ValueError) as e:
+                logger.error(f"Formulary reload failed, keeping version {self.version}: {e}")
+                return False
+        logger.info(f"Reloaded formulary {self.path} (version {self.version})")
+        return True
+
+    @staticmethod
+    def _string(tables: Dict[str, np.ndarray], offset: int, length: int) -> str:
+        return tables["strings"][offset:offset + length].tobytes().decode("utf-8")
+
+    def _display_name(self, tables: Dict[str, np.ndarray], name_id: int) -> str:
+        name = tables["names"][name_id]
+        return self._string(tables, name["display_offset"], name["display_length"])
+
+    def _entries(self, tables: Dict[str, np.ndarray], record_ids: Iterable[int]) -> List[FormularyEntry]:
+        records, categories, forms = tables["records"], tables["categories"], tables["forms"]
+        entries = []
+        for i in record_ids:
+            record = records[i]
+            category = categories[record["category"]]
+            form = forms[record["form"]]
+            entries.append(FormularyEntry(
+                self._display_name(tables, record["name"]),
+                self._display_name(tables, record["generic"]),
+                self._string(tables, category["offset"], category["length"]),
+                self._string(tables, record["strength_offset"], record["strength_length"]),
+                self._string(tables, form["offset"], form["length"]),
+            ))
+        return entries
+
+    @property
+    def checksum(self) -> str:
+        """SHA-256 of the mapped file; unlike ``version`` it is the same in every process."""
+        return self._mapping.checksum
+
+    def __len__(self) -> int:
+        return len(self._mapping.tables["records"])
+
+    def names(self) -> List[str]:
+        """Every brand and generic name."""
+        tables = self._mapping.tables
+        return [self._display_name(tables, i) for i in range(len(tables["names"]))]
+
+    def categories(self) -> List[str]:
+        tables = self._mapping.tables
+        return [self._string(tables, c["offset"], c["length"]) for c in tables["categories"]]
+
+    def lookup(self, name: str) -> List[FormularyEntry]:
+        """Products sold under ``name`` (case-insensitive), found by binary search."""
+        tables = self._mapping.tables
+        names = tables["names"]
+        key = name.strip().casefold()
+        low, high = 0, len(names)
+        while low < high:
+            middle = (low + high) // 2
+            probe = self._string(tables, names[middle]["key_offset"], names[middle]["key_length"])
+            if probe < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == len(names) or self._string(tables, names[low]["key_offset"], names[low]["key_length"]) != key:
+            return []
+        first, count = int(names[low]["first"]), int(names[low]["count"])
+        return self._entries(tables, range(first, first + count))
+
+    def by_category(self, category: str) -> List[FormularyEntry]:
+        tables = self._mapping.tables
+        for entry in tables["categories"]:
+            if self._string(tables, entry["offset"], entry["length"]) == category:
+                first, count = int(entry["first"]), int(entry["count"])
+                return self._entries(tables, tables["category_records"][first:first + count])
+        return []
+
+    def by_strength(self, strength: str) -> List[FormularyEntry]:
+        """Products of the given strength, e.g. "500 mg" (also matches "0.5 g")."""
+        parsed = parse_strength(strength)
+        if parsed is None:
+            return []
+        tables = self._mapping.tables
+        key = _strength_key(*parsed)
+        keys = tables["strength_keys"]
+        first = np.searchsorted(keys, key - 1e-6, side="left")
+        last = np.searchsorted(keys, key + 1e-6, side="right")
+        return self._entries(tables, tables["strength_records"][first:last])
+
+    def generic_names(self, category: Optional[str] = None) -> List[str]:
+        """Generic names, optionally of one category, in formulary order."""
+        entries = self.by_category(category) if category else self._entries(
+            self._mapping.tables, range(len(self))
+        )
+        return list(dict.fromkeys(entry.generic for entry in entries))
+
+
+FORMULARY = Formulary(settings.formulary_path, settings.formulary_source_path, settings.formulary_reload_seconds)
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else settings.formulary_source_path
+    target = sys.argv[2] if len(sys.argv) > 2 else settings.formulary_path
+    build_formulary(read_formulary_csv(source), target)
@@ -1,13 +1,8 @@
-# Enhanced medication database with categories
-MEDICINE_DB = {
-    "painkillers": ["Paracetamol", "Ibuprofen", "Aspirin", "Tramadol", "Codeine", "Diclofenac", "Naproxen"],
-    "antibiotics": ["Amoxicillin", "Azithromycin", "Ciprofloxacin", "Doxycycline", "Metronidazole"],
-    "antidiabetics": ["Metformin", "Glimepiride", "Sitagliptin", "Insulin", "Empagliflozin"],
-    "statins": ["Atorvastatin", "Simvastatin", "Rosuvastatin", "Pravastatin"],
-    "antihypertensives": ["Amlodipine", "Lisinopril", "Losartan", "Hydrochlorothiazide", "Enalapril"],
-    "antihistamines": ["Cetirizine", "Loratadine", "Fexofenadine", "Chlorpheniramine"],
-    "corticosteroids": ["Prednisolone", "Dexamethasone", "Hydrocortisone", "Budesonide"],
-}
-
-# Flattened medicine list for fuzzy matching
-ALL_MEDICINES = [med for category in MEDICINE_DB.values() for med in category]
\ No newline at end of file
+# Conditions commonly written on prescriptions, recognised alongside medication names
+CONDITIONS = [
+    "Hypertension", "Diabetes", "Type 2 diabetes", "Hypercholesterolemia", "Hyperlipidemia", "Asthma",
+    "COPD", "Fever", "Headache", "Migraine", "Arthritis", "Osteoarthritis", "Rheumatoid arthritis",
+    "Back pain", "Joint pain", "Allergic rhinitis", "Urticaria", "Sinusitis", "Pharyngitis", "Tonsillitis",
+    "Bronchitis", "Pneumonia", "Urinary tract infection", "Gastritis", "Acid reflux", "GERD",
+    "Hypothyroidism", "Anemia", "Dermatitis", "Eczema", "Angina", "Heart failure", "Influenza",
+]
@@ -1,12 +1,46 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from api.endpoints import router
+from api.middleware import RequestSizeLimitMiddleware
+from config import settings
+from db.formulary import FORMULARY
+from services.llm_client import LLM_CLIENT
+from services.nlp_model import nlp_warm, preload, warmup
+from services.ocr_backends import check_ocr_backend
+from services.ocr_engine import OCR_ENGINE
+
+# Under `gunicorn --preload` this runs once in the master, and the forked workers
+# share the loaded model instead of each loading their own copy
+if settings.nlp_preload:
+    preload()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Map the formulary (building it if stale), check the OCR backend and start the OCR
+    worker pool with the app; stop the pool and close LLM connections on shutdown.
+
+    The spaCy model is warmed up in the background, so the app serves /health straight
+    away and /ready once the model is loaded.
+    """
+    await asyncio.to_thread(FORMULARY.load)
+    check_ocr_backend()  # tesserocr can only be imported on the main thread
+    await OCR_ENGINE.start()
+    if settings.nlp_warmup and not nlp_warm():
+        asyncio.get_running_loop().run_in_executor(None, warmup)
+    yield
+    OCR_ENGINE.shutdown()
+    await LLM_CLIENT.close()
+
 
 # Initialize FastAPI
 app = FastAPI(
     title="Prescription Analysis API",
     description="API for analyzing and extracting structured data from prescription images",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -18,6 +52,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Reject oversized bodies while they are still being received
+app.add_middleware(RequestSizeLimitMiddleware, max_bytes=settings.max_request_size_mb * 1024 * 1024)
+
 # Include API router
 app.include_router(router, prefix="/api/v1")
 
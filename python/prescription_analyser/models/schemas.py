@@ -5,9 +5,21 @@ from pydantic import BaseModel
 class Medication(BaseModel):
     """Medication information extracted from prescription."""
     name: str
-    dosage: str
+    dosage: Optional[str] = None
     frequency: Optional[str] = None
     duration: Optional[str] = None
+    instructions: Optional[str] = None
+
+
+class CorrectedExtraction(BaseModel):
+    """Corrected text and medications returned together by the single-pass LLM mode."""
+    corrected_text: str
+    medications: List[Medication]
+
+
+class SpanCorrections(BaseModel):
+    """One corrected string per low-confidence OCR fragment sent to the LLM."""
+    corrections: List[str]
 
 
 class PrescriptionData(BaseModel):
@@ -15,20 +27,51 @@ class PrescriptionData(BaseModel):
     patient: Optional[str] = None
     date: Optional[str] = None
     medications: List[Medication] = []
+    conditions: List[str] = []
     doctor: Optional[str] = None
     hospital: Optional[str] = None
     notes: Optional[str] = None
 
 
+class TextRegion(BaseModel):
+    """Text block located by layout analysis, in source image pixels (as uploaded, before any rotation)."""
+    page: int = 0
+    x: int
+    y: int
+    width: int
+    height: int
+    angle: float = 0.0
+    text: str
+
+
 class PrescriptionResponse(BaseModel):
     """API response model for prescription analysis."""
     success: bool
+    filename: Optional[str] = None
     raw_text: Optional[str] = None
     corrected_text: Optional[str] = None
     parsed_data: Optional[PrescriptionData] = None
     job_id: Optional[str] = None
     error: Optional[str] = None
     processing_time_ms: Optional[float] = None
+    page_count: Optional[int] = None
+    regions: Optional[List[TextRegion]] = None
+    preprocess_profile: Optional[str] = None
+    llm_mode: Optional[str] = None
+    ai_correction: Optional[str] = None  # Correction applied: full, spans, skipped, unavailable, failed or disabled
+    ocr_confidence: Optional[Dict[str, float]] = None
+    stage_timings_ms: Optional[Dict[str, float]] = None
+    cached: bool = False
+
+
+class TextAnalysisRequest(BaseModel):
+    """Prescription text to analyze without OCR."""
+    text: str
+
+
+class TextBatchRequest(BaseModel):
+    """Prescription texts to analyze together without OCR."""
+    texts: List[str]
 
 
 class JobStatus(BaseModel):
@@ -0,0 +1,94 @@
+import re
+from bisect import bisect_right
+from functools import cached_property
+from typing import Iterable, List, Optional
+from config import settings, logger
+from services.mention_scanner import Mention, get_mention_scanner
+from services.nlp_model import get_nlp
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+class AnalysisContext:
+    """Everything derived from one prescription text that the extractors share.
+
+    ``raw_text`` keeps its lines for the line-based rules, and ``text`` is the same
+    text with whitespace runs collapsed to single spaces, as the parser reads it.
+    Dictionary mentions and the spaCy ``Doc`` are computed once, over ``text``, on
+    first use; ``raw_offset`` and ``raw_mentions`` map them back onto ``raw_text``.
+    Text longer than ``settings.max_text_chars`` is cut to that length first.
+    """
+
+    def __init__(self, raw_text: str, doc=None):
+        if len(raw_text) > settings.max_text_chars:
+            logger.warning(f"Analysing the first {settings.max_text_chars} of {len(raw_text)} characters")
+            raw_text = raw_text[:settings.max_text_chars]
+        self.raw_text = raw_text
+        stripped = raw_text.strip()
+        base = len(raw_text) - len(raw_text.lstrip())
+        # Starts of the pieces of ``text`` (a word run or a collapsed space) and where each piece starts in raw_text
+        self._starts: List[int] = [0]
+        self._raw_starts: List[int] = [base]
+        parts, position, length = [], 0, 0
+        for match in _WHITESPACE.finditer(stripped):
+            word = stripped[position:match.start()]
+            parts.extend((word, " "))
+            length += len(word)
+            self._starts.extend((length, length + 1))
+            self._raw_starts.extend((base + match.start(), base + match.end()))
+            length += 1
+            position = match.end()
+        parts.append(stripped[position:])
+        self.text = "".join(parts)
+        self._doc = doc
+
+    def raw_offset(self, offset: int) -> int:
+        """The position in ``raw_text`` of an offset into ``text``."""
+        piece = bisect_right(self._starts, offset) - 1
+        return self._raw_starts[piece] + offset - self._starts[piece]
+
+    @property
+    def doc(self):
+        """The spaCy Doc of ``text``, parsed on first use."""
+        if self._doc is None:
+            self._doc = get_nlp()(self.text)
+        return self._doc
+
+    @cached_property
+    def mentions(self) -> List[Mention]:
+        """Medication and condition mentions in ``text``, from one dictionary scan."""
+        return get_mention_scanner().scan(self.text)
+
+    def raw_mentions(self, label: Optional[str] = None) -> List[Mention]:
+        """``mentions`` with the offsets and written text of ``raw_text``."""
+        found = []
+        for mention in self.mentions:
+            if label is None or mention.label == label:
+                start, end = self.raw_offset(mention.start), self.raw_offset(mention.end - 1) + 1
+                found.append(mention._replace(start=start, end=end, text=self.raw_text[start:end]))
+        return found
+
+    @cached_property
+    def _line_ends(self) -> List[int]:
+        return [match.start() for match in re.finditer('\n', self.raw_text)]
+
+    def line_end(self, raw_offset: int) -> int:
+        """End of the ``raw_text`` line containing ``raw_offset`` (the newline, or the end of the text)."""
+        index = bisect_right(self._line_ends, raw_offset - 1)
+        return self._line_ends[index] if index < len(self._line_ends) else len(self.raw_text)
+
+
+def build_contexts(texts: Iterable[str], batch_size: Optional[int] = None) -> List[AnalysisContext]:
+    """Contexts for many texts, Docs parsed together with ``nlp.pipe`` only where NER is likely.
+
+    The extractors only read the Doc when no formulary name is found, so just the
+    texts without a medication mention are batch-parsed; the rest keep a lazy Doc.
+    """
+    contexts = [AnalysisContext(text) for text in texts]
+    needs_ner = [context for context in contexts
+                 if not any(mention.label == "MEDICATION" for mention in context.mentions)]
+    if len(needs_ner) > 1:  # A single text gains nothing from batching
+        docs = get_nlp().pipe((context.text for context in needs_ner), batch_size=batch_size or settings.nlp_batch_size)
+        for context, doc in zip(needs_ner, docs):
+            context._doc = doc
+    return contexts
@@ -0,0 +1,87 @@
+import re
+from typing import Dict, List, NamedTuple, Optional
+from config import settings, logger
+from services.med_matcher import get_medication_matcher
+from services.ocr_backends import WordConfidences
+
+
+class CorrectionDecision(NamedTuple):
+    """How much of the OCR text goes to the LLM for correction.
+
+    ``action`` is "skipped" (none), "spans" (only ``spans``) or "full".
+    """
+    action: str
+    spans: List[str]
+    confidence: Optional[Dict[str, float]]
+
+
+def confidence_summary(words: Optional[WordConfidences]) -> Optional[Dict[str, float]]:
+    """Mean and minimum word confidence, or None when there are no words."""
+    if not words:
+        return None
+    confidences = [confidence for _, confidence in words]
+    return {
+        "mean": round(sum(confidences) / len(confidences), 2),
+        "min": round(min(confidences), 2),
+    }
+
+
+def medication_name_score(word: str) -> int:
+    """Similarity (0-100) of a word to its closest formulary name."""
+    result = get_medication_matcher().extract_one(word, scorer="ratio")
+    return result[1] if result is not None else 0
+
+
+def misspelled_medication_names(text: str) -> List[str]:
+    """Words close enough to a formulary name to be a misreading of it, but not a clean match.
+
+    Words scoring at or below ``fuzzy_match_threshold`` are not medication names at all
+    (e.g. "Take"); those at or above ``correction_gate_fuzzy_score`` are read correctly.
+    """
+    return [
+        word for word in set(re.findall(r'[A-Za-z]{4,}', text))
+        if settings.fuzzy_match_threshold < medication_name_score(word) < settings.correction_gate_fuzzy_score
+    ]
+
+
+def low_confidence_spans(words: WordConfidences, threshold: float, context: int = 1) -> List[str]:
+    """Runs of low-confidence words, each with ``context`` neighbours on either side."""
+    windows = []
+    for i, (_, confidence) in enumerate(words):
+        if confidence >= threshold:
+            continue
+        start, end = max(0, i - context), min(len(words), i + context + 1)
+        if windows and start <= windows[-1][1]:
+            windows[-1][1] = end
+        else:
+            windows.append([start, end])
+    return [" ".join(word for word, _ in words[start:end]) for start, end in windows]
+
+
+def decide_correction(text: str, words: Optional[WordConfidences]) -> CorrectionDecision:
+    """Decide whether OCR output needs AI correction, based on word confidences and name matches.
+
+    Clean scans (high mean and minimum confidence, no misread medication names) skip
+    the LLM. A few low-confidence words are sent as fragments. Anything else, or text
+    without confidences, is corrected in full.
+    """
+    summary = confidence_summary(words)
+    if not settings.correction_gate_enabled or summary is None:
+        return CorrectionDecision("full", [], summary)
+
+    misspelled = misspelled_medication_names(text)
+    if (not misspelled
+            and summary["mean"] >= settings.correction_gate_mean_confidence
+            and summary["min"] >= settings.correction_gate_min_confidence):
+        logger.info(f"Skipping AI correction (mean confidence {summary['mean']}, min {summary['min']})")
+        return CorrectionDecision("skipped", [], summary)
+
+    if settings.correction_gate_spans:
+        spans = low_confidence_spans(words, settings.correction_gate_min_confidence)
+        low_words = sum(1 for _, confidence in words if confidence < settings.correction_gate_min_confidence)
+        # Fragments only help if every misread medication name is inside one of them
+        covered = all(any(name in span for span in spans) for name in misspelled)
+        if spans and covered and low_words <= settings.correction_gate_max_span_fraction * len(words):
+            return CorrectionDecision("spans", spans, summary)
+
+    return CorrectionDecision("full", [], summary)
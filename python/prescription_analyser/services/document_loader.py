@@ -0,0 +1,123 @@
+import os
+import numpy as np
+from typing import List, NamedTuple, Optional, Union
+from config import settings, logger
+from services.image_processor import DecodedImage, decode_image, estimate_source_dpi, get_preprocess_profile, open_image
+
+PDF_MAGIC = b"%PDF"
+TIFF_MAGICS = (b"II*\x00", b"MM\x00*")
+
+
+class DocumentInfo(NamedTuple):
+    """Page layout of an uploaded prescription."""
+    kind: str  # "image", "tiff" or "pdf"
+    page_count: int
+    text_layers: List[Optional[str]]  # Embedded text per page (PDF only), None when there is none
+
+
+def detect_document_kind(source: Union[bytes, str]) -> str:
+    """Tell PDFs and TIFFs apart from single images by their magic bytes."""
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            magic = f.read(4)
+    else:
+        magic = bytes(source[:4])
+
+    if magic.startswith(PDF_MAGIC):
+        return "pdf"
+    if magic in TIFF_MAGICS:
+        return "tiff"
+    return "image"
+
+
+def _check_size(source: Union[bytes, str]):
+    size = os.path.getsize(source) if isinstance(source, str) else len(source)
+    if size > settings.max_image_size_mb * 1024 * 1024:
+        raise ValueError(f"Image size exceeds the {settings.max_image_size_mb}MB limit")
+
+
+def _check_page_count(page_count: int):
+    if page_count > settings.max_document_pages:
+        raise ValueError(f"Document has {page_count} pages; the limit is {settings.max_document_pages}")
+
+
+def _open_pdf(source: Union[bytes, str]):
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        raise ValueError("PDF prescriptions require the pypdfium2 package")
+    try:
+        return pdfium.PdfDocument(source)
+    except Exception as e:
+        raise ValueError(f"Invalid PDF file: {e}")
+
+
+def inspect_document(source: Union[bytes, str]) -> DocumentInfo:
+    """Count the pages of an upload and pull any embedded PDF text layers."""
+    _check_size(source)
+    kind = detect_document_kind(source)
+
+    if kind == "pdf":
+        pdf = _open_pdf(source)
+        try:
+            _check_page_count(len(pdf))
+            text_layers = []
+            for page in pdf:
+                textpage = page.get_textpage()
+                text_layers.append(textpage.get_text_range())
+                textpage.close()
+                page.close()
+        finally:
+            pdf.close()
+        logger.debug(f"PDF has {len(text_layers)} pages")
+        return DocumentInfo(kind, len(text_layers), text_layers)
+
+    if kind == "tiff":
+        try:
+            with open_image(source) as img:
+                page_count = getattr(img, "n_frames", 1)
+        except Exception as e:
+            raise ValueError(f"Invalid image file: {e}")
+        _check_page_count(page_count)
+        return DocumentInfo(kind, page_count, [None] * page_count)
+
+    # Header check only; pixels are decoded later by decode_image
+    try:
+        with open_image(source) as img:
+            img.verify()
+    except Exception as e:
+        raise ValueError(f"Invalid image file: {e}")
+    return DocumentInfo(kind, 1, [None])
+
+
+def decode_page(source: Union[bytes, str], page_index: int, profile: Optional[str] = None) -> DecodedImage:
+    """Decode one page of a PDF, multi-page TIFF or single image to grayscale."""
+    kind = detect_document_kind(source)
+
+    if kind == "pdf":
+        # Render straight at the profile's target DPI so no resampling is needed afterwards
+        dpi = get_preprocess_profile(profile)["target_dpi"]
+        pdf = _open_pdf(source)
+        try:
+            page = pdf[page_index]
+            bitmap = page.render(scale=dpi / 72, grayscale=True)
+            gray = bitmap.to_numpy()
+            if gray.ndim == 3:
+                gray = gray[:, :, 0]
+            gray = np.array(gray)  # Own the pixels before pdfium frees the bitmap
+            page.close()
+        finally:
+            pdf.close()
+        return DecodedImage(gray, dpi)
+
+    if kind == "tiff":
+        try:
+            with open_image(source) as img:
+                img.seek(page_index)
+                return DecodedImage(np.asarray(img.convert("L")), estimate_source_dpi(img))
+        except EOFError:
+            raise ValueError(f"TIFF has no page {page_index + 1}")
+        except Exception as e:
+            raise ValueError(f"Invalid image file: {e}")
+
+    return decode_image(source)
@@ -0,0 +1,135 @@
+import re
+import sys
+from bisect import bisect_left
+from functools import cached_property
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+# Words the parser's field patterns are built around, by kind. Every match of a
+# field pattern starts with (or, for unanchored patterns, contains) one of its
+# kinds' words, so a pattern only has to run from the first place they occur.
+# The words are matched case-insensitively, like the patterns themselves.
+TRIGGERS = {
+    "patient_label": ("(patient's name)",),
+    "patient": ("patient",),
+    "pt": ("pt",),
+    "name": ("name",),
+    "for": ("for",),
+    "prescribed": ("prescribed for",),
+    "dr": ("dr",),
+    "doctor": ("doctor",),
+    "physician": ("physician",),
+    "sign": ("sign",),
+    "bottle": ("bottle",),
+    "facility": ("hospital", "clinic", "medical"),
+    "notes": ("notes", "instructions", "directions"),
+    "corrected": ("corrected medication name)",),
+    "time": ("time",),
+    "every": ("every",),
+    "once": ("once",),
+    "twice": ("twice",),
+    "daytime": ("morning", "evening", "night"),
+    "before": ("before",),
+    "after": ("after",),
+    "with": ("with",),
+    "tid": ("tid",),
+    "bid": ("bid",),
+    "qid": ("qid",),
+    "qd": ("qd",),
+    "take": ("take",),
+}
+# Case-sensitive words, found in the text as written
+EXACT_TRIGGERS = {"date": "DATE"}
+
+# Folds the text the way re.IGNORECASE compares it with ASCII letters: upper case and
+# the four non-ASCII letters it treats as i, k and s. Every mapping is one character
+# to one, so offsets in the folded text are offsets in the text.
+_FOLD = str.maketrans({
+    **{chr(c): chr(c + 32) for c in range(ord("A"), ord("Z") + 1)},
+    "\u0130": "i", "\u0131": "i", "\u017f": "s", "\u212a": "k",
+})
+
+_DIGIT_RUN = re.compile(r'\d+')
+
+# Characters a hospital/clinic name is made of (the hospital pattern never spans anything else)
+_NAME_RUN = re.compile(r'[\w\s]*')
+
+
+class FieldPattern(NamedTuple):
+    """A compiled field pattern and the trigger kinds its matches start with (or contain, if not ``anchored``)."""
+    regex: re.Pattern
+    kinds: Sequence[str]
+    anchored: bool = True
+
+
+def _occurrences(text: str, word: str) -> List[int]:
+    """Every offset where ``word`` starts, overlapping ones included."""
+    found = []
+    position = text.find(word)
+    while position != -1:
+        found.append(position)
+        position = text.find(word, position + 1)
+    return found
+
+
+class FieldTokens:
+    """Offsets of every trigger word in one text, from a single lexing pass.
+
+    Field patterns are then run from the first offset of their triggers, or skipped
+    when none occur, instead of each scanning the whole text. A pattern cannot match
+    before its first trigger, so the matches are exactly those of a full scan.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        folded = text.lower() if text.isascii() else text.translate(_FOLD)
+        self.positions: Dict[str, List[int]] = {}
+        for kind, words in TRIGGERS.items():
+            found = [position for word in words for position in _occurrences(folded, word)]
+            if found:
+                self.positions[kind] = sorted(found) if len(words) > 1 else found
+        for kind, word in EXACT_TRIGGERS.items():
+            found = _occurrences(text, word)
+            if found:
+                self.positions[kind] = found
+        # Starts of digit runs, which only locate the first digit of the whole text (not of a window)
+        digits = [match.start() for match in _DIGIT_RUN.finditer(text)]
+        if digits:
+            self.positions["digit"] = digits
+
+    def first(self, kinds: Sequence[str], start: int = 0, end: int = sys.maxsize) -> Optional[int]:
+        """First offset in [start, end) where a trigger of one of ``kinds`` starts."""
+        best = None
+        for kind in kinds:
+            positions = self.positions.get(kind)
+            if positions:
+                index = bisect_left(positions, start)
+                if index < len(positions) and positions[index] < end and (best is None or positions[index] < best):
+                    best = positions[index]
+        return best
+
+    def _scan_from(self, pattern: FieldPattern, start: int, end: int) -> Optional[int]:
+        """Where ``pattern`` has to start scanning in [start, end), or None if it cannot match there."""
+        position = self.first(pattern.kinds, start, end)
+        if position is None:
+            return None
+        return position if pattern.anchored else start
+
+    def search(self, pattern: FieldPattern, start: int = 0, end: int = sys.maxsize) -> Optional[re.Match]:
+        """``pattern.regex.search`` over text[start:end]."""
+        position = self._scan_from(pattern, start, end)
+        return pattern.regex.search(self.text, position, end) if position is not None else None
+
+    def finditer(self, pattern: FieldPattern, start: int = 0, end: int = sys.maxsize) -> Iterator[re.Match]:
+        """``pattern.regex.finditer`` over text[start:end]."""
+        position = self._scan_from(pattern, start, end)
+        return pattern.regex.finditer(self.text, position, end) if position is not None else iter(())
+
+    @cached_property
+    def _reversed_text(self) -> str:
+        return self.text[::-1]
+
+    def name_run_start(self, position: int) -> int:
+        """Start of the run of word and space characters that ends at or contains ``position``."""
+        # Matching forwards over the reversed text walks back from position in one C call
+        offset = len(self.text) - position
+        return position - (_NAME_RUN.match(self._reversed_text, offset).end() - offset)
@@ -1,58 +1,239 @@
-import os
+import time
+import threading
 import cv2
 import numpy as np
 from io import BytesIO
+from typing import Dict, NamedTuple, Optional, Tuple, Union
 from PIL import Image
 from config import settings, logger
 
 
-def validate_image(image_file: BytesIO) -> bool:
-    """Validate the uploaded image file."""
-    # Check file size
-    image_file.seek(0, os.SEEK_END)
-    file_size = image_file.tell() / (1024 * 1024)  # Convert to MB
-    image_file.seek(0)  # Reset file pointer
-    
-    if file_size > settings.max_image_size_mb:
+# Named preprocessing profiles trading OCR latency against accuracy.
+# target_dpi: resolution the page is resampled to before any filtering
+# upscale: whether low-resolution scans may be enlarged (capped at MAX_UPSCALE)
+# denoise: "median" (cheap) or "nlmeans" (cv2.fastNlMeansDenoising)
+PREPROCESS_PROFILES = {
+    "fast": {"target_dpi": 200, "upscale": False, "denoise": "median", "median_ksize": 3},
+    "balanced": {"target_dpi": 300, "upscale": True, "denoise": "nlmeans", "nlm_h": 10, "nlm_template": 7, "nlm_search": 15},
+    "quality": {"target_dpi": 400, "upscale": True, "denoise": "nlmeans", "nlm_h": 10, "nlm_template": 7, "nlm_search": 21},
+}
+
+# Largest enlargement applied to small scans
+MAX_UPSCALE = 2.0
+
+# Embedded DPI below this is treated as a placeholder (72/96 from phone cameras and editors)
+MIN_TRUSTED_DPI = 150
+
+# Pages larger than this get one-off buffers instead of growing the worker's pool
+MAX_POOLED_PIXELS = 40_000_000
+
+
+class DecodedImage(NamedTuple):
+    """Grayscale pixels decoded once from an upload and the scan resolution."""
+    gray: np.ndarray
+    dpi: float
+
+
+class PreprocessResult(NamedTuple):
+    """Binarized page ready for OCR, its resolution and per-stage timings (ms)."""
+    image: np.ndarray
+    dpi: int
+    timings: Dict[str, float]
+
+
+class BufferPool:
+    """Reusable uint8 image buffers, one per named slot, grown to the largest page seen.
+
+    Each slot keeps a flat buffer and hands out a contiguous 2-D view of it, so pages
+    of different sizes share the same memory.
+    """
+
+    def __init__(self, max_pixels: int = MAX_POOLED_PIXELS):
+        self.max_pixels = max_pixels
+        self._buffers: Dict[str, np.ndarray] = {}
+
+    def get(self, slot: str, shape: Tuple[int, int]) -> np.ndarray:
+        size = shape[0] * shape[1]
+        if size > self.max_pixels:
+            return np.empty(shape, dtype=np.uint8)
+        buffer = self._buffers.get(slot)
+        if buffer is None or buffer.size < size:
+            buffer = self._buffers[slot] = np.empty(size, dtype=np.uint8)
+        return buffer[:size].reshape(shape)
+
+    def clear(self):
+        self._buffers.clear()
+
+
+_local = threading.local()
+
+
+def get_buffer_pool() -> BufferPool:
+    """Return this thread's preprocessing buffer pool (one per OCR worker)."""
+    pool = getattr(_local, "buffer_pool", None)
+    if pool is None:
+        pool = _local.buffer_pool = BufferPool()
+    return pool
+
+
+def load_image_buffer(source: Union[bytes, str]) -> np.ndarray:
+    """View upload bytes as a uint8 buffer without copying, or read a spooled upload from disk."""
+    if isinstance(source, str):
+        return np.fromfile(source, dtype=np.uint8)
+    return np.frombuffer(source, dtype=np.uint8)
+
+
+def open_image(source: Union[bytes, str]) -> Image.Image:
+    """Open an upload lazily with PIL (BytesIO shares the bytes object rather than copying it)."""
+    return Image.open(BytesIO(source) if isinstance(source, bytes) else source)
+
+
+def decode_image(source: Union[bytes, str]) -> DecodedImage:
+    """Validate an upload (bytes or spooled file path) and decode it to grayscale exactly once."""
+    buffer = load_image_buffer(source)
+    if buffer.size > settings.max_image_size_mb * 1024 * 1024:
         raise ValueError(f"Image size exceeds the {settings.max_image_size_mb}MB limit")
-    
-    # Validate image format
+
+    # Validate image format from the header only; PIL does not decode pixels here
     try:
-        with Image.open(image_file) as img:
+        with open_image(source) as img:
             img.verify()
-            image_file.seek(0)  # Reset file pointer after verification
-            return True
+            source_dpi = estimate_source_dpi(img)
     except Exception as e:
         raise ValueError(f"Invalid image file: {e}")
 
+    # Decode straight to 8-bit grayscale, skipping the RGB intermediate
+    gray = cv2.imdecode(buffer, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        # Formats OpenCV cannot read (e.g. GIF) go through PIL instead
+        try:
+            with open_image(source) as img:
+                gray = np.asarray(img.convert("L"))
+        except Exception as e:
+            raise ValueError(f"Invalid image file: {e}")
+    return DecodedImage(gray, source_dpi)
+
 
-def preprocess_image(image_file: BytesIO) -> Image.Image:
+def validate_image(image_file: BytesIO) -> bool:
+    """Validate the uploaded image file."""
+    decode_image(image_file.getvalue())
+    return True
+
+
+def get_preprocess_profile(name: Optional[str] = None) -> dict:
+    """Return the named preprocessing profile, defaulting to the configured one."""
+    name = name or settings.preprocess_profile
+    if name not in PREPROCESS_PROFILES:
+        raise ValueError(f"Unknown preprocessing profile '{name}'. Choose one of: {', '.join(PREPROCESS_PROFILES)}")
+    return PREPROCESS_PROFILES[name]
+
+
+def estimate_source_dpi(img: Image.Image) -> float:
+    """Estimate the scan resolution from embedded metadata or the page size."""
+    dpi = img.info.get("dpi")
+    if dpi and min(dpi) >= MIN_TRUSTED_DPI:
+        return float(min(dpi))
+    # Assume the photo or scan covers a whole prescription page
+    return max(img.size) / settings.assumed_page_height_in
+
+
+def resample_to_dpi(
+    img_np: np.ndarray, source_dpi: float, profile: dict, dst: Optional[np.ndarray] = None, pool: Optional[BufferPool] = None
+) -> Tuple[np.ndarray, float]:
+    """Resample a grayscale page to the profile's target DPI, returning the resulting DPI.
+
+    With a ``pool`` the output is written into its "scratch" buffer.
+    """
+    scale = profile["target_dpi"] / source_dpi
+    if scale > 1 and not profile["upscale"]:
+        return img_np, source_dpi
+    scale = min(scale, MAX_UPSCALE)
+    if abs(scale - 1) < 0.1:
+        return img_np, source_dpi
+
+    if pool is not None:
+        # Same rounding OpenCV applies when sizing the output from fx/fy
+        height, width = img_np.shape[:2]
+        dst = pool.get("scratch", (round(height * scale), round(width * scale)))
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    return cv2.resize(img_np, None, dst=dst, fx=scale, fy=scale, interpolation=interpolation), source_dpi * scale
+
+
+def denoise(img_np: np.ndarray, profile: dict, dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """Remove sensor and compression noise using the profile's filter."""
+    if profile["denoise"] == "median":
+        return cv2.medianBlur(img_np, profile["median_ksize"], dst=dst)
+    return cv2.fastNlMeansDenoising(
+        img_np, dst, profile["nlm_h"], profile["nlm_template"], profile["nlm_search"]
+    )
+
+
+def preprocess_image(image_file: BytesIO, profile: Optional[str] = None) -> Image.Image:
     """Enhance image for better OCR accuracy with advanced techniques."""
+    # Copy out of the worker's buffer pool; the next preprocess call reuses it
+    return Image.fromarray(preprocess_decoded(decode_image(image_file.getvalue()), profile).image.copy())
+
+
+def preprocess_decoded(
+    decoded: DecodedImage, profile: Optional[str] = None, pool: Optional[BufferPool] = None
+) -> PreprocessResult:
+    """Run the preprocessing pipeline for a profile, timing each stage in milliseconds.
+
+    Every stage writes into buffers from ``pool`` (the calling thread's pool by
+    default), so a worker allocates page-sized memory once rather than per request.
+    The returned image lives in the pool and is only valid until the next call on
+    the same pool.
+    """
+    stage_profile = get_preprocess_profile(profile)
+    pool = pool or get_buffer_pool()
+    timings = {}
+
+    def timed(stage, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        timings[stage] = round((time.perf_counter() - start) * 1000, 2)
+        return result
+
     try:
-        # Open and convert to grayscale
-        img = Image.open(image_file).convert("L")
-        img_np = np.array(img)
-        
-        # Denoise
-        img_np = cv2.fastNlMeansDenoising(img_np, None, 10, 7, 21)
-        
+        # Normalise resolution before the expensive filters
+        img_np, dpi = timed("resample", resample_to_dpi, decoded.gray, decoded.dpi, stage_profile, pool=pool)
+
+        # Denoise (stages alternate between the "scratch" and "output" buffers)
+        img_np = timed("denoise", denoise, img_np, stage_profile, dst=pool.get("output", img_np.shape))
+
         # Apply Adaptive Thresholding
-        img_np = cv2.adaptiveThreshold(
-            img_np, 255, 
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-            cv2.THRESH_BINARY, 31, 2
+        img_np = timed("threshold", cv2.adaptiveThreshold,
+            img_np, 255,
+            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY, 31, 2,
+            dst=pool.get("scratch", img_np.shape)
         )
-        
-        # Apply dilation followed by erosion to close gaps in letters
-        kernel = np.ones((1, 1), np.uint8)
-        img_np = cv2.morphologyEx(img_np, cv2.MORPH_CLOSE, kernel)
-        
+
         # Apply contrast stretching
-        p2, p98 = np.percentile(img_np, (2, 98))
-        img_np = np.clip(img_np, p2, p98)
-        img_np = ((img_np - p2) / (p98 - p2) * 255).astype(np.uint8)
-        
-        return Image.fromarray(img_np)
+        img_np = timed("contrast", stretch_contrast, img_np, dst=img_np)
+
+        return PreprocessResult(img_np, round(dpi), timings)
     except Exception as e:
         logger.error(f"Image preprocessing error: {e}")
-        raise ValueError(f"Failed to preprocess image: {e}")
\ No newline at end of file
+        raise ValueError(f"Failed to preprocess image: {e}")
+
+
+def histogram_percentiles(img_np: np.ndarray, percentiles: Tuple[float, ...]) -> Tuple[int, ...]:
+    """Percentiles of an 8-bit image from its 256-bin histogram, without sorting or copying pixels."""
+    hist = cv2.calcHist([img_np], [0], None, [256], [0, 256]).ravel()
+    cdf = np.cumsum(hist)
+    return tuple(int(np.searchsorted(cdf, cdf[-1] * p / 100.0)) for p in percentiles)
+
+
+def stretch_contrast(img_np: np.ndarray, dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """Stretch intensities between the 2nd and 98th percentiles to the full range.
+
+    Applied through a 256-entry lookup table; pass ``dst=img_np`` to stretch in place.
+    """
+    p2, p98 = histogram_percentiles(img_np, (2, 98))
+    if p98 <= p2:
+        # Nearly uniform page (e.g. under 2% ink after thresholding): nothing to stretch
+        return img_np
+    levels = np.arange(256, dtype=np.float32)
+    lut = np.clip((levels - p2) / (p98 - p2) * 255, 0, 255).astype(np.uint8)
+    return cv2.LUT(img_np, lut, dst=dst)
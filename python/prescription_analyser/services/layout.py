@@ -0,0 +1,130 @@
+import cv2
+import numpy as np
+from typing import List, NamedTuple, Tuple
+
+# Blocks whose ink covers less than this are noise, more than that are photos/logos
+MIN_INK_DENSITY = 0.02
+MAX_INK_DENSITY = 0.6
+
+# Skew estimates beyond this are block-shape artefacts rather than rotated text
+MAX_DESKEW_DEGREES = 20.0
+
+# Below this the rotation is not worth a warp
+MIN_DESKEW_DEGREES = 0.5
+
+# When detected blocks cover more of the page than this, OCR the page as a whole
+MAX_REGION_COVERAGE = 0.85
+
+
+class TextBlock(NamedTuple):
+    """A detected text block: bounding box in page pixels and the skew of its lines."""
+    x: int
+    y: int
+    width: int
+    height: int
+    angle: float
+
+
+def ink_mask(binary: np.ndarray) -> np.ndarray:
+    """Text pixels of a binarized page (dark on light) as a 0/255 mask."""
+    return cv2.threshold(binary, 127, 255, cv2.THRESH_BINARY_INV)[1]
+
+
+def block_skew(contour: np.ndarray) -> float:
+    """Estimate the text-line angle of a block from its minimum-area rectangle."""
+    _, (width, height), angle = cv2.minAreaRect(contour)
+    # Make the long side the line direction, then fold into [-90, 90)
+    if width < height:
+        angle += 90
+    angle = (angle + 90) % 180 - 90
+    return angle if abs(angle) <= MAX_DESKEW_DEGREES else 0.0
+
+
+def median_char_height(ink: np.ndarray, dpi: int) -> int:
+    """Median height of character-sized connected components, defaulting to 10pt text."""
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    # Ignore specks and anything taller than an inch (rules, borders, art)
+    chars = heights[(heights >= 4) & (heights <= dpi) & (widths <= dpi)]
+    if chars.size == 0:
+        return max(8, int(dpi * 10 / 72 * 0.7))
+    return int(np.median(chars))
+
+
+def detect_text_blocks(binary: np.ndarray, dpi: int) -> List[TextBlock]:
+    """Find text blocks on a binarized page, in reading order.
+
+    Characters are smeared into lines and lines into blocks with morphological closing
+    (kernels scaled to the median character height); the outer contours of the result
+    are filtered by size and ink density so margins, specks and letterhead art are dropped.
+    """
+    ink = ink_mask(binary)
+    char_height = median_char_height(ink, dpi)
+    line_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(3, int(char_height * 1.2)), max(1, char_height // 8)))
+    block_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(1, char_height // 4), max(3, int(char_height * 0.6))))
+    smeared = cv2.morphologyEx(ink, cv2.MORPH_CLOSE, line_kernel)
+    smeared = cv2.morphologyEx(smeared, cv2.MORPH_CLOSE, block_kernel)
+
+    contours, _ = cv2.findContours(smeared, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    min_size = max(8, int(0.04 * dpi))  # Roughly the x-height of 6pt text
+    blocks = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w < min_size or h < min_size:
+            continue
+        density = cv2.countNonZero(ink[y:y + h, x:x + w]) / float(w * h)
+        if not MIN_INK_DENSITY <= density <= MAX_INK_DENSITY:
+            continue
+        blocks.append(TextBlock(x, y, w, h, round(block_skew(contour), 2)))
+
+    # Reading order: top to bottom in bands of one text line, then left to right
+    band = max(1, int(0.15 * dpi))
+    return sorted(blocks, key=lambda b: (b.y // band, b.x))
+
+
+def region_coverage(blocks: List[TextBlock], shape) -> float:
+    """Fraction of the page area covered by block bounding boxes."""
+    area = sum(b.width * b.height for b in blocks)
+    return area / float(shape[0] * shape[1])
+
+
+def crop_block(binary: np.ndarray, block: TextBlock, padding: int = 8) -> np.ndarray:
+    """Cut a block out of the page with a white margin and rotate its lines level."""
+    height, width = binary.shape[:2]
+    x0, y0 = max(0, block.x - padding), max(0, block.y - padding)
+    x1, y1 = min(width, block.x + block.width + padding), min(height, block.y + block.height + padding)
+    crop = binary[y0:y1, x0:x1]
+    if abs(block.angle) < MIN_DESKEW_DEGREES:
+        return crop
+
+    crop_h, crop_w = crop.shape[:2]
+    matrix = cv2.getRotationMatrix2D((crop_w / 2, crop_h / 2), block.angle, 1.0)
+    return cv2.warpAffine(crop, matrix, (crop_w, crop_h), flags=cv2.INTER_NEAREST, borderValue=255)
+
+
+def rotate_upright(binary: np.ndarray, orientation: int) -> np.ndarray:
+    """Undo a clockwise page rotation of 90, 180 or 270 degrees."""
+    rotations = {
+        90: cv2.ROTATE_90_COUNTERCLOCKWISE,
+        180: cv2.ROTATE_180,
+        270: cv2.ROTATE_90_CLOCKWISE,
+    }
+    if orientation not in rotations:
+        return binary
+    return cv2.rotate(binary, rotations[orientation])
+
+
+def unrotate_box(x: int, y: int, width: int, height: int, orientation: int, shape) -> Tuple[int, int, int, int]:
+    """Map a box on the page returned by ``rotate_upright`` back onto the page before it.
+
+    ``shape`` is the (height, width) of the page before rotation.
+    """
+    page_h, page_w = shape[:2]
+    if orientation == 90:
+        return page_w - y - height, x, height, width
+    if orientation == 180:
+        return page_w - x - width, page_h - y - height, width, height
+    if orientation == 270:
+        return y, page_h - x - width, height, width
+    return x, y, width, height
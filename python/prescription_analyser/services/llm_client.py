@@ -0,0 +1,178 @@
+import json
+import random
+import asyncio
+from typing import Callable, List, Optional
+from config import settings, logger
+from services.llm_providers import LLMProvider, create_llm_provider
+from utils.cache import TieredCache, make_cache_key
+from utils.resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, deadline_scope, time_remaining
+from utils.singleflight import SingleFlight
+
+
+def normalize_llm_input(text: str) -> str:
+    """Collapse whitespace and case so trivially different OCR outputs share a cache entry."""
+    return " ".join(text.split()).casefold()
+
+
+class LLMClient:
+    """One long-lived LLM client per process, in front of an ``LLMProvider``.
+
+    At most ``max_concurrency`` requests are in flight at once, and failed calls are
+    retried with exponential backoff and full jitter without blocking the event loop.
+    With a ``cache``, ``complete`` serves repeated inputs without a network round trip.
+    Calls respect the request deadline and stop reaching the provider while
+    ``breaker`` is open.
+    """
+
+    def __init__(self, provider: LLMProvider, max_concurrency: int, timeout_seconds: float,
+                 retry_base_delay: float, cache: Optional[TieredCache] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self.timeout_seconds = timeout_seconds
+        self.retry_base_delay = retry_base_delay
+        self.cache = cache
+        self.breaker = breaker or CircuitBreaker(provider.name, failure_threshold=5, reset_seconds=30.0)
+        self._inflight = SingleFlight()
+        self._semaphore = None
+
+    async def chat(self, model: str, messages: List[dict], max_retries: int = 3, **kwargs) -> str:
+        """Run a chat completion and return the message text, retrying failures.
+
+        Attempts and backoff sleeps stay within the current request deadline. Raises
+        CircuitOpenError at once while the breaker is open, DeadlineExceeded when the
+        budget is spent, and otherwise the last error once ``max_retries`` attempts failed.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        for attempt in range(max_retries):
+            try:
+                return await self._attempt(model, messages, **kwargs)
+            except (CircuitOpenError, DeadlineExceeded):
+                raise
+            except Exception as e:
+                logger.warning(f"{self.provider.name} API Error on {model} (attempt {attempt+1}/{max_retries}): {e}")
+                if attempt == max_retries - 1:
+                    raise
+                delay = random.uniform(0, self.retry_base_delay * 2 ** attempt)
+                remaining = time_remaining()
+                if remaining is not None and delay >= remaining:
+                    raise DeadlineExceeded(f"No time left to retry {model}") from e
+                await asyncio.sleep(delay)
+
+    async def _attempt(self, model: str, messages: List[dict], **kwargs) -> str:
+        """One completion request, bounded by the deadline and guarded by the circuit breaker."""
+        remaining = time_remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"Request deadline passed before calling {model}")
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), remaining)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Request deadline passed waiting to call {model}") from None
+        try:
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"{self.provider.name} circuit is open, not calling {model}")
+            # A half-open breaker only lets its single trial call through
+            trial = self.breaker.state == "half_open"
+            remaining = time_remaining()
+            # The provider's own timeout applies too; this one also covers providers without one
+            deadline_bound = remaining is not None and remaining < self.timeout_seconds
+            timeout = remaining if deadline_bound else self.timeout_seconds
+            try:
+                content = await asyncio.wait_for(self.provider.chat(model, messages, **kwargs), timeout)
+            except asyncio.TimeoutError:
+                if deadline_bound:
+                    # Our own budget ran out first, which says nothing about the upstream
+                    raise DeadlineExceeded(f"Request deadline passed calling {model}") from None
+                self.breaker.record_failure()
+                raise
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            else:
+                self.breaker.record_success()
+            finally:
+                if trial:
+                    # A trial cancelled or cut short by our deadline records nothing; let the next call try
+                    self.breaker.release_trial()
+            return content
+        finally:
+            self._semaphore.release()
+
+    async def complete(self, model: str, system_prompt: str, user_prompt: str, text: str, max_retries: int = 3,
+                       validate: Optional[Callable[[str], object]] = None, **kwargs) -> str:
+        """Run the chat ``system_prompt`` + ``user_prompt.format(text=text)``, using the cache when possible.
+
+        Entries are keyed by the normalised text, the provider and model, and a digest of
+        both prompts and the sampling parameters, so changing a prompt invalidates its old
+        entries. A reply is only cached if ``validate`` (when given) accepts it without
+        raising. Concurrent calls with the same key share one upstream request.
+        """
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt.format(text=text)},
+        ]
+        prompt_version = make_cache_key(system_prompt, user_prompt, json.dumps(kwargs, sort_keys=True))
+        key = make_cache_key(self.provider.name, model, prompt_version, normalize_llm_input(text))
+        if self.cache is not None:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                logger.debug(f"LLM cache hit for {model}")
+                return cached
+
+        async def fetch() -> str:
+            # The shared call serves every waiter, so it must not inherit the first
+            # caller's deadline; each attempt is still bounded by timeout_seconds
+            with deadline_scope(None):
+                content = await self.chat(model, messages, max_retries, **kwargs)
+            if self.cache is not None:
+                try:
+                    if validate is not None:
+                        validate(content)
+                except Exception:
+                    return content
+                await asyncio.to_thread(self.cache.set, key, content)
+            return content
+
+        try:
+            # Each caller waits only until its own deadline; the shared call keeps running for the others
+            return await asyncio.wait_for(self._inflight.do(key, fetch), time_remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Request deadline passed waiting for {model}") from None
+
+    def inflight_stats(self) -> dict:
+        """Calls currently in flight and how many duplicates have joined one."""
+        return self._inflight.stats()
+
+    def available(self) -> bool:
+        """False while the circuit breaker is open or the request deadline has passed."""
+        remaining = time_remaining()
+        return self.breaker.state != "open" and (remaining is None or remaining > 0)
+
+    async def close(self):
+        """Close the provider's connections; the next call opens new ones."""
+        await self.provider.close()
+        self._semaphore = None
+
+
+# Replies keyed by normalised input, model and prompt version
+LLM_CACHE = TieredCache(
+    "llm_responses",
+    settings.cache_db_path,
+    ttl_seconds=settings.llm_cache_ttl_seconds,
+    memory_entries=settings.llm_cache_memory_entries,
+    max_disk_mb=settings.llm_cache_max_disk_mb,
+) if settings.llm_cache_enabled else None
+
+LLM_CLIENT = LLMClient(
+    provider=create_llm_provider(),
+    max_concurrency=settings.llm_max_concurrency,
+    timeout_seconds=settings.llm_timeout_seconds,
+    retry_base_delay=settings.llm_retry_base_delay,
+    cache=LLM_CACHE,
+    breaker=CircuitBreaker(
+        settings.llm_provider,
+        failure_threshold=settings.llm_breaker_failure_threshold,
+        reset_seconds=settings.llm_breaker_reset_seconds,
+    ),
+)
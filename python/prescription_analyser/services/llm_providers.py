@@ -0,0 +1,194 @@
+import os
+import re
+import sys
+import json
+import threading
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Pattern
+from config import settings, logger
+from db.formulary import FORMULARY
+from services.med_matcher import get_medication_matcher
+from services.mention_scanner import OCR_CONFUSIONS, fold_ocr
+
+# The fake provider's latency and failure model is shared with the chatbot
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "shared"))
+from fake_llm import FakeLatency, FakeProviderError
+
+
+class LLMProvider:
+    """A chat completion backend: takes chat messages and returns the reply text.
+
+    Retries, concurrency limits, deadlines, the circuit breaker and caching live in
+    ``LLMClient``; a provider only makes one call.
+    """
+    name = "base"
+
+    async def chat(self, model: str, messages: List[dict], **kwargs) -> str:
+        raise NotImplementedError
+
+    async def close(self):
+        """Release connections; the next call opens new ones."""
+
+
+class GroqProvider(LLMProvider):
+    """The Groq API, over one long-lived async client with a keep-alive connection pool."""
+    name = "groq"
+
+    def __init__(self, api_key: str, max_connections: int, timeout_seconds: float):
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self.timeout_seconds = timeout_seconds
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            import httpx
+            from groq import AsyncGroq
+
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                timeout=self.timeout_seconds,
+            )
+            # Retries are LLMClient's, so the SDK's own (sleeping) retry loop is switched off
+            self._client = AsyncGroq(api_key=self.api_key, http_client=http_client, max_retries=0)
+        return self._client
+
+    async def chat(self, model: str, messages: List[dict], **kwargs) -> str:
+        response = await self._get_client().chat.completions.create(model=model, messages=messages, **kwargs)
+        return response.choices[0].message.content.strip()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+# Dosage as the fake provider reports it, e.g. "500 mg"; never the tail of a longer number
+_FAKE_DOSAGE = re.compile(r'(?<![\d.])\d+(?:\.\d+)?\s*(?:mg|mcg|g|ml)\b', re.IGNORECASE)
+# Words as OCR writes them, digits included ("Paracetamo1", "0meprazole")
+_FAKE_WORD = re.compile(r'[A-Za-z0-9]+')
+# Digits OCR writes for letters, undone before fuzzy matching
+_DIGIT_CONFUSIONS = str.maketrans({digit: letter for digit, letter in OCR_CONFUSIONS.items() if digit.isdigit()})
+
+
+class _FakeFormulary(NamedTuple):
+    version: int
+    names: Dict[str, str]  # Lowercase name to display name
+    folded: Dict[str, str]  # fold_ocr of the name to display name
+    pattern: Pattern  # Matches any formulary name, longest first
+
+
+_fake_formulary: Optional[_FakeFormulary] = None
+_fake_formulary_lock = threading.Lock()
+
+
+def get_fake_formulary() -> _FakeFormulary:
+    """The fake provider's index of the current formulary names, rebuilt after a reload."""
+    global _fake_formulary
+    FORMULARY.refresh()
+    if _fake_formulary is None or _fake_formulary.version != FORMULARY.version:
+        with _fake_formulary_lock:
+            if _fake_formulary is None or _fake_formulary.version != FORMULARY.version:
+                version = FORMULARY.version
+                names = FORMULARY.names()
+                _fake_formulary = _FakeFormulary(
+                    version, {name.lower(): name for name in names}, {fold_ocr(name): name for name in names},
+                    re.compile(
+                        r'\b(' + '|'.join(re.escape(name) for name in sorted(names, key=len, reverse=True)) + r')\b',
+                        re.IGNORECASE
+                    )
+                )
+    return _fake_formulary
+
+
+@lru_cache(maxsize=4096)
+def _fake_correct_word(word: str, formulary_version: int) -> str:
+    """The formulary name a word is a near miss of, or the word itself.
+
+    ``formulary_version`` is part of the cache key, so a reload does not serve old corrections.
+    """
+    formulary = get_fake_formulary()
+    if len(word) < 4 or word.isdigit() or _FAKE_DOSAGE.fullmatch(word) or word.lower() in formulary.names:
+        return word
+    if fold_ocr(word) in formulary.folded:
+        return formulary.folded[fold_ocr(word)]
+    match, score = get_medication_matcher().extract_one(word.translate(_DIGIT_CONFUSIONS), scorer="ratio")
+    return match if score > settings.fuzzy_match_threshold else word
+
+
+def fake_correct_text(text: str) -> str:
+    """Deterministic stand-in for AI correction: snap misspelt medication names to the formulary."""
+    version = get_fake_formulary().version
+    return _FAKE_WORD.sub(lambda m: _fake_correct_word(m.group(0), version), text)
+
+
+def fake_extract_medications(text: str) -> List[dict]:
+    """Deterministic stand-in for LLM extraction: formulary names with the dosage on the same line."""
+    formulary = get_fake_formulary()
+    medications = []
+    for line in text.splitlines():
+        for match in formulary.pattern.finditer(line):
+            dosage = _FAKE_DOSAGE.search(line, match.end())
+            instructions = line[dosage.end() if dosage else match.end():].strip(" ,.-")
+            medications.append({
+                "name": formulary.names[match.group(1).lower()],
+                "dosage": dosage.group(0) if dosage else None,
+                "instructions": instructions or None,
+            })
+    return medications
+
+
+class FakeLLMProvider(LLMProvider):
+    """Offline stand-in for Groq, for load tests, benchmarks and cache/retry tests.
+
+    Replies are a deterministic function of the input: misspelt formulary names are
+    corrected and medications are read off the lines that name them, in whichever
+    shape the system prompt asks for. Latency and failures (FakeProviderError) are
+    simulated by ``FakeLatency`` from the shared fake_llm module.
+    """
+    name = "fake"
+
+    def __init__(self, latency_ms: float, latency_sigma: float, failure_rate: float, seed: Optional[int] = None):
+        self.latency = FakeLatency(latency_ms, latency_sigma, failure_rate, seed)
+
+    async def chat(self, model: str, messages: List[dict], **kwargs) -> str:
+        await self.latency.wait(model)
+        return self.reply(messages, json_mode=kwargs.get("response_format", {}).get("type") == "json_object")
+
+    @staticmethod
+    def reply(messages: List[dict], json_mode: bool = False) -> str:
+        """The reply to a conversation, without the simulated latency or failures."""
+        system_prompt = next((m["content"] for m in messages if m["role"] == "system"), "")
+        # Every user prompt ends with ":\n" followed by the text itself
+        text = messages[-1]["content"].split("\n", 1)[-1]
+        if not json_mode:
+            return fake_correct_text(text)
+        if "'corrections'" in system_prompt:
+            return json.dumps({"corrections": [fake_correct_text(line) for line in text.splitlines()]})
+        corrected_text = fake_correct_text(text)
+        medications = fake_extract_medications(corrected_text)
+        if "'corrected_text'" in system_prompt:
+            return json.dumps({"corrected_text": corrected_text, "medications": medications})
+        return json.dumps({"medications": medications})
+
+
+LLM_PROVIDERS = ("groq", "fake")
+
+
+def create_llm_provider(name: Optional[str] = None) -> LLMProvider:
+    """Build the named provider from settings, defaulting to the configured one."""
+    name = name or settings.llm_provider
+    if name == "groq":
+        return GroqProvider(settings.groq_api_key, settings.llm_max_connections, settings.llm_timeout_seconds)
+    if name == "fake":
+        logger.warning("Using the fake LLM provider: replies are simulated, not from a model")
+        return FakeLLMProvider(
+            settings.fake_llm_latency_ms,
+            settings.fake_llm_latency_sigma,
+            settings.fake_llm_failure_rate,
+            settings.fake_llm_seed,
+        )
+    raise ValueError(f"Unknown LLM provider '{name}'. Choose one of: {', '.join(LLM_PROVIDERS)}")
@@ -0,0 +1,116 @@
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from config import settings, logger
+from db.formulary import FORMULARY
+
+# Scores stay fuzzywuzzy's (backed by python-Levenshtein), which fuzzy_match_threshold is tuned
+# for; other scorers such as rapidfuzz's WRatio rank some names differently
+from fuzzywuzzy import fuzz, process
+
+_NON_WORD = re.compile(r'(?ui)\W')
+
+
+def normalize_name(name: str) -> str:
+    """Lower-case with punctuation turned into spaces, as fuzzywuzzy processes strings before scoring."""
+    return _NON_WORD.sub(" ", name).lower().strip()
+
+
+def trigrams(name: str) -> set:
+    """Character trigrams of a normalised name, padded so short names and word edges count."""
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class MedicationMatcher:
+    """Fuzzy lookup of the closest formulary name, without scanning the whole formulary.
+
+    A trigram index picks the ``max_candidates`` names sharing the most trigrams with
+    the query, and only those are scored with fuzzywuzzy. Formularies no larger than
+    ``max_candidates`` are scored in full, so the match and score are those of
+    fuzzywuzzy's ``process.extractOne`` over the list (benchmarks/med_matcher.py
+    checks this); larger ones may miss a name the index does not shortlist. Each
+    matcher remembers its recent lookups.
+    """
+
+    def __init__(self, names: Iterable[str], max_candidates: int = 256):
+        self.max_candidates = max_candidates
+        self.extract_one = lru_cache(maxsize=4096)(self.extract_one)
+        self.names: List[str] = []
+        self._normalized: List[str] = []
+        self._exact: Dict[str, int] = {}
+        postings: Dict[str, List[int]] = {}
+        for name in names:
+            normalized = normalize_name(name)
+            if not normalized or normalized in self._exact:
+                continue
+            index = len(self.names)
+            self._exact[normalized] = index
+            self.names.append(name)
+            self._normalized.append(normalized)
+            for gram in trigrams(normalized):
+                postings.setdefault(gram, []).append(index)
+        self._postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def candidates(self, normalized: str) -> List[int]:
+        """Indices of the names sharing the most trigrams with a normalised query."""
+        if len(self.names) <= self.max_candidates:
+            return list(range(len(self.names)))
+        lists = [self._postings[gram] for gram in trigrams(normalized) if gram in self._postings]
+        if not lists:
+            return []
+        shared = np.bincount(np.concatenate(lists), minlength=len(self.names))
+        hits = np.flatnonzero(shared)
+        if len(hits) > self.max_candidates:
+            hits = hits[np.argpartition(shared[hits], -self.max_candidates)[-self.max_candidates:]]
+        return hits.tolist()
+
+    def extract_one(self, query: str, scorer: str = "WRatio") -> Optional[Tuple[str, int]]:
+        """Closest name and its score under the named ``fuzz`` scorer, or None for an empty query."""
+        normalized = normalize_name(query)
+        if not normalized or not self.names:
+            return None
+        exact = self._exact.get(normalized)
+        if exact is not None:
+            return self.names[exact], 100
+
+        indices = self.candidates(normalized)
+        if not indices:
+            return None
+        choices = {position: self._normalized[i] for position, i in enumerate(indices)}
+        # Strings are already normalised, so they are not processed again before scoring
+        _, score, position = process.extractOne(normalized, choices, scorer=getattr(fuzz, scorer), processor=lambda s: s)
+        return self.names[indices[position]], score
+
+    def correct(self, name: str, threshold: Optional[int] = None) -> str:
+        """The closest formulary name if it scores above ``threshold``, else ``name`` unchanged."""
+        threshold = settings.fuzzy_match_threshold if threshold is None else threshold
+        result = self.extract_one(name)
+        if result is None:
+            return name
+        match, score = result
+        logger.debug(f"Medication match: '{name}' → '{match}' (score: {score})")
+        return match if score > threshold else name
+
+
+_matcher: Optional[MedicationMatcher] = None
+_matcher_version = None
+_matcher_lock = threading.Lock()
+
+
+def get_medication_matcher() -> MedicationMatcher:
+    """The matcher over the current formulary, rebuilt after the formulary reloads."""
+    global _matcher, _matcher_version
+    FORMULARY.refresh()
+    if _matcher_version != FORMULARY.version:
+        with _matcher_lock:
+            if _matcher_version != FORMULARY.version:
+                version = FORMULARY.version
+                _matcher = MedicationMatcher(FORMULARY.names(), settings.medication_match_candidates)
+                _matcher_version = version
+    return _matcher
@@ -0,0 +1,127 @@
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from config import logger
+from db.formulary import FORMULARY
+from db.medicine_db import CONDITIONS
+
+# Characters OCR commonly confuses are folded to one form in both the dictionary
+# and the scanned text. Every mapping is one character to one, so offsets carry over.
+OCR_CONFUSIONS = {"0": "o", "1": "l", "|": "l", "i": "l", "I": "l", "5": "s", "8": "b"}
+_FOLD = str.maketrans({
+    **{chr(c): chr(c).lower() for c in range(ord("A"), ord("Z") + 1)},
+    **OCR_CONFUSIONS,
+})
+
+# Shorter terms fold onto too many ordinary words
+MIN_TERM_LENGTH = 4
+
+
+def fold_ocr(text: str) -> str:
+    """Lower-case ASCII letters and fold OCR look-alikes (0/O, 1/l/I, 5/S, 8/B); length is unchanged."""
+    return text.translate(_FOLD)
+
+
+class Mention(NamedTuple):
+    """A dictionary term found in the text; ``text[start:end]`` is what was actually written."""
+    start: int
+    end: int
+    text: str
+    term: str
+    label: str
+
+
+class MentionScanner:
+    """Aho–Corasick automaton over labelled dictionary terms.
+
+    One pass over the text finds every term, in time linear in the text length plus
+    the number of matches, however many terms there are. Terms and text are compared
+    after ``fold_ocr``, so "Paracetamo1" and "0meprazole" still match, and only whole
+    words count (no letter directly before or after).
+    """
+
+    def __init__(self, terms: Dict[str, Iterable[str]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # (length, term, label) of every term ending at a node, longest first
+        self._output: List[List[Tuple[int, str, str]]] = [[]]
+        count = 0
+        for label, label_terms in terms.items():
+            for term in label_terms:
+                if len(term) >= MIN_TERM_LENGTH:
+                    self._add(fold_ocr(term), term, label)
+                    count += 1
+        self._link()
+        logger.debug(f"Built mention scanner: {count} terms, {len(self._goto)} states")
+
+    def _add(self, folded: str, term: str, label: str):
+        node = 0
+        for char in folded:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        if not any(length == len(folded) for length, _, _ in self._output[node]):
+            self._output[node].append((len(folded), term, label))
+
+    def _link(self):
+        """Breadth-first failure links; each node also reports the terms of its failure chain."""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] = sorted(self._output[child] + self._output[self._fail[child]], reverse=True)
+
+    def scan(self, text: str, label: Optional[str] = None) -> List[Mention]:
+        """Non-overlapping whole-word mentions, leftmost first and longest at each position."""
+        folded = fold_ocr(text)
+        goto, fail, output = self._goto, self._fail, self._output
+        found = []
+        node = 0
+        for i, char in enumerate(folded):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length, term, term_label in output[node]:
+                start, end = i + 1 - length, i + 1
+                if label is not None and term_label != label:
+                    continue
+                if (start > 0 and text[start - 1].isalpha()) or (end < len(text) and text[end].isalpha()):
+                    continue
+                found.append((start, -end, term, term_label))
+
+        mentions, covered = [], 0
+        for start, negative_end, term, term_label in sorted(found):
+            if start >= covered:
+                mentions.append(Mention(start, -negative_end, text[start:-negative_end], term, term_label))
+                covered = -negative_end
+        return mentions
+
+
+_scanner: Optional[MentionScanner] = None
+_scanner_version = None
+_scanner_lock = threading.Lock()
+
+
+def get_mention_scanner() -> MentionScanner:
+    """The scanner over the current formulary names and known conditions, rebuilt after a reload."""
+    global _scanner, _scanner_version
+    FORMULARY.refresh()
+    if _scanner_version != FORMULARY.version:
+        with _scanner_lock:
+            if _scanner_version != FORMULARY.version:
+                version = FORMULARY.version
+                _scanner = MentionScanner({"MEDICATION": FORMULARY.names(), "CONDITION": CONDITIONS})
+                _scanner_version = version
+    return _scanner
+
@@ -0,0 +1,87 @@
+import gc
+import threading
+from typing import List, Optional
+from config import settings, logger
+
+# Short clinical line run once after loading, so the first real request does not pay
+# for lazy initialisation inside the pipeline components
+WARMUP_TEXT = "Paracetamol 500 mg twice daily for fever. Amoxicillin 250mg TID."
+
+_nlp = None
+_nlp_lock = threading.Lock()
+_warm = False
+
+
+def excluded_components() -> List[str]:
+    """Pipeline components never loaded; the extractors only read the tokens and entities."""
+    return [name.strip() for name in settings.nlp_exclude.split(",") if name.strip()]
+
+
+def _drop_unused_tok2vec(nlp):
+    """Remove a shared tok2vec layer once nothing left in the pipeline listens to it."""
+    if "tok2vec" not in nlp.pipe_names:
+        return
+    listeners = getattr(nlp.get_pipe("tok2vec"), "listening_components", None)
+    if listeners is not None and not listeners:
+        nlp.remove_pipe("tok2vec")
+
+
+def _load():
+    import spacy
+
+    exclude = excluded_components()
+    try:
+        nlp = spacy.load(settings.nlp_model, exclude=exclude)
+    except Exception as e:
+        logger.warning(f"Failed to load SpaCy model {settings.nlp_model}: {e}. Using fallback model.")
+        nlp = spacy.load(settings.nlp_fallback_model, exclude=exclude)
+    _drop_unused_tok2vec(nlp)
+    logger.info(f"Loaded SpaCy model {_model_name(nlp)} with pipeline: {', '.join(nlp.pipe_names)}")
+    return nlp
+
+
+def get_nlp():
+    """The shared spaCy pipeline, loaded on first use."""
+    global _nlp
+    if _nlp is None:
+        with _nlp_lock:
+            if _nlp is None:
+                _nlp = _load()
+    return _nlp
+
+
+def _model_name(nlp) -> str:
+    return f"{nlp.meta.get('lang', '')}_{nlp.meta.get('name', '')}"
+
+
+def nlp_model_name() -> Optional[str]:
+    """Name of the loaded model, or None before it is loaded."""
+    return _model_name(_nlp) if _nlp is not None else None
+
+
+def nlp_warm() -> bool:
+    """Whether the model has been loaded and run once."""
+    return _warm
+
+
+def warmup() -> bool:
+    """Load the model and run it over a sample line; False (logged) if loading failed."""
+    global _warm
+    try:
+        get_nlp()(WARMUP_TEXT)
+    except Exception as e:
+        logger.error(f"SpaCy warmup failed, the model will be loaded on first use: {e}")
+        return False
+    _warm = True
+    return True
+
+
+def preload():
+    """Warm up in the parent process before workers are forked.
+
+    The model then lives in memory the workers share copy-on-write. ``gc.freeze``
+    moves everything allocated so far out of the collector's reach, so collections
+    in the workers do not write to (and so copy) the shared pages.
+    """
+    if warmup():
+        gc.freeze()
@@ -0,0 +1,214 @@
+import shlex
+import threading
+import numpy as np
+from typing import List, Optional, Tuple
+from config import settings, logger
+
+
+# (word, confidence 0-100) pairs in reading order
+WordConfidences = List[Tuple[str, float]]
+
+
+class OCRBackend:
+    """Interface for OCR engines that read text from an 8-bit grayscale numpy image."""
+    name = "base"
+
+    def image_to_string(self, img_np: np.ndarray, dpi: int = 300) -> str:
+        raise NotImplementedError
+
+    def image_to_data(self, img_np: np.ndarray, dpi: int = 300) -> Tuple[str, WordConfidences]:
+        """Text and per-word confidences from one recognition pass; no words if unsupported."""
+        return self.image_to_string(img_np, dpi), []
+
+    def detect_orientation(self, img_np: np.ndarray, dpi: int = 300) -> int:
+        """Clockwise rotation of the page in degrees (0, 90, 180 or 270); 0 if unsupported."""
+        return 0
+
+    def close(self):
+        """Release engine resources."""
+
+
+def parse_tesseract_config(config: str) -> dict:
+    """Split a tesseract CLI config string (e.g. "--oem 3 --psm 6") into its options."""
+    options = {"psm": None, "oem": None, "lang": "eng", "variables": {}}
+    args = shlex.split(config)
+    for i, arg in enumerate(args[:-1]):
+        value = args[i + 1]
+        if arg == "--psm":
+            options["psm"] = int(value)
+        elif arg == "--oem":
+            options["oem"] = int(value)
+        elif arg == "-l":
+            options["lang"] = value
+        elif arg == "-c" and "=" in value:
+            key, val = value.split("=", 1)
+            options["variables"][key] = val
+    return options
+
+
+class TesserocrBackend(OCRBackend):
+    """In-process Tesseract through the tesserocr API binding.
+
+    The engine and its traineddata are loaded once and reused for every image, and
+    images are handed over as raw pixel buffers, so there is no process spawn or
+    temp file per call.
+    """
+    name = "tesserocr"
+
+    def __init__(self, config: str):
+        import tesserocr
+
+        self._tesserocr = tesserocr
+        options = parse_tesseract_config(config)
+        kwargs = {"lang": options["lang"]}
+        if options["psm"] is not None:
+            kwargs["psm"] = options["psm"]
+        if options["oem"] is not None:
+            kwargs["oem"] = options["oem"]
+        self._api = tesserocr.PyTessBaseAPI(**kwargs)
+        for key, value in options["variables"].items():
+            self._api.SetVariable(key, value)
+        self._osd_api = None  # Created on the first orientation check; False once it failed to load
+
+    def _set_image(self, img_np: np.ndarray, dpi: int, api=None):
+        api = api or self._api
+        img_np = np.ascontiguousarray(img_np, dtype=np.uint8)
+        height, width = img_np.shape[:2]
+        bytes_per_pixel = 1 if img_np.ndim == 2 else img_np.shape[2]
+        api.SetImageBytes(img_np.tobytes(), width, height, bytes_per_pixel, width * bytes_per_pixel)
+        api.SetSourceResolution(dpi)
+
+    def _get_osd_api(self):
+        """A separate OSD-only engine: the recognition engine's page mode and language cannot report orientation."""
+        if self._osd_api is None:
+            try:
+                self._osd_api = self._tesserocr.PyTessBaseAPI(lang="osd", psm=self._tesserocr.PSM.OSD_ONLY)
+            except RuntimeError as e:
+                logger.warning(
+                    f"Orientation detection unavailable ({e}); install osd.traineddata "
+                    "or set LAYOUT_DETECT_ORIENTATION=false"
+                )
+                self._osd_api = False
+        return self._osd_api or None
+
+    def image_to_string(self, img_np: np.ndarray, dpi: int = 300) -> str:
+        self._set_image(img_np, dpi)
+        return self._api.GetUTF8Text()
+
+    def image_to_data(self, img_np: np.ndarray, dpi: int = 300) -> Tuple[str, WordConfidences]:
+        self._set_image(img_np, dpi)
+        self._api.Recognize()
+        text = self._api.GetUTF8Text()
+        words = []
+        level = self._tesserocr.RIL.WORD
+        iterator = self._api.GetIterator()
+        if iterator is not None:
+            for word in self._tesserocr.iterate_level(iterator, level):
+                words.append((word.GetUTF8Text(level), word.Confidence(level)))
+        return text, words
+
+    def detect_orientation(self, img_np: np.ndarray, dpi: int = 300) -> int:
+        osd_api = self._get_osd_api()
+        if osd_api is None:
+            return 0  # Without osd.traineddata we assume upright
+        self._set_image(img_np, dpi, osd_api)
+        try:
+            result = osd_api.DetectOrientationScript()
+        except RuntimeError:
+            return 0
+        return result["orient_deg"] if result else 0
+
+    def close(self):
+        self._api.End()
+        if self._osd_api:
+            self._osd_api.End()
+
+
+class PytesseractBackend(OCRBackend):
+    """Fallback that runs the tesseract executable through pytesseract for every image."""
+    name = "pytesseract"
+
+    def __init__(self, config: str):
+        import pytesseract
+
+        self._pytesseract = pytesseract
+        self._config = config
+        # Set Tesseract path from settings (once per process)
+        pytesseract.pytesseract.tesseract_cmd = settings.tesseract_path
+
+    def image_to_string(self, img_np: np.ndarray, dpi: int = 300) -> str:
+        return self._pytesseract.image_to_string(img_np, config=f"{self._config} --dpi {dpi}")
+
+    def image_to_data(self, img_np: np.ndarray, dpi: int = 300) -> Tuple[str, WordConfidences]:
+        data = self._pytesseract.image_to_data(
+            img_np, config=f"{self._config} --dpi {dpi}", output_type=self._pytesseract.Output.DICT
+        )
+        # Rebuild the text from the word boxes so tesseract only runs once
+        lines, words, current_line = [], [], None
+        for i, word in enumerate(data["text"]):
+            confidence = float(data["conf"][i])
+            if confidence < 0 or not word.strip():
+                continue
+            line = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            if line != current_line:
+                lines.append([])
+                current_line = line
+            lines[-1].append(word)
+            words.append((word, confidence))
+        return "\n".join(" ".join(line) for line in lines), words
+
+
+OCR_BACKENDS = {
+    "tesserocr": TesserocrBackend,
+    "pytesseract": PytesseractBackend,
+}
+
+# Engines are not thread-safe, so each thread (block OCR uses a few) gets its own
+_local = threading.local()
+
+
+def create_ocr_backend(name: str = "auto", config: Optional[str] = None) -> OCRBackend:
+    """Create an OCR backend by name; "auto" prefers tesserocr and falls back to pytesseract."""
+    config = config if config is not None else settings.ocr_config
+    if name != "auto":
+        if name not in OCR_BACKENDS:
+            raise ValueError(f"Unknown OCR backend '{name}'. Choose one of: auto, {', '.join(OCR_BACKENDS)}")
+        return OCR_BACKENDS[name](config)
+
+    try:
+        return TesserocrBackend(config)
+    except Exception as e:
+        logger.warning(f"tesserocr backend unavailable ({e}), using pytesseract")
+        return PytesseractBackend(config)
+
+
+def check_ocr_backend() -> str:
+    """Name of the backend the configured OCR backend resolves to; warns when "auto" falls back.
+
+    Called once at startup: the workers create their own backends, and their fallback
+    warnings are easy to miss in worker logs.
+    """
+    backend = create_ocr_backend(settings.ocr_backend)
+    backend.close()
+    if settings.ocr_backend == "auto" and backend.name != "tesserocr":
+        logger.warning(
+            f"OCR backend 'auto' fell back to {backend.name}, which starts a tesseract process per image; "
+            "install tesserocr and its tessdata to OCR in-process"
+        )
+    else:
+        logger.info(f"OCR backend: {backend.name}")
+    return backend.name
+
+
+def get_ocr_backend() -> OCRBackend:
+    """Return this thread's long-lived OCR backend, creating it on first use."""
+    backend = getattr(_local, "backend", None)
+    if backend is None:
+        backend = _local.backend = create_ocr_backend(settings.ocr_backend)
+        logger.info(f"Initialised {backend.name} OCR backend")
+    return backend
+
+
+def init_ocr_worker():
+    """Process pool initializer: load the OCR engine once per worker process."""
+    get_ocr_backend()
@@ -0,0 +1,77 @@
+import os
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+from config import settings, logger
+from services.ocr_backends import init_ocr_worker
+
+
+class EngineBusyError(RuntimeError):
+    """Raised when the OCR engine's submission queue is full."""
+
+
+class OCREngine:
+    """Pool of worker processes for CPU-bound image validation, preprocessing and OCR.
+
+    Jobs are submitted from the event loop and awaited, so a slow scan only occupies
+    one worker process instead of blocking every request on the uvicorn worker.
+    """
+
+    def __init__(self, workers: int = 0, queue_size: int = 32, initializer: Optional[Callable[[], None]] = None):
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.queue_size = queue_size
+        self.initializer = initializer
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        """Number of jobs currently queued or running."""
+        return self._pending
+
+    async def start(self):
+        """Create the process pool and fork its workers up front."""
+        if self._executor is not None:
+            return
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=self.initializer)
+        loop = asyncio.get_running_loop()
+        # Spawn all workers now rather than on the first upload
+        await asyncio.gather(*(
+            loop.run_in_executor(self._executor, os.getpid) for _ in range(self.workers)
+        ))
+        logger.info(f"OCR engine started with {self.workers} worker processes")
+
+    def shutdown(self):
+        """Stop the worker processes, cancelling jobs that have not started."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            logger.info("OCR engine stopped")
+
+    async def submit(self, fn: Callable[..., Any], *args) -> Any:
+        """Run a picklable function in a worker process and await its result."""
+        if self._pending >= self.queue_size:
+            raise EngineBusyError(f"OCR queue is full ({self.queue_size} jobs pending)")
+        if self._executor is None:
+            await self.start()
+
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. tesseract crashed); replace the pool for later jobs
+            logger.error("OCR worker process died, restarting the OCR engine")
+            self.shutdown()
+            raise ValueError("OCR worker crashed while processing the image")
+        finally:
+            self._pending -= 1
+
+
+# Shared engine for the API process (started and stopped by the app lifespan)
+OCR_ENGINE = OCREngine(
+    workers=settings.ocr_workers,
+    queue_size=settings.ocr_queue_size,
+    initializer=init_ocr_worker,
+)
@@ -1,29 +1,124 @@
 import re
-import pytesseract
+import time
 from io import BytesIO
+from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+from PIL import Image
 from config import settings, logger
-from services.image_processor import preprocess_image
+from services.image_processor import DecodedImage, PreprocessResult, decode_image, preprocess_decoded
+from services.document_loader import DocumentInfo, decode_page, inspect_document
+from services.layout import (
+    MAX_REGION_COVERAGE, crop_block, detect_text_blocks, region_coverage, rotate_upright, unrotate_box,
+)
+from services.ocr_backends import WordConfidences, get_ocr_backend
 
+# Threads OCR'ing text blocks inside an OCR worker, created on first use
+_block_pool: Optional[ThreadPoolExecutor] = None
 
-def extract_text_from_image(image_file: BytesIO) -> str:
+
+def clean_ocr_text(text: str) -> str:
+    """Apply basic text cleaning to OCR output or an embedded text layer."""
+    text = re.sub(r'\s+', ' ', text)  # Normalize whitespace
+    text = re.sub(r'[^\w\s.,:\-\(\)]', '', text)  # Remove special characters
+    return text.strip()
+
+
+def clean_ocr_words(words: WordConfidences) -> WordConfidences:
+    """Clean each recognised word like the text, dropping words that clean to nothing."""
+    cleaned = [(clean_ocr_text(word), confidence) for word, confidence in words]
+    return [(word, confidence) for word, confidence in cleaned if word]
+
+
+class OCRResult(NamedTuple):
+    """Text extracted from an image with the time spent in each stage (ms).
+
+    ``regions`` lists the text blocks found by layout analysis (None when the whole
+    page was OCR'd) as dicts with x/y/width/height in source image pixels (of the
+    image as given, even when it was turned upright for OCR), the skew angle that
+    was corrected and the block's text. ``words`` holds each recognised word with
+    its confidence (0-100), or None when the backend reports none.
+    """
+    text: str
+    timings: Dict[str, float]
+    regions: Optional[List[dict]] = None
+    words: Optional[WordConfidences] = None
+
+
+def _ocr_block(crop, dpi: int) -> Tuple[str, WordConfidences]:
+    """OCR one text block with the calling thread's backend."""
+    text, words = get_ocr_backend().image_to_data(crop, dpi=dpi)
+    return clean_ocr_text(text), clean_ocr_words(words)
+
+
+def recognize_page(
+    processed: PreprocessResult, scale: float, timings: Dict[str, float]
+) -> Tuple[str, Optional[List[dict]], WordConfidences]:
+    """OCR a preprocessed page, restricted to its detected text blocks when layout analysis is on.
+
+    Blocks are OCR'd in parallel threads. Pages with no detectable blocks, or whose
+    blocks cover most of the page anyway, are OCR'd whole. Returns the text, the
+    regions (None for a whole-page read) and the word confidences. Blocks are found
+    on the upright page and mapped back onto the page as it was given.
+    """
+    global _block_pool
+    backend = get_ocr_backend()
+    page = processed.image
+
+    if settings.layout_analysis:
+        start = time.perf_counter()
+        orientation = backend.detect_orientation(page, processed.dpi) if settings.layout_detect_orientation else 0
+        page = rotate_upright(page, orientation)
+        blocks = detect_text_blocks(page, processed.dpi)
+        timings["layout"] = round((time.perf_counter() - start) * 1000, 2)
+
+        if blocks and region_coverage(blocks, page.shape) <= MAX_REGION_COVERAGE:
+            start = time.perf_counter()
+            if _block_pool is None:
+                _block_pool = ThreadPoolExecutor(max_workers=settings.layout_threads)
+            crops = [crop_block(page, block) for block in blocks]
+            results = list(_block_pool.map(_ocr_block, crops, repeat(processed.dpi)))
+            timings["ocr"] = round((time.perf_counter() - start) * 1000, 2)
+
+            regions = []
+            for block, (text, _) in zip(blocks, results):
+                if not text:
+                    continue
+                x, y, width, height = unrotate_box(
+                    block.x, block.y, block.width, block.height, orientation, processed.image.shape
+                )
+                regions.append({
+                    "x": round(x * scale),
+                    "y": round(y * scale),
+                    "width": round(width * scale),
+                    "height": round(height * scale),
+                    "angle": block.angle,
+                    "text": text,
+                })
+            words = [word for _, block_words in results for word in block_words]
+            return "\n".join(region["text"] for region in regions), regions, words
+
+    start = time.perf_counter()
+    text, words = backend.image_to_data(page, dpi=processed.dpi)
+    timings["ocr"] = round((time.perf_counter() - start) * 1000, 2)
+    return clean_ocr_text(text), None, clean_ocr_words(words)
+
+
+def extract_text_from_image(image_file: BytesIO, profile: Optional[str] = None) -> str:
     """Extract text using optimized OCR settings with error handling."""
+    return extract_text_from_decoded(decode_image(image_file.getvalue()), profile).text
+
+
+def extract_text_from_decoded(decoded: DecodedImage, profile: Optional[str] = None) -> OCRResult:
+    """Preprocess a decoded image with the given profile and OCR it, timing every stage."""
     try:
-        # Set Tesseract path from settings
-        pytesseract.pytesseract.tesseract_cmd = settings.tesseract_path
-        
-        processed_img = preprocess_image(image_file)
+        processed = preprocess_decoded(decoded, profile)
+        timings = processed.timings
         
-        # Apply OCR with custom configuration
-        text = pytesseract.image_to_string(
-            processed_img, 
-            config=settings.ocr_config
-        )
+        # Apply OCR with the process's long-lived backend
+        text, regions, words = recognize_page(processed, decoded.dpi / processed.dpi, timings)
         
-        # Apply basic text cleaning
-        text = re.sub(r'\s+', ' ', text)  # Normalize whitespace
-        text = re.sub(r'[^\w\s.,:\-\(\)]', '', text)  # Remove special characters
-        
-        return text.strip()
+        return OCRResult(text, timings, regions, words or None)
     except Exception as e:
         logger.error(f"OCR extraction error: {e}")
         
@@ -32,9 +127,47 @@ def extract_text_from_image(image_file: BytesIO) -> str:
             logger.warning("Falling back to mock OCR service since Tesseract is not available")
             try:
                 from services.mock_ocr_service import extract_text_from_image_mock
-                return extract_text_from_image_mock(image_file)
+                return OCRResult(extract_text_from_image_mock(Image.fromarray(decoded.gray)), {})
             except Exception as mock_error:
                 logger.error(f"Mock OCR service also failed: {mock_error}")
                 raise ValueError(f"Failed to extract text from image: {e}")
         
-        raise ValueError(f"Failed to extract text from image: {e}")
\ No newline at end of file
+        raise ValueError(f"Failed to extract text from image: {e}")
+
+
+def ocr_upload(source: Union[bytes, str], profile: Optional[str] = None) -> OCRResult:
+    """Validate an upload (bytes or spooled file path) and extract its text.
+
+    Runs inside an OCR worker process. The image is decoded once and the same
+    grayscale buffer is used for validation and preprocessing.
+    """
+    start = time.perf_counter()
+    decoded = decode_image(source)
+    decode_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    result = extract_text_from_decoded(decoded, profile)
+    return result._replace(timings={"decode": decode_ms, **result.timings})
+
+
+def inspect_upload(source: Union[bytes, str]) -> DocumentInfo:
+    """Find the pages of a multi-page upload and which of them can skip OCR.
+
+    Pages whose embedded text layer has at least ``pdf_text_layer_min_chars`` characters
+    after cleaning are treated as born-digital; the rest are left as None for OCR.
+    """
+    info = inspect_document(source)
+    text_layers = []
+    for text in info.text_layers:
+        text = clean_ocr_text(text) if text else ""
+        text_layers.append(text if len(text) >= settings.pdf_text_layer_min_chars else None)
+    return DocumentInfo(info.kind, info.page_count, text_layers)
+
+
+def ocr_page(source: Union[bytes, str], page_index: int, profile: Optional[str] = None) -> OCRResult:
+    """Decode and OCR a single page of a PDF or multi-page TIFF (runs inside an OCR worker process)."""
+    start = time.perf_counter()
+    decoded = decode_page(source, page_index, profile)
+    decode_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    result = extract_text_from_decoded(decoded, profile)
+    return result._replace(timings={"decode": decode_ms, **result.timings})
\ No newline at end of file
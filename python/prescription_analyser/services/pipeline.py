@@ -0,0 +1,448 @@
+import time
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple, Union
+from pydantic import ValidationError
+from config import settings, logger
+from db.formulary import FORMULARY
+from models.schemas import Medication, PrescriptionResponse, PrescriptionData
+from services.analysis_context import AnalysisContext, build_contexts
+from services.ocr_engine import OCR_ENGINE
+from services.ocr_backends import WordConfidences
+from services.correction_gate import CorrectionDecision, confidence_summary, decide_correction
+from services.document_loader import detect_document_kind, inspect_document
+from services.ocr_service import OCRResult, inspect_upload, ocr_page, ocr_upload
+from services.text_processor import (
+    CORRECTION_MODEL, EXTRACTION_MODEL, correct_and_extract_with_llm, correct_spans_with_groq, correct_text_with_groq,
+    extract_medications_with_rules, extract_structured_medications, get_llm_mode
+)
+from services.llm_client import LLM_CLIENT
+from services.prescription_parser import parse_prescription_text
+from utils.cache import TieredCache, make_cache_key
+from utils.resilience import deadline_after, deadline_scope
+from utils.upload import IngestedUpload
+
+# Async callback receiving (stage, data) as each pipeline stage finishes
+StageCallback = Callable[[str, dict], Awaitable[None]]
+
+# Bump whenever OCR, correction or parsing changes in a way that alters results
+PIPELINE_VERSION = "4"
+
+# Finished responses keyed by upload content and pipeline configuration
+RESULT_CACHE = TieredCache(
+    "prescription_results",
+    settings.cache_db_path,
+    ttl_seconds=settings.result_cache_ttl_seconds,
+    memory_entries=settings.result_cache_memory_entries,
+    max_disk_mb=settings.result_cache_max_disk_mb,
+)
+
+
+def llm_cache_settings() -> Tuple[str, ...]:
+    """The LLM settings that shape a result: a fake provider's answers must not be served for Groq's."""
+    return LLM_CLIENT.provider.name, CORRECTION_MODEL, EXTRACTION_MODEL, str(settings.enable_ai_correction)
+
+
+def text_cache_settings() -> Tuple[str, ...]:
+    """Settings and data that shape the text stages: the formulary contents, the text cap and the correction gate."""
+    FORMULARY.refresh()
+    return FORMULARY.checksum, *(str(value) for value in (
+        settings.max_text_chars, settings.correction_gate_enabled, settings.correction_gate_mean_confidence,
+        settings.correction_gate_min_confidence, settings.correction_gate_fuzzy_score,
+        settings.correction_gate_spans, settings.correction_gate_max_span_fraction,
+    ))
+
+
+def result_cache_key(upload: IngestedUpload, profile: str, llm_mode: str) -> str:
+    """Key an analysis by the upload content hash plus everything that shapes its result."""
+    return make_cache_key(
+        upload.sha256, PIPELINE_VERSION, profile, llm_mode, settings.ocr_config,
+        str(settings.layout_analysis), str(settings.layout_detect_orientation),
+        *llm_cache_settings(), *text_cache_settings()
+    )
+
+
+def text_cache_key(text: str, llm_mode: str) -> str:
+    """Key a text analysis by the text plus everything that shapes its result."""
+    return make_cache_key("text", text, PIPELINE_VERSION, llm_mode, *llm_cache_settings(), *text_cache_settings())
+
+
+async def get_cached_response(cache_key: str) -> Optional[PrescriptionResponse]:
+    """Look up a finished response, treating unreadable entries as misses."""
+    cached = await asyncio.to_thread(RESULT_CACHE.get, cache_key)
+    if cached is None:
+        return None
+    try:
+        return PrescriptionResponse.model_validate_json(cached)
+    except ValidationError as e:
+        logger.warning(f"Ignoring unreadable cached result: {e}")
+        return None
+
+
+async def emit_stage(on_stage: Optional[StageCallback], stage: str, data: dict):
+    """Report a finished pipeline stage to the caller's callback, if any."""
+    if on_stage is not None:
+        await on_stage(stage, data)
+
+
+async def correct_extracted_text(extracted_text: str, decision: Optional[CorrectionDecision]) -> Tuple[str, str]:
+    """Apply the correction decided on: none, low-confidence fragments only, or full.
+
+    Returns the text and the correction actually applied: the decision's action,
+    "full" when span correction fell back to it, "failed" when the LLM call failed
+    and the OCR text was kept, or "disabled" without a decision.
+    """
+    if decision is None:
+        return extracted_text, "disabled"
+    if decision.action in ("skipped", "unavailable"):
+        return extracted_text, decision.action
+    if decision.action == "spans":
+        corrected_text = await correct_spans_with_groq(extracted_text, decision.spans)
+        if corrected_text is not None:
+            return corrected_text, "spans"
+    corrected_text = await correct_text_with_groq(extracted_text)
+    if corrected_text is None:
+        return extracted_text, "failed"
+    return corrected_text, "full"
+
+
+def is_degraded(correction: str, extraction_degraded: bool) -> bool:
+    """Whether an LLM stage fell back (correction unavailable or failed, or rule-based
+    extraction standing in for a failed LLM call). Such results are not cached, since
+    they would outlive the outage."""
+    return correction in ("unavailable", "failed") or extraction_degraded
+
+
+async def correction_stage(
+    extracted_text: str, on_stage: Optional[StageCallback] = None, llm_mode: Optional[str] = None,
+    words: Optional[WordConfidences] = None
+) -> Tuple[str, Optional[List[Medication]], str]:
+    """Decide on and run AI correction of OCR output.
+
+    OCR word confidences decide whether correction is skipped, limited to low-confidence
+    fragments or run in full. In single_pass mode one LLM call corrects and extracts;
+    an invalid reply falls back to the two calls. While the LLM is unavailable (circuit
+    open or request deadline passed) correction is skipped. Returns the corrected text,
+    the medications single_pass extracted with it (None otherwise) and the correction
+    actually applied (see ``correct_extracted_text``).
+    """
+    decision = None
+    if settings.enable_ai_correction and not LLM_CLIENT.available():
+        logger.warning("LLM unavailable, using OCR text and rule-based extraction")
+        decision = CorrectionDecision("unavailable", [], confidence_summary(words))
+    elif settings.enable_ai_correction:
+        decision = await asyncio.to_thread(decide_correction, extracted_text, words)
+
+    combined = None
+    if get_llm_mode(llm_mode) == "single_pass" and decision is not None and decision.action == "full":
+        combined = await correct_and_extract_with_llm(extracted_text)
+
+    if combined is not None:
+        (corrected_text, medications), correction = combined, "full"
+    else:
+        (corrected_text, correction), medications = await correct_extracted_text(extracted_text, decision), None
+    await emit_stage(on_stage, "corrected_text", {"corrected_text": corrected_text})
+    return corrected_text, medications, correction
+
+
+async def parse_stage(
+    corrected_text: str, context: AnalysisContext, medications: Optional[List[Medication]] = None,
+    on_stage: Optional[StageCallback] = None
+) -> Tuple[PrescriptionData, List[Medication], bool]:
+    """Extract medications (unless correction already did) and parse the corrected text.
+
+    The extractors and the parser share ``context``, the AnalysisContext of
+    ``corrected_text``. CPU-bound work runs in a thread so the event loop keeps
+    serving other requests. Also returns whether LLM extraction was unavailable or
+    failed, leaving the rule-based fallback's medications.
+    """
+    degraded = False
+    if medications is None:
+        # Extract structured medication data; the parser reuses its mentions and Doc
+        medications, degraded = await extract_structured_medications(corrected_text, context)
+    elif not medications:
+        # Same rule-based fallback as the two-pass path when the LLM finds nothing
+        medications = await asyncio.to_thread(extract_medications_with_rules, corrected_text, context)
+    await emit_stage(on_stage, "medications", {"medications": medications})
+
+    # Parse structured data
+    prescription_details = await asyncio.to_thread(parse_prescription_text, corrected_text, context)
+
+    # Add medications to the response
+    prescription_details.medications = medications
+    await emit_stage(on_stage, "parsed_data", {"parsed_data": prescription_details})
+    return prescription_details, medications, degraded
+
+
+async def process_extracted_text(
+    extracted_text: str, on_stage: Optional[StageCallback] = None, llm_mode: Optional[str] = None,
+    words: Optional[WordConfidences] = None
+) -> Tuple[str, PrescriptionData, List[Medication], str, bool]:
+    """Run AI correction, medication extraction and parsing on OCR output.
+
+    See ``correction_stage`` and ``parse_stage``. Also returns the correction applied
+    and whether the result is degraded (see ``is_degraded``).
+    """
+    corrected_text, medications, correction = await correction_stage(extracted_text, on_stage, llm_mode, words)
+    context = AnalysisContext(corrected_text)
+    prescription_details, medications, extraction_degraded = await parse_stage(
+        corrected_text, context, medications, on_stage
+    )
+    degraded = is_degraded(correction, extraction_degraded)
+    return corrected_text, prescription_details, medications, correction, degraded
+
+
+async def extract_document_text(
+    upload: IngestedUpload, profile: str, on_stage: Optional[StageCallback] = None
+) -> Tuple[OCRResult, int]:
+    """OCR an image, or the pages of a PDF/multi-page TIFF in parallel
+    (``document_page_concurrency`` at a time).
+
+    Pages are merged in order into a single text so the downstream stages produce one
+    PrescriptionData per document. PDF pages with an embedded text layer skip OCR.
+    Returns the merged result and the page count.
+    """
+    if detect_document_kind(upload.source) == "image":
+        if on_stage is not None:
+            # Only a header check, so followers hear about bad uploads before OCR runs
+            info = await asyncio.to_thread(inspect_document, upload.source)
+            await emit_stage(on_stage, "validated", {"kind": info.kind, "page_count": info.page_count})
+        return await OCR_ENGINE.submit(ocr_upload, upload.source, profile), 1
+
+    # Every page job reopens the document, so give workers a path instead of the bytes
+    await asyncio.to_thread(upload.spool)
+
+    start = time.perf_counter()
+    info = await OCR_ENGINE.submit(inspect_upload, upload.source)
+    timings = {"inspect": round((time.perf_counter() - start) * 1000, 2)}
+    await emit_stage(on_stage, "validated", {"kind": info.kind, "page_count": info.page_count})
+
+    ocr_pages = [i for i, text in enumerate(info.text_layers) if text is None]
+    # A document queues its own pages rather than filling the engine's queue, where
+    # they would crowd out (and be rejected alongside) other requests' jobs
+    semaphore = asyncio.Semaphore(max(1, settings.document_page_concurrency))
+
+    async def ocr_one(page_index: int) -> OCRResult:
+        async with semaphore:
+            return await OCR_ENGINE.submit(ocr_page, upload.source, page_index, profile)
+
+    tasks = [asyncio.create_task(ocr_one(i)) for i in ocr_pages]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        # One page failed or the request went away: drop the pages not yet running
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    page_texts = list(info.text_layers)
+    # Embedded text layers count as fully confident
+    page_words = [[(word, 100.0) for word in text.split()] if text else [] for text in page_texts]
+    regions = []
+    for page_index, result in zip(ocr_pages, results):
+        page_texts[page_index] = result.text
+        page_words[page_index] = result.words if result.text else []
+        regions.extend({**region, "page": page_index} for region in result.regions or [])
+        # Stage timings are summed over pages (worker time, not wall time)
+        for stage, ms in result.timings.items():
+            timings[stage] = round(timings.get(stage, 0) + ms, 2)
+
+    logger.info(f"Extracted text from {info.page_count}-page {info.kind} ({len(ocr_pages)} pages OCR'd)")
+    merged_text = "\n".join(text for text in page_texts if text)
+    # Only trust the confidences if every page has them
+    words = None if any(w is None for w in page_words) else [word for w in page_words for word in w]
+    return OCRResult(merged_text, timings, regions or None, words or None), info.page_count
+
+
+async def analyze_image(
+    upload: IngestedUpload, profile: Optional[str] = None, on_stage: Optional[StageCallback] = None,
+    llm_mode: Optional[str] = None, deadline: Optional[float] = None
+) -> PrescriptionResponse:
+    """Analyze one prescription image without blocking the event loop.
+
+    Validation, preprocessing and OCR run in the OCR engine's worker processes; LLM
+    calls are awaited and NLP parsing runs in a thread so other requests keep being
+    served. Any spooled upload file is removed once the analysis finishes.
+    ``on_stage`` is awaited with validated, raw_text, corrected_text, medications and
+    parsed_data as those stages finish. LLM stages still running at ``deadline`` (a
+    ``time.monotonic()`` value, see ``deadline_after``) give way to the rule-based path.
+    """
+    try:
+        with deadline_scope(deadline):
+            return await _analyze_image(upload, profile, on_stage, llm_mode)
+    finally:
+        upload.cleanup()
+
+
+async def analyze_batch(
+    uploads: List[IngestedUpload], profile: Optional[str] = None, concurrency: int = 1,
+    llm_mode: Optional[str] = None, deadline_seconds: Optional[float] = None
+) -> AsyncIterator[PrescriptionResponse]:
+    """Analyze several uploads concurrently, yielding each response as soon as it is done.
+
+    At most ``concurrency`` images of the batch are in flight at once, so a large batch
+    queues behind itself instead of filling the OCR engine. A failed image yields an
+    error response and does not stop the rest of the batch. Each image gets its own
+    ``deadline_seconds`` budget, counted from when it starts.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(upload: IngestedUpload) -> PrescriptionResponse:
+        async with semaphore:
+            try:
+                response = await analyze_image(
+                    upload, profile, llm_mode=llm_mode, deadline=deadline_after(deadline_seconds)
+                )
+            except Exception as e:
+                logger.error(f"Batch analysis of {upload.filename} failed: {e}")
+                response = PrescriptionResponse(success=False, error=str(e))
+        response.filename = upload.filename
+        return response
+
+    tasks = [asyncio.create_task(run(upload)) for upload in uploads]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Client went away or the stream was closed early: stop the remaining work
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for upload in uploads:
+            upload.cleanup()
+
+
+async def _analyze_image(
+    upload: IngestedUpload, profile: Optional[str], on_stage: Optional[StageCallback], llm_mode: Optional[str]
+) -> PrescriptionResponse:
+    start_time = time.time()
+    profile = profile or settings.preprocess_profile
+    llm_mode = get_llm_mode(llm_mode)
+
+    cache_key = result_cache_key(upload, profile, llm_mode) if settings.result_cache_enabled else None
+    if cache_key:
+        response = await get_cached_response(cache_key)
+        if response is not None:
+            response.cached = True
+            response.processing_time_ms = (time.time() - start_time) * 1000
+            logger.info(f"Served prescription from result cache in {response.processing_time_ms:.2f}ms")
+            return response
+
+    # Validate and extract text
+    ocr_result, page_count = await extract_document_text(upload, profile, on_stage)
+    extracted_text = ocr_result.text
+    await emit_stage(on_stage, "raw_text", {"raw_text": extracted_text, "page_count": page_count})
+
+    text_start = time.perf_counter()
+    corrected_text, prescription_details, medications, correction, degraded = await process_extracted_text(
+        extracted_text, on_stage, llm_mode, ocr_result.words
+    )
+    stage_timings = {**ocr_result.timings, "text_processing": round((time.perf_counter() - text_start) * 1000, 2)}
+
+    processing_time = (time.time() - start_time) * 1000  # Convert to milliseconds
+    logger.info(f"Processed prescription in {processing_time:.2f}ms")
+
+    response = PrescriptionResponse(
+        success=True,
+        raw_text=extracted_text,
+        corrected_text=corrected_text,
+        parsed_data=prescription_details,
+        medications=medications,
+        processing_time_ms=processing_time,
+        page_count=page_count,
+        regions=ocr_result.regions,
+        preprocess_profile=profile,
+        llm_mode=llm_mode,
+        ai_correction=correction,
+        ocr_confidence=confidence_summary(ocr_result.words),
+        stage_timings_ms=stage_timings
+    )
+    if cache_key and not degraded:
+        await asyncio.to_thread(RESULT_CACHE.set, cache_key, response.model_dump_json())
+    return response
+
+
+async def analyze_text(text: str, llm_mode: Optional[str] = None, deadline: Optional[float] = None) -> PrescriptionResponse:
+    """Analyze prescription text that needs no OCR: correction, extraction and parsing only.
+
+    Same stages and response as ``analyze_image`` after OCR; ``raw_text`` is the text
+    as given. Errors are raised.
+    """
+    with deadline_scope(deadline):
+        [result] = await _analyze_texts([text], llm_mode)
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+async def analyze_texts(
+    texts: List[str], llm_mode: Optional[str] = None, deadline: Optional[float] = None
+) -> List[PrescriptionResponse]:
+    """Analyze several prescription texts together, returning their responses in order.
+
+    Corrections run concurrently, then one ``nlp.pipe`` pass parses the corrected
+    texts likely to need the NER fallback before extraction and parsing. A text whose analysis fails gets an error
+    response and does not stop the rest. ``deadline`` covers the whole batch.
+    """
+    with deadline_scope(deadline):
+        results = await _analyze_texts(texts, llm_mode)
+    responses = []
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Text analysis failed: {result}")
+            result = PrescriptionResponse(success=False, error=str(result))
+        responses.append(result)
+    return responses
+
+
+async def _analyze_texts(texts: List[str], llm_mode: Optional[str]) -> List[Union[PrescriptionResponse, Exception]]:
+    start_time = time.time()
+    llm_mode = get_llm_mode(llm_mode)
+
+    cache_keys = [text_cache_key(text, llm_mode) if settings.result_cache_enabled else None for text in texts]
+    results: List[Union[PrescriptionResponse, Exception, None]] = [None] * len(texts)
+    if settings.result_cache_enabled:
+        results = list(await asyncio.gather(*(get_cached_response(cache_key) for cache_key in cache_keys)))
+    for response in results:
+        if response is not None:
+            response.cached = True
+            response.processing_time_ms = (time.time() - start_time) * 1000
+    pending = [i for i, response in enumerate(results) if response is None]
+
+    corrections = await asyncio.gather(
+        *(correction_stage(texts[i], llm_mode=llm_mode) for i in pending), return_exceptions=True
+    )
+    corrected = []
+    for i, correction in zip(pending, corrections):
+        if isinstance(correction, Exception):
+            results[i] = correction
+        else:
+            corrected.append((i, correction))
+
+    # One nlp.pipe pass over the texts likely to reach NER instead of a Doc per text
+    contexts = await asyncio.to_thread(build_contexts, [correction[0] for _, correction in corrected])
+    parsed = await asyncio.gather(*(
+        parse_stage(corrected_text, context, medications)
+        for (_, (corrected_text, medications, _)), context in zip(corrected, contexts)
+    ), return_exceptions=True)
+
+    for (i, (corrected_text, _, correction)), result in zip(corrected, parsed):
+        if isinstance(result, Exception):
+            results[i] = result
+            continue
+        prescription_details, medications, extraction_degraded = result
+        response = PrescriptionResponse(
+            success=True,
+            raw_text=texts[i],
+            corrected_text=corrected_text,
+            parsed_data=prescription_details,
+            medications=medications,
+            processing_time_ms=(time.time() - start_time) * 1000,
+            llm_mode=llm_mode,
+            ai_correction=correction
+        )
+        results[i] = response
+        if cache_keys[i] and not is_degraded(correction, extraction_degraded):
+            await asyncio.to_thread(RESULT_CACHE.set, cache_keys[i], response.model_dump_json())
+    logger.info(f"Processed {len(texts)} prescription texts ({len(pending)} uncached) in {(time.time() - start_time) * 1000:.2f}ms")
+    return results
@@ -1,51 +1,124 @@
 import re
-from typing import List
+import sys
+from functools import lru_cache
+from typing import List, Optional
 from models.schemas import PrescriptionData, Medication
-from services.text_processor import nlp, correct_medication_name
+from services.analysis_context import AnalysisContext
+from services.field_lexer import FieldPattern, FieldTokens
+from services.text_processor import correct_medication_name
+
+# Dosage directly after a medication name, read from the name's end offset
+DOSAGE_AFTER_NAME = re.compile(r"\s*(\d+(?:\.\d+)?)\s*(mg|ml|g|mcg|tablet|capsule|pill)", re.IGNORECASE)
+
+# Bounds on the repetitions a scan could otherwise re-run from every start position:
+# the longest name or phrase one field match captures and the longest notes. With
+# them, each start costs a fixed amount of backtracking, so every scan is linear in
+# the text length whatever the text (long runs of words without punctuation, digit
+# runs, repeated field words).
+MAX_FIELD_CHARS = 200
+MAX_NOTES_CHARS = 1000
+_FIELD = rf"[\w\s]{{1,{MAX_FIELD_CHARS}}}"
+
+# A date such as 12/03/2024 or 12 Feb 2025 (the letters can be any word up to 30 long)
+_DATE = r"\d{1,2}[\/\-\s]{0,3}[A-Za-z]{0,30}[\/\-\s]{0,3}\d{2,4}"
+
+# Field patterns, each with the trigger words (see field_lexer) its matches start with
+FREQUENCY_PATTERNS = [
+    FieldPattern(re.compile(r"(\d{1,12})\s*times?\s*(?:a|per)\s*day", re.IGNORECASE), ("time",), anchored=False),
+    FieldPattern(re.compile(r"every\s*(\d+)\s*hours?", re.IGNORECASE), ("every",)),
+    FieldPattern(re.compile(r"once\s*daily", re.IGNORECASE), ("once",)),
+    FieldPattern(re.compile(r"twice\s*daily", re.IGNORECASE), ("twice",)),
+    FieldPattern(re.compile(r"(morning|evening|night)", re.IGNORECASE), ("daytime",)),
+    FieldPattern(re.compile(r"before\s*meals", re.IGNORECASE), ("before",)),
+    FieldPattern(re.compile(r"after\s*meals", re.IGNORECASE), ("after",)),
+    FieldPattern(re.compile(r"with\s*meals", re.IGNORECASE), ("with",)),
+    FieldPattern(re.compile(r"TID", re.IGNORECASE), ("tid",)),  # Three times a day
+    FieldPattern(re.compile(r"BID", re.IGNORECASE), ("bid",)),  # Twice a day
+    FieldPattern(re.compile(r"QID", re.IGNORECASE), ("qid",)),  # Four times a day
+    FieldPattern(re.compile(r"QD", re.IGNORECASE), ("qd",)),    # Once daily
+    FieldPattern(re.compile(r"Take\s*(?:once|twice|three|four)\s*(?:times)?\s*(?:a|per|each)?\s*day", re.IGNORECASE), ("take",)),
+]
+
+PATIENT_LABEL_PATTERN = FieldPattern(
+    re.compile(rf"\(Patient's name\)\s*([\w\s\.,]{{1,{MAX_FIELD_CHARS}}}?)(?:,|$)", re.IGNORECASE), ("patient_label",)
+)
+PATIENT_PATTERNS = [
+    FieldPattern(re.compile(rf"Patient\s*(?:Name)?\s*:\s*({_FIELD}?)[,\n\.]", re.IGNORECASE), ("patient",)),
+    FieldPattern(re.compile(rf"Name\s*:\s*({_FIELD}?)[,\n\.]", re.IGNORECASE), ("name",)),
+    FieldPattern(re.compile(rf"FOR\s*(?:\(.{{0,{MAX_FIELD_CHARS}}}\))?\s*([\w\s,]{{1,{MAX_FIELD_CHARS}}}?)[,\n\.]", re.IGNORECASE), ("for",)),
+    FieldPattern(re.compile(rf"(?:Pt|Patient):\s*({_FIELD}?)[,\n\.]", re.IGNORECASE), ("pt", "patient")),
+    FieldPattern(re.compile(rf"(?:Prescribed for|For):\s*({_FIELD}?)[,\n\.]", re.IGNORECASE), ("prescribed", "for")),
+]
+
+DOCTOR_PATTERNS = [
+    FieldPattern(re.compile(rf"Dr\.?\s*({_FIELD}?)[,\n\.]", re.IGNORECASE), ("dr",)),
+    FieldPattern(re.compile(rf"Doctor\s*:\s*({_FIELD}?)[,\n\.]", re.IGNORECASE), ("doctor",)),
+    FieldPattern(re.compile(rf"Physician\s*:\s*({_FIELD}?)[,\n\.]", re.IGNORECASE), ("physician",)),
+    FieldPattern(re.compile(rf"(?:SIGNATURE|SIGNED BY)\s*([\w\s\.]{{1,{MAX_FIELD_CHARS}}})(?:\n|$)", re.IGNORECASE), ("sign",)),
+    FieldPattern(re.compile(rf"(?:Bottle|Dr\.?)\s*([\w\s\.]{{1,{MAX_FIELD_CHARS}}})(?:\n|$)", re.IGNORECASE), ("bottle", "dr")),
+]
+
+DATE_PATTERNS = [
+    FieldPattern(re.compile(rf"DATE\s*:\s*({_DATE})"), ("date",)),
+    FieldPattern(re.compile(rf"DATE\s+({_DATE})"), ("date",)),
+    FieldPattern(re.compile(rf"({_DATE})"), ("digit",)),
+]
+
+# Hospital names start wherever their run of words does, so this one is searched from the start of that run
+HOSPITAL_PATTERN = FieldPattern(
+    re.compile(rf"({_FIELD}\s*Hospital|{_FIELD}\s*Clinic|{_FIELD}\s*Medical\s*Center|MEDICAL FACILITY)", re.IGNORECASE),
+    ("facility",), anchored=False
+)
+
+NOTES_PATTERN = FieldPattern(
+    re.compile(rf"(?:Notes|Instructions|Directions|Signa):\s*([\w\s.,;]{{1,{MAX_NOTES_CHARS}}})(?:\n|$)", re.IGNORECASE),
+    ("notes", "sign")
+)
+
+CORRECTED_MEDICATION_PATTERN = FieldPattern(
+    re.compile(rf"(?:Corrected medication name\))\s*({_FIELD})(?:\s+(\d+(?:\.\d+)?)\s*(mg|ml|g|mcg|tablet|capsule|pill))?", re.IGNORECASE),
+    ("corrected",)
+)
+# Only tried from the first digit of a number: from any later digit it would match no more than from the first
+NUMBERED_MEDICATION_PATTERN = FieldPattern(
+    re.compile(rf"(?<!\d)(?:\d+\.?\s*)({_FIELD})\s+(\d+(?:\.\d+)?)\s*(mg|ml|g|mcg|tablet|capsule|pill)"), ("digit",)
+)
+
+@lru_cache(maxsize=1024)
+def _dosage_pattern(medication_name: str) -> re.Pattern:
+    """The medication name followed by a dosage, compiled once per name."""
+    return re.compile(fr"{re.escape(medication_name)}\s+(\d+(?:\.\d+)?)\s*(mg|ml|g|mcg|tablet|capsule|pill)", re.IGNORECASE)
 
 
 def extract_dosage(text: str, medication_name: str) -> str:
     """Extract dosage information for a given medication."""
     # Look for the medication name and try to find dosage after it
-    pattern = fr"{re.escape(medication_name)}\s+(\d+(?:\.\d+)?)\s*(mg|ml|g|mcg|tablet|capsule|pill)"
-    match = re.search(pattern, text, re.IGNORECASE)
+    match = _dosage_pattern(medication_name).search(text)
     if match:
         return f"{match.group(1)} {match.group(2)}"
     return ""
 
 
-def extract_frequency(text: str) -> List[str]:
-    """Extract medication frequency instructions."""
-    frequency_patterns = [
-        r"(\d+)\s*times?\s*(?:a|per)\s*day",
-        r"every\s*(\d+)\s*hours?",
-        r"once\s*daily",
-        r"twice\s*daily",
-        r"(morning|evening|night)",
-        r"before\s*meals",
-        r"after\s*meals",
-        r"with\s*meals",
-        r"TID",  # Three times a day
-        r"BID",  # Twice a day
-        r"QID",  # Four times a day
-        r"QD",   # Once daily
-        r"Take\s*(?:once|twice|three|four)\s*(?:times)?\s*(?:a|per|each)?\s*day",
-    ]
-    
+def extract_frequency(text: str, start: int = 0, end: int = sys.maxsize, tokens: Optional[FieldTokens] = None) -> List[str]:
+    """Extract medication frequency instructions from text[start:end].
+
+    ``tokens`` are the lexed triggers of the whole ``text``, so windows around each
+    medication reuse one scan; patterns whose words are absent from the window are skipped.
+    """
+    tokens = tokens or FieldTokens(text)
     frequencies = []
-    for pattern in frequency_patterns:
-        matches = re.finditer(pattern, text, re.IGNORECASE)
-        for match in matches:
+    for pattern in FREQUENCY_PATTERNS:
+        for match in tokens.finditer(pattern, start, end):
             frequencies.append(match.group(0))
             
     return frequencies
 
 
-def extract_patient_name(text: str) -> str:
+def extract_patient_name(text: str, tokens: Optional[FieldTokens] = None) -> str:
     """Extract patient name from prescription text."""
+    tokens = tokens or FieldTokens(text)
     # Look specifically for the pattern in your example
-    patient_pattern = r"\(Patient's name\)\s*([\w\s\.,]+?)(?:,|$)"
-    patient_match = re.search(patient_pattern, text, re.IGNORECASE)
+    patient_match = tokens.search(PATIENT_LABEL_PATTERN)
     
     if patient_match:
         # Extract just the name part without military info if possible
@@ -53,28 +126,29 @@ def extract_patient_name(text: str) -> str:
         return name_parts[0].strip()
     
     # Fall back to other patterns if the specific one doesn't match
-    fallback_patterns = [
-        r"Patient\s*(?:Name)?\s*:\s*([\w\s]+?)[,\n\.]",
-        r"Name\s*:\s*([\w\s]+?)[,\n\.]",
-        r"FOR\s*(?:\(.*\))?\s*([\w\s,]+?)[,\n\.]",
-        r"(?:Pt|Patient):\s*([\w\s]+?)[,\n\.]",
-        r"(?:Prescribed for|For):\s*([\w\s]+?)[,\n\.]"
-    ]
-    
-    for pattern in fallback_patterns:
-        patient_match = re.search(pattern, text, re.IGNORECASE)
+    for pattern in PATIENT_PATTERNS:
+        patient_match = tokens.search(pattern)
         if patient_match:
             return patient_match.group(1).strip()
     
     return ""
 
 
-def extract_medications(text: str, doc) -> List[Medication]:
-    """Extract medications and their details from prescription text."""
+def extract_medications(
+    text: str, context: Optional[AnalysisContext] = None, tokens: Optional[FieldTokens] = None
+) -> List[Medication]:
+    """Extract medications and their details from prescription text.
+
+    Dictionary mentions and the spaCy Doc are read from ``context`` (built here when
+    not given); the Doc is only parsed when nothing else finds a medication.
+    ``tokens`` are the lexed field triggers of ``text``.
+    """
+    context = context or AnalysisContext(text)
+    tokens = tokens or FieldTokens(text)
     medications = []
     
     # Method 1: Look for "Corrected medication name" pattern
-    corrected_med_matches = re.finditer(r"(?:Corrected medication name\))\s*([\w\s]+)(?:\s+(\d+(?:\.\d+)?)\s*(mg|ml|g|mcg|tablet|capsule|pill))?", text, re.IGNORECASE)
+    corrected_med_matches = tokens.finditer(CORRECTED_MEDICATION_PATTERN)
     
     for match in corrected_med_matches:
         med_name = match.group(1).strip()
@@ -89,9 +163,7 @@ def extract_medications(text: str, doc) -> List[Medication]:
         
         # Look for frequency information near this medication
         med_index = match.start()
-        next_section = text[med_index:med_index + 200]  # Look further ahead
-        
-        frequencies = extract_frequency(next_section)
+        frequencies = extract_frequency(text, med_index, med_index + 200, tokens)  # Look further ahead
         frequency = ", ".join(frequencies) if frequencies else None
         
         medications.append(Medication(
@@ -102,7 +174,7 @@ def extract_medications(text: str, doc) -> List[Medication]:
     
     # Method 2: Extract using numbered list format if Method 1 finds nothing
     if not medications:
-        med_matches = re.findall(r"(?:\d+\.?\s*)([\w\s]+)\s+(\d+(?:\.\d+)?)\s*(mg|ml|g|mcg|tablet|capsule|pill)", text)
+        med_matches = (match.groups() for match in tokens.finditer(NUMBERED_MEDICATION_PATTERN))
         
         for match in med_matches:
             med_name = match[0].strip()
@@ -113,8 +185,7 @@ def extract_medications(text: str, doc) -> List[Medication]:
             med_index = text.find(med_name)
             if med_index != -1:
                 # Look for frequency in the next 100 characters after medication
-                next_section = text[med_index:med_index + 100]
-                frequencies = extract_frequency(next_section)
+                frequencies = extract_frequency(text, med_index, med_index + 100, tokens)
                 frequency = ", ".join(frequencies) if frequencies else None
                 
                 medications.append(Medication(
@@ -123,9 +194,23 @@ def extract_medications(text: str, doc) -> List[Medication]:
                     frequency=frequency
                 ))
     
-    # Method 3: Use SpaCy NER for medications not found by regex
+    # Method 3: Formulary names found by the dictionary scanner, dosage read right after each name
     if not medications:
-        for ent in doc.ents:
+        for mention in context.mentions:
+            if mention.label != "MEDICATION" or any(med.name == mention.term for med in medications):
+                continue
+            dosage_match = DOSAGE_AFTER_NAME.match(text, mention.end)
+            if dosage_match:  # Only add if we found a dosage
+                frequencies = extract_frequency(text, mention.start, mention.start + 100, tokens)
+                medications.append(Medication(
+                    name=mention.term,
+                    dosage=f"{dosage_match.group(1)} {dosage_match.group(2)}",
+                    frequency=", ".join(frequencies) if frequencies else None
+                ))
+
+    # Method 4: Use SpaCy NER for medications missing from the formulary
+    if not medications:
+        for ent in context.doc.ents:
             if ent.label_ == "CHEMICAL":
                 med_name = ent.text
                 corrected_name = correct_medication_name(med_name)
@@ -137,8 +222,7 @@ def extract_medications(text: str, doc) -> List[Medication]:
                         # Look for frequency
                         med_index = text.find(med_name)
                         if med_index != -1:
-                            next_section = text[med_index:med_index + 100]
-                            frequencies = extract_frequency(next_section)
+                            frequencies = extract_frequency(text, med_index, med_index + 100, tokens)
                             frequency = ", ".join(frequencies) if frequencies else None
                             
                             medications.append(Medication(
@@ -150,57 +234,52 @@ def extract_medications(text: str, doc) -> List[Medication]:
     return medications
 
 
-def parse_prescription_text(text: str) -> PrescriptionData:
-    """Parse prescription details without adding explanatory text at newlines."""
+def parse_prescription_text(text: str, context: Optional[AnalysisContext] = None) -> PrescriptionData:
+    """Parse prescription details without adding explanatory text at newlines.
+
+    Pass the ``context`` already built for ``text`` to reuse its mentions and Doc.
+    """
     # Initialize empty prescription data object
     prescription_data = PrescriptionData()
     
-    # Clean input text - normalize newlines and whitespace
-    text = re.sub(r'\s+', ' ', text.strip())
+    # Clean input text - the context normalizes newlines and whitespace
+    context = context or AnalysisContext(text)
+    text = context.text
     
-    # Process with SpaCy for NER
-    doc = nlp(text)
+    # One lexer pass finds the trigger words of every field pattern below
+    tokens = FieldTokens(text)
     
     # Extract data fields without adding explanatory text
-    prescription_data.patient = extract_patient_name(text)
-    prescription_data.medications = extract_medications(text, doc)
+    prescription_data.patient = extract_patient_name(text, tokens)
+    prescription_data.medications = extract_medications(text, context, tokens)
+    prescription_data.conditions = list(dict.fromkeys(
+        mention.term for mention in context.mentions if mention.label == "CONDITION"
+    ))
     
     # Extract doctor's name
-    doctor_patterns = [
-        r"Dr\.?\s*([\w\s]+?)[,\n\.]",
-        r"Doctor\s*:\s*([\w\s]+?)[,\n\.]",
-        r"Physician\s*:\s*([\w\s]+?)[,\n\.]",
-        r"(?:SIGNATURE|SIGNED BY)\s*([\w\s\.]+)(?:\n|$)",
-        r"(?:Bottle|Dr\.?)\s*([\w\s\.]+)(?:\n|$)"
-    ]
-    
-    for pattern in doctor_patterns:
-        doctor_match = re.search(pattern, text, re.IGNORECASE)
+    for pattern in DOCTOR_PATTERNS:
+        doctor_match = tokens.search(pattern)
         if doctor_match:
             prescription_data.doctor = doctor_match.group(1).strip()
             break
     
     # Extract date
-    date_patterns = [
-        r"DATE\s*:\s*(\d{1,2}[\/\-\s]*[A-Za-z]*[\/\-\s]*\d{2,4})",
-        r"DATE\s+(\d{1,2}[\/\-\s]*[A-Za-z]*[\/\-\s]*\d{2,4})",
-        r"(\d{1,2}[\/\-\s]*[A-Za-z]*[\/\-\s]*\d{2,4})"
-    ]
-    
-    for pattern in date_patterns:
-        date_match = re.search(pattern, text)
+    for pattern in DATE_PATTERNS:
+        date_match = tokens.search(pattern)
         if date_match:
             prescription_data.date = date_match.group(1).strip()
             break
     
     # Extract hospital/clinic
-    hospital_match = re.search(r"([\w\s]+\s*Hospital|[\w\s]+\s*Clinic|[\w\s]+\s*Medical\s*Center|MEDICAL FACILITY)", text, re.IGNORECASE)
-    if hospital_match:
-        prescription_data.hospital = hospital_match.group(1).strip()
+    facility = tokens.first(HOSPITAL_PATTERN.kinds)
+    if facility is not None:
+        hospital_match = tokens.search(HOSPITAL_PATTERN, tokens.name_run_start(facility))
+        if hospital_match:
+            prescription_data.hospital = hospital_match.group(1).strip()
     
     # Extract notes/additional instructions
-    notes_match = re.search(r"(?:Notes|Instructions|Directions|Signa):\s*([\w\s.,;]+)(?:\n|$)", text, re.IGNORECASE)
+    notes_match = tokens.search(NOTES_PATTERN)
     if notes_match:
         prescription_data.notes = notes_match.group(1).strip()
     
-    return prescription_data
\ No newline at end of file
+    return prescription_data
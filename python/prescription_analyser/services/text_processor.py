@@ -1,153 +1,291 @@
-import time
-import spacy
+import json
 import re
-from groq import Groq
-from functools import lru_cache
-from fuzzywuzzy import process
+import asyncio
+from typing import List, Optional, Tuple
+from pydantic import ValidationError
 from config import settings, logger
-from db.medicine_db import ALL_MEDICINES
+from models.schemas import CorrectedExtraction, Medication, SpanCorrections
+from services.llm_client import LLM_CLIENT
+from services.med_matcher import get_medication_matcher
+from services.analysis_context import AnalysisContext
 
-# Load medical NLP model
-try:
-    nlp = spacy.load("en_core_sci_sm")
-    logger.info("Successfully loaded SpaCy NLP model")
-except Exception as e:
-    logger.warning(f"Failed to load SpaCy model: {e}. Using fallback model.")
-    nlp = spacy.load("en_core_web_sm")
 
+# Common dosage patterns. A dosage starts where its digit run does: a match from inside
+# the run would also match from its start, and trying each digit makes long runs quadratic.
+DOSAGE_PATTERN = re.compile(r'(?<!\d)(\d+(?:\.\d+)?)\s*(mg|mcg|g|ml|tablet|capsule|tablespoon|teaspoon)', re.IGNORECASE)
 
-def correct_text_with_groq(text: str) -> str:
-    """Use Groq AI model to correct OCR errors with error handling and retries."""
+# Common frequency patterns including medical abbreviations (QD, BID, TID, QID)
+FREQUENCY_PATTERN = re.compile(
+    r'(once|twice|three times|four times|every\s*\d+\s*hours?|daily|weekly|monthly|morning|evening|night|before meal|after meal|QD|BID|TID|QID)',
+    re.IGNORECASE
+)
+
+# Medical frequency abbreviations and what they mean
+FREQUENCY_ABBREVIATIONS = {
+    "QD": "once daily",
+    "BID": "twice daily",
+    "TID": "three times daily",
+    "QID": "four times daily"
+}
+
+# two_pass: correct the OCR text, then extract medications from it (two LLM round trips)
+# single_pass: one call returns both, falling back to two_pass when the reply is invalid
+LLM_PIPELINE_MODES = ("two_pass", "single_pass")
+
+
+def get_llm_mode(name: Optional[str] = None) -> str:
+    """Return the named LLM pipeline mode, defaulting to the configured one."""
+    name = name or settings.llm_pipeline_mode
+    if name not in LLM_PIPELINE_MODES:
+        raise ValueError(f"Unknown LLM pipeline mode '{name}'. Choose one of: {', '.join(LLM_PIPELINE_MODES)}")
+    return name
+
+
+# Models behind each LLM step; they are part of the LLM and result cache keys
+CORRECTION_MODEL = "gemma2-9b-it"
+EXTRACTION_MODEL = "llama-3.1-70b-versatile"  # Using a powerful LLM for accurate extraction
+
+# Prompts are part of the LLM cache key: editing one invalidates its cached replies
+CORRECTION_PROMPT = (
+    "You are an AI assistant that corrects OCR-extracted text from medical prescriptions. "
+    "Maintain the original format but fix spelling errors, especially in medication names. "
+    "Only output the corrected text, nothing else."
+)
+CORRECTION_USER_PROMPT = "Correct the following OCR text from a medical prescription:\n{text}"
+
+EXTRACTION_PROMPT = (
+    "You are a medical prescription analyzer specialized in extracting medication information. "
+    "Extract all medications from the prescription with their complete details. "
+    "For each medication, identify: "
+    "1. Exact name (correct any misspellings) "
+    "2. Dosage (amount and unit) "
+    "3. Administration instructions (frequency, timing, etc.) "
+    "Respond ONLY with a JSON array of medication objects containing 'name', 'dosage', and 'instructions' fields. "
+    "Example format: [{\"name\":\"Metformin\",\"dosage\":\"500 mg\",\"instructions\":\"1 tablet twice daily\"}]"
+)
+EXTRACTION_USER_PROMPT = "Extract medications from this prescription:\n{text}"
+
+SPAN_CORRECTION_PROMPT = (
+    "You are an AI assistant that corrects OCR-extracted fragments of medical prescriptions. "
+    "Each input line is a separate fragment. Fix spelling errors, especially in medication names, "
+    "and change nothing else. "
+    "Respond ONLY with a JSON object whose 'corrections' field is an array holding one corrected "
+    "string per input line, in the same order."
+)
+SPAN_CORRECTION_USER_PROMPT = "Correct these OCR fragments from a medical prescription, one per line:\n{text}"
+
+CORRECT_AND_EXTRACT_PROMPT = (
+    "You are an AI assistant that corrects OCR-extracted text from medical prescriptions "
+    "and extracts the medications it lists. "
+    "First fix spelling errors, especially in medication names, keeping the original format. "
+    "Then, from the corrected text, identify for each medication: "
+    "1. Exact name "
+    "2. Dosage (amount and unit) "
+    "3. Administration instructions (frequency, timing, etc.) "
+    "Respond ONLY with a JSON object with two fields: 'corrected_text' (the full corrected text) and "
+    "'medications' (an array of objects with 'name', 'dosage' and 'instructions' fields). "
+    "Example format: {\"corrected_text\":\"...\",\"medications\":"
+    "[{\"name\":\"Metformin\",\"dosage\":\"500 mg\",\"instructions\":\"1 tablet twice daily\"}]}"
+)
+CORRECT_AND_EXTRACT_USER_PROMPT = (
+    "Correct this OCR text from a medical prescription and extract its medications:\n{text}"
+)
+
+
+async def correct_text_with_groq(text: str) -> Optional[str]:
+    """Use Groq AI model to correct OCR errors with error handling and retries.
+
+    Returns None when every attempt fails, so the caller knows the OCR text was kept.
+    """
     if not settings.enable_ai_correction:
         logger.info("AI correction disabled")
         return text
 
-    max_retries = 3
-    retry_delay = 1
-    
-    for attempt in range(max_retries):
-        try:
-            # Configure Groq client
-            client = Groq(api_key=settings.groq_api_key)
-            
-            response = client.chat.completions.create(
-                model="gemma2-9b-it",
-                messages=[
-                    {"role": "system", "content": (
-                        "You are an AI assistant that corrects OCR-extracted text from medical prescriptions. "
-                        "Maintain the original format but fix spelling errors, especially in medication names. "
-                        "Only output the corrected text, nothing else."
-                    )},
-                    {"role": "user", "content": f"Correct the following OCR text from a medical prescription:\n{text}"}
-                ],
-                temperature=0.6,  # Lower temperature for more predictable corrections
-                max_tokens=1024
-            )
-            corrected_text = response.choices[0].message.content.strip()
-            logger.info("Successfully corrected text with AI")
-            return corrected_text
-            
-        except Exception as e:
-            logger.warning(f"Groq API Error (attempt {attempt+1}/{max_retries}): {e}")
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-                retry_delay *= 2  # Exponential backoff
-            else:
-                logger.error(f"Failed all {max_retries} attempts to correct text with Groq")
-                return text  # Return original text if all retries fail
-
-
-def extract_medications_with_llm(text: str) -> list:
-    """Use LLM to extract structured medication information from complex prescriptions."""
-    max_retries = 2
-    retry_delay = 1
-    
-    for attempt in range(max_retries):
+    try:
+        corrected_text = await LLM_CLIENT.complete(
+            CORRECTION_MODEL,
+            CORRECTION_PROMPT,
+            CORRECTION_USER_PROMPT,
+            text,
+            max_retries=3,
+            temperature=0.6,  # Lower temperature for more predictable corrections
+            max_tokens=1024
+        )
+        logger.info("Successfully corrected text with AI")
+        return corrected_text
+    except Exception as e:
+        logger.error(f"AI correction failed, keeping OCR text: {e}")
+        return None
+
+
+async def correct_spans_with_groq(text: str, spans: List[str]) -> Optional[str]:
+    """Correct only the given fragments of ``text`` with the LLM and splice the fixes back in.
+
+    Returns None when the call fails or the reply does not hold one correction per
+    fragment, so the caller can correct the whole text instead.
+    """
+    try:
+        result = await LLM_CLIENT.complete(
+            CORRECTION_MODEL,
+            SPAN_CORRECTION_PROMPT,
+            SPAN_CORRECTION_USER_PROMPT,
+            "\n".join(spans),
+            max_retries=3,
+            validate=SpanCorrections.model_validate_json,
+            temperature=0.2,
+            max_tokens=1024,
+            response_format={"type": "json_object"}
+        )
+        corrections = SpanCorrections.model_validate_json(result).corrections
+    except Exception as e:
+        logger.warning(f"Span correction failed: {e}")
+        return None
+    if len(corrections) != len(spans):
+        logger.warning(f"Span correction returned {len(corrections)} fragments for {len(spans)}")
+        return None
+
+    # Replace each fragment at its next occurrence, matching across line breaks
+    parts, position = [], 0
+    for span, correction in zip(spans, corrections):
+        pattern = r"\s+".join(re.escape(word) for word in span.split())
+        match = re.compile(pattern).search(text, position)
+        if match is None:
+            continue
+        parts.append(text[position:match.start()])
+        parts.append(correction.strip())
+        position = match.end()
+    parts.append(text[position:])
+    logger.info(f"Corrected {len(spans)} low-confidence fragments with AI")
+    return "".join(parts)
+
+
+def parse_json_object(content: str) -> dict:
+    """Parse an LLM reply that must be a JSON object; raises ValueError otherwise."""
+    parsed = json.loads(content)
+    if not isinstance(parsed, dict):
+        raise ValueError(f"Expected a JSON object, got {type(parsed).__name__}")
+    return parsed
+
+
+def to_medications(entries: list) -> List[Medication]:
+    """Extracted medication entries as Medication models; entries that do not validate are dropped."""
+    if not isinstance(entries, list):
+        logger.warning(f"Ignoring medications that are not a list: {entries!r}")
+        return []
+    medications = []
+    for entry in entries:
         try:
-            # Configure Groq client
-            client = Groq(api_key=settings.groq_api_key)
-            
-            response = client.chat.completions.create(
-                model="llama-3.1-70b-versatile",  # Using a powerful LLM for accurate extraction
-                messages=[
-                    {"role": "system", "content": (
-                        "You are a medical prescription analyzer specialized in extracting medication information. "
-                        "Extract all medications from the prescription with their complete details. "
-                        "For each medication, identify: "
-                        "1. Exact name (correct any misspellings) "
-                        "2. Dosage (amount and unit) "
-                        "3. Administration instructions (frequency, timing, etc.) "
-                        "Respond ONLY with a JSON array of medication objects containing 'name', 'dosage', and 'instructions' fields. "
-                        "Example format: [{\"name\":\"Metformin\",\"dosage\":\"500 mg\",\"instructions\":\"1 tablet twice daily\"}]"
-                    )},
-                    {"role": "user", "content": f"Extract medications from this prescription:\n{text}"}
-                ],
-                temperature=0.2,  # Low temperature for more deterministic extraction
-                max_tokens=1024,
-                response_format={"type": "json_object"}
-            )
-            
-            result = response.choices[0].message.content.strip()
-            logger.info("Successfully extracted medications with LLM")
-            
-            import json
-            try:
-                # Parse the JSON response
-                parsed_response = json.loads(result)
-                if "medications" in parsed_response:
-                    return parsed_response["medications"]
-                return parsed_response.get("medications", [])
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to parse LLM response as JSON: {e}")
-                logger.debug(f"Raw LLM response: {result}")
-                return []
-            
-        except Exception as e:
-            logger.warning(f"LLM Extraction Error (attempt {attempt+1}/{max_retries}): {e}")
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-                retry_delay *= 2  # Exponential backoff
-            else:
-                logger.error(f"Failed all {max_retries} attempts to extract medications with LLM")
-                return []  # Return empty list if all retries fail
+            medications.append(Medication.model_validate(entry))
+        except ValidationError as e:
+            logger.warning(f"Dropping invalid medication entry {entry!r}: {e}")
+    return medications
+
+
+async def extract_medications_with_llm(text: str) -> Optional[List[Medication]]:
+    """Use LLM to extract structured medication information from complex prescriptions.
+
+    Returns None when the call fails or the reply is not a JSON object.
+    """
+    try:
+        result = await LLM_CLIENT.complete(
+            EXTRACTION_MODEL,
+            EXTRACTION_PROMPT,
+            EXTRACTION_USER_PROMPT,
+            text,
+            max_retries=2,
+            validate=parse_json_object,  # Only cache replies that parse to an object
+            temperature=0.2,  # Low temperature for more deterministic extraction
+            max_tokens=1024,
+            response_format={"type": "json_object"}
+        )
+    except Exception as e:
+        logger.error(f"LLM medication extraction failed: {e}")
+        return None
+
+    logger.info("Successfully extracted medications with LLM")
+    try:
+        # Parse the JSON response
+        parsed_response = parse_json_object(result)
+    except ValueError as e:  # Includes json.JSONDecodeError
+        logger.error(f"Failed to parse LLM response as a JSON object: {e}")
+        logger.debug(f"Raw LLM response: {result}")
+        return None
+    return to_medications(parsed_response.get("medications", []))
+
+
+async def correct_and_extract_with_llm(text: str) -> Optional[Tuple[str, List[Medication]]]:
+    """Correct OCR text and extract its medications in a single LLM call.
+
+    Returns None when the call fails or the reply does not match CorrectedExtraction,
+    so the caller can fall back to the two-call path.
+    """
+    try:
+        result = await LLM_CLIENT.complete(
+            EXTRACTION_MODEL,
+            CORRECT_AND_EXTRACT_PROMPT,
+            CORRECT_AND_EXTRACT_USER_PROMPT,
+            text,
+            max_retries=2,
+            validate=CorrectedExtraction.model_validate_json,
+            temperature=0.2,  # Low temperature for more deterministic extraction
+            max_tokens=2048,
+            response_format={"type": "json_object"}
+        )
+    except Exception as e:
+        logger.error(f"Single-pass LLM call failed: {e}")
+        return None
+
+    try:
+        parsed = CorrectedExtraction.model_validate_json(result)
+    except ValidationError as e:
+        logger.warning(f"Invalid single-pass LLM response, falling back to two calls: {e}")
+        logger.debug(f"Raw LLM response: {result}")
+        return None
+    logger.info(f"Corrected text and extracted {len(parsed.medications)} medications in one LLM call")
+    return parsed.corrected_text, parsed.medications
 
 
-@lru_cache(maxsize=100)
 def correct_medication_name(med_name: str) -> str:
     """Use fuzzy matching to correct medication names with caching."""
-    match, score = process.extractOne(med_name, ALL_MEDICINES)
-    logger.debug(f"Medication match: '{med_name}' → '{match}' (score: {score})")
-    return match if score > settings.fuzzy_match_threshold else med_name
+    return get_medication_matcher().correct(med_name)
 
 
-def extract_structured_medications(text: str) -> list:
+async def extract_structured_medications(
+    text: str, context: Optional[AnalysisContext] = None
+) -> Tuple[List[Medication], bool]:
     """Extract structured medication information from prescription text.
-    First tries LLM-based extraction, then falls back to rule-based extraction if needed."""
+    First tries LLM-based extraction, then falls back to rule-based extraction if needed.
+    While the LLM is unavailable (circuit open or deadline passed) only the rules run.
+    The rules read ``context`` when the caller already built one for the text.
+    Also returns whether the LLM step was unavailable or failed (degraded), as
+    opposed to finding nothing."""
     
     # Try LLM-based extraction first for complex prescriptions
-    llm_medications = extract_medications_with_llm(text)
-    if llm_medications and len(llm_medications) > 0:
+    llm_medications = await extract_medications_with_llm(text) if LLM_CLIENT.available() else None
+    if llm_medications:
         logger.info(f"Successfully extracted {len(llm_medications)} medications using LLM")
-        return llm_medications
-    
+        return llm_medications, False
+
+    # NLP and regex matching are CPU work, keep them off the event loop
+    return await asyncio.to_thread(extract_medications_with_rules, text, context), llm_medications is None
+
+
+def extract_medications_with_rules(text: str, context: Optional[AnalysisContext] = None) -> List[Medication]:
+    """Rule-based medication extraction: dosage/frequency patterns, then formulary mentions, then NER entities.
+
+    Mentions and the spaCy Doc come from ``context`` (built here when not given), so
+    they are shared with the parser.
+    """
+    context = context or AnalysisContext(text)
+    text = context.raw_text  # Capped at settings.max_text_chars
     # Initialize medications list for rule-based extraction
     medications = []
     
-    # Process the text with NLP model
-    doc = nlp(text)
-    
     # Common dosage patterns
-    dosage_pattern = re.compile(r'(\d+(?:\.\d+)?)\s*(mg|mcg|g|ml|tablet|capsule|tablespoon|teaspoon)', re.IGNORECASE)
-    
-    # Common frequency patterns including medical abbreviations (QD, BID, TID, QID)
-    frequency_pattern = re.compile(
-        r'(once|twice|three times|four times|every\s*\d+\s*hours?|daily|weekly|monthly|morning|evening|night|before meal|after meal|QD|BID|TID|QID)',
-        re.IGNORECASE
-    )
+    dosage_pattern = DOSAGE_PATTERN
     
     # Split text into lines to process prescription items
     lines = text.split('\n')
-    current_medication = None
     
     for i, line in enumerate(lines):
         line = line.strip()
@@ -173,7 +311,7 @@ def extract_structured_medications(text: str) -> list:
                 
                 # Extract frequency/instructions (might be on the next line)
                 instructions = ""
-                freq_match = frequency_pattern.search(line)
+                freq_match = FREQUENCY_PATTERN.search(line)
                 if freq_match:
                     instructions = line[freq_match.start():].strip()
                 elif i + 1 < len(lines) and lines[i + 1].strip() and not re.match(r'^\d+[\.\)]|•', lines[i + 1]):
@@ -183,16 +321,10 @@ def extract_structured_medications(text: str) -> list:
                 # Look for medical abbreviations in the line
                 for abbr in ["QD", "BID", "TID", "QID"]:
                     if re.search(rf'\b{abbr}\b', line, re.IGNORECASE):
-                        abbr_meanings = {
-                            "QD": "once daily",
-                            "BID": "twice daily",
-                            "TID": "three times daily",
-                            "QID": "four times daily"
-                        }
                         if not instructions:
-                            instructions = abbr_meanings.get(abbr.upper(), abbr)
+                            instructions = FREQUENCY_ABBREVIATIONS.get(abbr.upper(), abbr)
                         elif abbr.upper() not in instructions.upper():
-                            instructions += f" ({abbr_meanings.get(abbr.upper(), abbr)})"
+                            instructions += f" ({FREQUENCY_ABBREVIATIONS.get(abbr.upper(), abbr)})"
                 
                 # Create medication object
                 medication = {
@@ -203,26 +335,37 @@ def extract_structured_medications(text: str) -> list:
                 
                 medications.append(medication)
     
-    # If no structured medications found, try fallback method
+    # If no structured medications found, anchor on formulary names found by the dictionary scanner
+    if not medications:
+        for mention in context.raw_mentions("MEDICATION"):
+            if any(med["name"] == mention.term for med in medications):
+                continue
+            # Dosage and abbreviations are read from the rest of the mention's line
+            line_rest = text[mention.end:context.line_end(mention.end)]
+            dosage_match = dosage_pattern.search(line_rest)
+            abbr = next((abbr for abbr in FREQUENCY_ABBREVIATIONS
+                         if re.search(rf'\b{abbr}\b', line_rest, re.IGNORECASE)), None)
+            medications.append({
+                "name": mention.term,
+                "dosage": dosage_match.group(0) if dosage_match else "",
+                "instructions": FREQUENCY_ABBREVIATIONS[abbr] if abbr else ""
+            })
+
+    # Drugs missing from the formulary: fall back to NER entities
     if not medications:
-        for entity in doc.ents:
+        for entity in context.doc.ents:
             if entity.label_ in ["CHEMICAL", "ORG", "PRODUCT"]:  # These labels often catch medication names
-                # Try to find dosage near this entity
-                context = text[max(0, entity.start_char-50):min(len(text), entity.end_char+50)]
-                dosage_match = dosage_pattern.search(context)
+                # Try to find dosage near this entity (the Doc is of the collapsed text)
+                start, end = context.raw_offset(entity.start_char), context.raw_offset(entity.end_char - 1) + 1
+                window = text[max(0, start-50):min(len(text), end+50)]
+                dosage_match = dosage_pattern.search(window)
                 dosage = dosage_match.group(0) if dosage_match else ""
                 
                 # Look for frequency abbreviations
                 instructions = ""
                 for abbr in ["QD", "BID", "TID", "QID"]:
-                    if re.search(rf'\b{abbr}\b', context, re.IGNORECASE):
-                        abbr_meanings = {
-                            "QD": "once daily",
-                            "BID": "twice daily",
-                            "TID": "three times daily",
-                            "QID": "four times daily"
-                        }
-                        instructions = abbr_meanings.get(abbr.upper(), abbr)
+                    if re.search(rf'\b{abbr}\b', window, re.IGNORECASE):
+                        instructions = FREQUENCY_ABBREVIATIONS.get(abbr.upper(), abbr)
                         break
                 
                 # Create medication object with limited info
@@ -234,4 +377,4 @@ def extract_structured_medications(text: str) -> list:
                 
                 medications.append(medication)
     
-    return medications
\ No newline at end of file
+    return to_medications(medications)
\ No newline at end of file
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# Make the application modules importable when run from any directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Settings are read at import time: keep the caches out of the working tree and the LLM offline
+os.environ.setdefault("CACHE_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="prescription_tests_"), "cache.db"))
+os.environ.setdefault("LLM_PROVIDER", "fake")
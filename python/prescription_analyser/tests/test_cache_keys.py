@@ -0,0 +1,84 @@
+import pytest
+from config import settings
+from db.formulary import Formulary
+from services import pipeline
+from services.llm_client import LLM_CLIENT
+from services.llm_providers import LLMProvider
+from utils.upload import IngestedUpload
+
+UPLOAD = IngestedUpload("rx.png", 3, "0" * 64, data=b"abc")
+
+
+def keys():
+    return pipeline.result_cache_key(UPLOAD, "balanced", "two_pass"), pipeline.text_cache_key("Paracetamol 500 mg", "two_pass")
+
+
+def test_keys_are_stable():
+    assert keys() == keys()
+
+
+def test_keys_depend_on_their_inputs():
+    result_key, text_key = keys()
+    assert pipeline.result_cache_key(UPLOAD, "fast", "two_pass") != result_key
+    assert pipeline.result_cache_key(UPLOAD, "balanced", "single_pass") != result_key
+    other_upload = IngestedUpload("rx.png", 3, "1" * 64, data=b"abd")
+    assert pipeline.result_cache_key(other_upload, "balanced", "two_pass") != result_key
+    assert pipeline.text_cache_key("Paracetamol 650 mg", "two_pass") != text_key
+
+
+def test_keys_depend_on_the_llm_provider(monkeypatch):
+    before = keys()
+
+    class OtherProvider(LLMProvider):
+        name = "other"
+
+    monkeypatch.setattr(LLM_CLIENT, "provider", OtherProvider())
+    after = keys()
+    assert after[0] != before[0] and after[1] != before[1]
+
+
+def test_keys_depend_on_the_models(monkeypatch):
+    before = keys()
+    monkeypatch.setattr(pipeline, "EXTRACTION_MODEL", "another-model")
+    after = keys()
+    assert after[0] != before[0] and after[1] != before[1]
+
+
+def test_keys_depend_on_the_formulary(monkeypatch):
+    before = keys()
+    monkeypatch.setattr(Formulary, "checksum", property(lambda self: "f" * 64))
+    after = keys()
+    assert after[0] != before[0] and after[1] != before[1]
+
+
+def test_keys_depend_on_the_pipeline_version(monkeypatch):
+    before = keys()
+    monkeypatch.setattr(pipeline, "PIPELINE_VERSION", pipeline.PIPELINE_VERSION + "-next")
+    after = keys()
+    assert after[0] != before[0] and after[1] != before[1]
+
+
+@pytest.mark.parametrize("name, value", [
+    ("enable_ai_correction", not settings.enable_ai_correction),
+    ("max_text_chars", settings.max_text_chars + 1),
+    ("correction_gate_enabled", not settings.correction_gate_enabled),
+    ("correction_gate_mean_confidence", settings.correction_gate_mean_confidence + 1),
+])
+def test_keys_depend_on_text_stage_settings(monkeypatch, name, value):
+    before = keys()
+    monkeypatch.setattr(settings, name, value)
+    after = keys()
+    assert after[0] != before[0] and after[1] != before[1]
+
+
+@pytest.mark.parametrize("name, value", [
+    ("ocr_config", settings.ocr_config + " -c preserve_interword_spaces=1"),
+    ("layout_analysis", not settings.layout_analysis),
+    ("layout_detect_orientation", not settings.layout_detect_orientation),
+])
+def test_result_key_depends_on_ocr_settings(monkeypatch, name, value):
+    result_key, text_key = keys()
+    monkeypatch.setattr(settings, name, value)
+    new_result_key, new_text_key = keys()
+    assert new_result_key != result_key
+    assert new_text_key == text_key  # Text analyses never run OCR
@@ -0,0 +1,106 @@
+import asyncio
+import time
+import pytest
+from services.llm_client import LLMClient
+from services.llm_providers import LLMProvider
+from utils.resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, deadline_scope, time_remaining
+
+
+class SlowProvider(LLMProvider):
+    """Replies after ``delay`` seconds, recording the deadline each call saw."""
+    name = "slow"
+
+    def __init__(self, delay: float = 0.0, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.remaining_seen = []
+
+    async def chat(self, model, messages, **kwargs):
+        self.calls += 1
+        self.remaining_seen.append(time_remaining())
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return "reply"
+
+
+def make_client(provider, timeout_seconds=1.0, failure_threshold=2):
+    return LLMClient(
+        provider, max_concurrency=4, timeout_seconds=timeout_seconds, retry_base_delay=0.001,
+        breaker=CircuitBreaker(provider.name, failure_threshold=failure_threshold, reset_seconds=60.0),
+    )
+
+
+def test_deadline_timeout_is_not_an_upstream_failure():
+    client = make_client(SlowProvider(delay=0.5))
+
+    async def run():
+        with deadline_scope(time.monotonic() + 0.05):
+            await client.chat("model", [], max_retries=3)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+    assert client.breaker.stats() == {"state": "closed", "consecutive_failures": 0}
+    assert client.provider.calls == 1
+
+
+def test_provider_timeout_opens_the_breaker():
+    client = make_client(SlowProvider(delay=0.5), timeout_seconds=0.02, failure_threshold=2)
+    with pytest.raises(asyncio.TimeoutError) as excinfo:
+        asyncio.run(client.chat("model", [], max_retries=2))
+    assert not isinstance(excinfo.value, DeadlineExceeded)
+    assert client.breaker.state == "open"
+
+    # Once open, calls are refused without reaching the provider
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(client.chat("model", [], max_retries=2))
+    assert client.provider.calls == 2
+
+
+def test_provider_errors_are_failures_and_success_resets():
+    provider = SlowProvider(error=RuntimeError("upstream down"))
+    client = make_client(provider, failure_threshold=5)
+    with pytest.raises(RuntimeError):
+        asyncio.run(client.chat("model", [], max_retries=2))
+    assert client.breaker.stats()["consecutive_failures"] == 2
+
+    provider.error = None
+    assert asyncio.run(client.chat("model", [])) == "reply"
+    assert client.breaker.stats()["consecutive_failures"] == 0
+
+
+def test_expired_deadline_skips_the_provider():
+    client = make_client(SlowProvider())
+
+    async def run():
+        with deadline_scope(time.monotonic() - 1):
+            await client.chat("model", [])
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+    assert client.provider.calls == 0
+
+
+def test_coalesced_call_outlives_the_first_callers_deadline():
+    provider = SlowProvider(delay=0.2)
+    client = make_client(provider)
+
+    async def caller(deadline):
+        with deadline_scope(deadline):
+            return await client.complete("model", "system", "{text}", "Paracetamo1 500 mg")
+
+    async def run():
+        first = asyncio.ensure_future(caller(time.monotonic() + 0.05))
+        await asyncio.sleep(0)  # The first caller starts the shared call
+        second = asyncio.ensure_future(caller(None))
+        return await asyncio.gather(first, second, return_exceptions=True)
+
+    first, second = asyncio.run(run())
+    assert isinstance(first, DeadlineExceeded)
+    assert second == "reply"
+    # One upstream call, made without the first caller's deadline, and no breaker failure
+    assert provider.calls == 1
+    assert provider.remaining_seen == [None]
+    assert client.breaker.stats()["consecutive_failures"] == 0
+    assert client.inflight_stats()["coalesced"] == 1
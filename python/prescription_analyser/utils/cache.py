@@ -0,0 +1,144 @@
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+from config import logger
+
+
+def make_cache_key(*parts) -> str:
+    """Build a SHA-256 cache key from bytes/str parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(part)
+        digest.update(b"\x00")  # Separator so ("ab", "c") != ("a", "bc")
+    return digest.hexdigest()
+
+
+class TieredCache:
+    """String cache with an in-memory LRU tier in front of a SQLite disk tier.
+
+    Entries expire after ``ttl_seconds``. The memory tier holds at most ``memory_entries``
+    items; the disk tier is trimmed least-recently-used first once it grows past
+    ``max_disk_mb``. The SQLite file can be shared by several worker processes.
+    """
+
+    def __init__(self, name: str, path: str, ttl_seconds: int, memory_entries: int, max_disk_mb: int):
+        self.name = name
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_mb * 1024 * 1024
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+
+    def _db(self) -> sqlite3.Connection:
+        """Open the SQLite tier on first use (after any worker fork)."""
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.name} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.name}_accessed ON {self.name} (accessed_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, key: str, expires_at: float, value: str):
+        """Insert into the memory tier, evicting the least recently used entry."""
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached value, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.hits["memory"] += 1
+                    return entry[1]
+                del self._memory[key]
+
+            try:
+                db = self._db()
+                row = db.execute(
+                    f"SELECT value, expires_at FROM {self.name} WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    db.execute(f"UPDATE {self.name} SET accessed_at = ? WHERE key = ?", (now, key))
+                    db.commit()
+                    self._remember(key, row[1], row[0])
+                    self.hits["disk"] += 1
+                    return row[0]
+            except sqlite3.Error as e:
+                logger.warning(f"{self.name} disk cache read failed: {e}")
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str):
+        """Store a value in both tiers and enforce the disk tier's limits."""
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            self._remember(key, expires_at, value)
+            try:
+                db = self._db()
+                db.execute(
+                    f"INSERT OR REPLACE INTO {self.name} (key, value, size, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value.encode("utf-8")), expires_at, now)
+                )
+                self._evict(db, now)
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"{self.name} disk cache write failed: {e}")
+
+    def _evict(self, db: sqlite3.Connection, now: float):
+        """Drop expired rows, then least recently used rows until under the size limit."""
+        db.execute(f"DELETE FROM {self.name} WHERE expires_at <= ?", (now,))
+        total = db.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.name}").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+
+        excess = total - self.max_disk_bytes
+        freed = 0
+        stale = []
+        for key, size in db.execute(f"SELECT key, size FROM {self.name} ORDER BY accessed_at"):
+            stale.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        db.executemany(f"DELETE FROM {self.name} WHERE key = ?", stale)
+        logger.debug(f"{self.name} evicted {len(stale)} entries ({freed} bytes)")
+
+    def clear(self):
+        """Remove every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            db = self._db()
+            db.execute(f"DELETE FROM {self.name}")
+            db.commit()
+
+    def stats(self) -> dict:
+        """Hit/miss counters for this process."""
+        return {
+            "memory_hits": self.hits["memory"],
+            "disk_hits": self.hits["disk"],
+            "misses": self.misses,
+            "memory_entries": len(self._memory),
+        }
@@ -1,2 +1,77 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from config import settings
+
 # In-memory job storage (replace with proper database in production)
-JOB_STORE = {}
\ No newline at end of file
+JOB_STORE = {}
+
+# Stage events published by each job, kept so late subscribers can replay them
+JOB_EVENTS: Dict[str, List[Tuple[str, Any]]] = {}
+
+# Events after which a job publishes nothing more
+TERMINAL_EVENTS = ("completed", "failed")
+
+_job_conditions: Dict[str, asyncio.Condition] = {}
+
+
+def _job_finished(job_id: str) -> bool:
+    events = JOB_EVENTS.get(job_id)
+    return bool(events) and events[-1][0] in TERMINAL_EVENTS
+
+
+def _job_condition(job_id: str) -> Optional[asyncio.Condition]:
+    """The condition followers of a running job wait on; None once the job has finished."""
+    if _job_finished(job_id):
+        return None
+    return _job_conditions.setdefault(job_id, asyncio.Condition())
+
+
+def _expire_job(job_id: str):
+    JOB_STORE.pop(job_id, None)
+    JOB_EVENTS.pop(job_id, None)
+    _job_conditions.pop(job_id, None)
+
+
+async def publish_job_event(job_id: str, event: str, data: Any):
+    """Record a stage event for a job and wake everyone following it.
+
+    A job's status and events are dropped ``settings.job_retention_seconds`` after
+    its terminal event.
+    """
+    JOB_EVENTS.setdefault(job_id, []).append((event, data))
+    # Only followers create the condition, so without one nobody is waiting
+    condition = _job_conditions.get(job_id)
+    if condition is not None:
+        async with condition:
+            condition.notify_all()
+    if event in TERMINAL_EVENTS:
+        _job_conditions.pop(job_id, None)
+        asyncio.get_running_loop().call_later(settings.job_retention_seconds, _expire_job, job_id)
+
+
+async def follow_job_events(job_id: str, heartbeat_seconds: float) -> AsyncIterator[Optional[Tuple[str, Any]]]:
+    """Yield a job's events from the start, then live ones until it completes or fails.
+
+    Yields None after ``heartbeat_seconds`` without events so callers can keep the
+    connection alive. Stops early if the job expires while it is being followed.
+    """
+    seen = 0
+    while job_id in JOB_STORE:
+        for event in JOB_EVENTS.get(job_id, [])[seen:]:
+            seen += 1
+            yield event
+            if event[0] in TERMINAL_EVENTS:
+                return
+
+        condition = _job_condition(job_id)
+        if condition is None:
+            continue  # Finished while the last events were being sent; replay the rest
+        timed_out = False
+        async with condition:
+            if len(JOB_EVENTS.get(job_id, [])) == seen:
+                try:
+                    await asyncio.wait_for(condition.wait(), heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    timed_out = True
+        if timed_out:
+            yield None
@@ -0,0 +1,101 @@
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from config import logger
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a request's time budget runs out before a stage can start."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+
+# Absolute time.monotonic() deadline of the request being processed, if any
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+def deadline_after(seconds: Optional[float]) -> Optional[float]:
+    """Absolute deadline ``seconds`` from now (None for no deadline)."""
+    return time.monotonic() + seconds if seconds else None
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[float]):
+    """Make ``deadline`` the current deadline for code (and tasks) started inside the block."""
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_remaining() -> Optional[float]:
+    """Seconds left until the current deadline, or None when there is none."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class CircuitBreaker:
+    """Stop calling a failing dependency for a while.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and ``allow``
+    refuses calls for ``reset_seconds``. Then one trial call is let through
+    (half-open): success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"{self.name} circuit closed")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def release_trial(self):
+        """Free the half-open trial slot when the trial call ended without an outcome (e.g. cancelled)."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            trial_failed = self._trial_running
+            self._trial_running = False
+            if trial_failed or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                logger.warning(f"{self.name} circuit opened after {self._failures} consecutive failures")
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self._failures}
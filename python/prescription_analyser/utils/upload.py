@@ -0,0 +1,103 @@
+import os
+import hashlib
+import tempfile
+from typing import List, Optional, Union
+from config import logger
+
+# Size of each read from the incoming upload
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds the configured size limit."""
+
+
+class IngestedUpload:
+    """An upload read in chunks: kept in memory when small, spooled to a temp file when large.
+
+    ``source`` is what OCR workers receive: the bytes themselves, or the path of the
+    spooled file so large bodies are not pickled through the process pool.
+    """
+
+    def __init__(self, filename: Optional[str], size: int, sha256: str,
+                 data: Optional[bytes] = None, path: Optional[str] = None):
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+        self.data = data
+        self.path = path
+
+    @property
+    def source(self) -> Union[bytes, str]:
+        return self.data if self.data is not None else self.path
+
+    def read_bytes(self) -> bytes:
+        """Return the upload body (reads the spooled file if it was written to disk)."""
+        if self.data is not None:
+            return self.data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def spool(self):
+        """Move an in-memory body to a temp file so several workers can open it by path."""
+        if self.data is None:
+            return
+        with tempfile.NamedTemporaryFile(prefix="prescription_", suffix=".upload", delete=False) as f:
+            f.write(self.data)
+        self.path = f.name
+        self.data = None
+
+    def cleanup(self):
+        """Delete the spooled file, if any."""
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except OSError as e:
+                logger.warning(f"Failed to remove spooled upload {self.path}: {e}")
+            self.path = None
+
+
+def cleanup_uploads(uploads: List[IngestedUpload]):
+    """Delete the spooled files of several uploads; safe to call more than once."""
+    for upload in uploads:
+        upload.cleanup()
+
+
+async def ingest_upload(upload, max_bytes: int, spool_bytes: int) -> IngestedUpload:
+    """Read an UploadFile chunk by chunk, hashing as it goes.
+
+    Aborts with UploadTooLargeError as soon as ``max_bytes`` is exceeded, and moves the
+    body to a temp file once it grows past ``spool_bytes``.
+    """
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    spool = None
+    size = 0
+    try:
+        while True:
+            chunk = await upload.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLargeError(f"Image size exceeds the {max_bytes // (1024 * 1024)}MB limit")
+            digest.update(chunk)
+
+            if spool is None and len(buffer) + len(chunk) > spool_bytes:
+                spool = tempfile.NamedTemporaryFile(prefix="prescription_", suffix=".upload", delete=False)
+                spool.write(buffer)
+                buffer = None
+            if spool is not None:
+                spool.write(chunk)
+            else:
+                buffer += chunk
+    except BaseException:
+        if spool is not None:
+            spool.close()
+            os.unlink(spool.name)
+        raise
+
+    if spool is not None:
+        spool.close()
+        return IngestedUpload(upload.filename, size, digest.hexdigest(), path=spool.name)
+    return IngestedUpload(upload.filename, size, digest.hexdigest(), data=bytes(buffer))
@@ -0,0 +1,37 @@
+"""
+Simulated latency and failures for the offline fake LLM providers.
+
+Shared by the prescription analyser and the chatbot. Both are deployed as flat apps
+rather than packages, so each adds this directory to sys.path before importing it.
+"""
+
+import math
+import random
+import asyncio
+from typing import Optional
+
+
+class FakeProviderError(RuntimeError):
+    """A simulated upstream failure from a fake LLM provider."""
+
+
+class FakeLatency:
+    """Latency and failures of simulated LLM calls.
+
+    Latency is log-normal around ``latency_ms`` (``latency_sigma`` sets the tail) and a
+    ``failure_rate`` share of calls fail after their delay. Both come from a random
+    generator seeded with ``seed``, so a run can be repeated exactly.
+    """
+
+    def __init__(self, latency_ms: float, latency_sigma: float, failure_rate: float, seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+
+    async def wait(self, target: str):
+        """Sleep for one simulated call to ``target``, then raise FakeProviderError if it fails."""
+        if self.latency_ms > 0:
+            await asyncio.sleep(self._random.lognormvariate(math.log(self.latency_ms / 1000), self.latency_sigma))
+        if self._random.random() < self.failure_rate:
+            raise FakeProviderError(f"Simulated failure calling {target}")